@@ -5,130 +5,185 @@ Import ZNC logs into encrypted SQLite database
 This script scans the ZNC log directory structure and imports all logs
 into an encrypted SQLite database for faster searching.
 
+Every ZNC user under <ZNC_DATA_PATH>/users is discovered automatically,
+with logs written by the log module loaded as a network, user or global
+module. Users are imported concurrently, and every line is tagged with
+the ZNC user it belongs to.
+
 Usage:
-    python3 import_logs.py [--incremental]
-    
+    python3 import_logs.py [--incremental] [--user USER] [--network NETWORK] [--workers N]
+
 Options:
     --incremental   Only import logs newer than the last import date
+    --user          Only import a single ZNC user
+    --network       Only import a single network
+    --workers       Number of users imported in parallel
+
+Compressed archives (.log.gz, .log.xz, .log.zst) are imported alongside
+plain .log files and are decompressed on the fly.
 """
 
 import os
+import io
 import sys
+import gzip
+import lzma
+import threading
 from datetime import datetime
-from pysqlcipher3 import dbapi2 as sqlite
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
 
-# Configuration - should match app.py
-ZNC_BASE_PATH = '/path/to/.znc/users/username/networks'
-DB_PATH = '/path/to/znc_search/znc_logs.db'
-DB_KEY = 'secret_key'  # Must match app.py
+import storage
+import fuzzy
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configuration - database path and encryption key are set in storage.py
+ZNC_DATA_PATH = '/path/to/.znc'  # ZNC data directory (contains users/ and moddata/)
 
 # Network display name mapping (should match app.py)
 NETWORK_NAMES = {}
 
+# Log file suffixes picked up by the importer. Compressed archives are
+# decompressed on the fly; .zst requires the optional 'zstandard' package.
+LOG_EXTENSIONS = ('.log', '.log.gz', '.log.xz', '.log.zst')
+
+# Number of lines buffered before each executemany() call
+IMPORT_BATCH_SIZE = 5000
+
+# Number of ZNC users imported in parallel (overridable with --workers)
+IMPORT_WORKERS = 4
+
+# Refresh query planner statistics once an import adds at least this many
+# lines; ANALYZE samples at most ANALYSIS_LIMIT rows per index
+OPTIMIZE_MIN_LINES = 100000
+ANALYSIS_LIMIT = 1000
+
+# Serializes progress output from concurrent workers
+_print_lock = threading.Lock()
+
+def log(znc_user, message):
+    """Print a progress line prefixed with the ZNC user being imported"""
+    with _print_lock:
+        print(f"[{znc_user}] {message}", flush=True)
+
 def get_db():
     """Get database connection with encryption"""
-    conn = sqlite.connect(DB_PATH)
-    conn.execute(f"PRAGMA key = '{DB_KEY}'")
-    conn.execute("PRAGMA cipher_compatibility = 4")
-    return conn
-
-def init_db():
-    """Initialize the database schema"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS networks (
-            id TEXT PRIMARY KEY,
-            display_name TEXT NOT NULL
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS channels (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            network_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            FOREIGN KEY (network_id) REFERENCES networks(id),
-            UNIQUE(network_id, name)
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS log_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            network_id TEXT NOT NULL,
-            channel_name TEXT NOT NULL,
-            log_date DATE NOT NULL,
-            line_number INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            FOREIGN KEY (network_id) REFERENCES networks(id)
-        )
-    ''')
-    
-    # Create indexes for efficient searching
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_network 
-        ON log_entries(network_id)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_channel 
-        ON log_entries(channel_name)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_date 
-        ON log_entries(log_date)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_content 
-        ON log_entries(content)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_composite 
-        ON log_entries(network_id, channel_name, log_date)
-    ''')
-    
-    # Create import tracking table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS import_metadata (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    return storage.get_db('bulk-import')
 
-def get_last_import_date(conn):
-    """Get the date of the last import"""
+def get_last_import_date(conn, znc_user=None):
+    """Get the date of the last import (per ZNC user, falling back to the global one)"""
     cursor = conn.cursor()
-    cursor.execute('SELECT value FROM import_metadata WHERE key = ?', ('last_import_date',))
-    row = cursor.fetchone()
-    if row:
-        try:
-            return datetime.fromisoformat(row[0])
-        except ValueError:
-            return None
+    keys = ['last_import_date']
+    if znc_user:
+        keys.insert(0, f'last_import_date:{znc_user}')
+    
+    for key in keys:
+        cursor.execute('SELECT value FROM import_metadata WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        if row:
+            try:
+                return datetime.fromisoformat(row[0])
+            except ValueError:
+                return None
     return None
 
-def set_last_import_date(conn, date):
+def set_last_import_date(conn, date, znc_user=None):
     """Set the last import date"""
+    key = f'last_import_date:{znc_user}' if znc_user else 'last_import_date'
     cursor = conn.cursor()
     cursor.execute('''
         INSERT OR REPLACE INTO import_metadata (key, value) 
         VALUES (?, ?)
-    ''', ('last_import_date', date.isoformat()))
+    ''', (key, date.isoformat()))
     conn.commit()
 
+def get_prune_cutoff(conn, network_id):
+    """Get the date before which db_utils.py prune removed this network's logs"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT MAX(value) FROM import_metadata WHERE key IN (?, ?)
+    ''', ('prune_before', f'prune_before:{network_id}'))
+    row = cursor.fetchone()
+    if row and row[0]:
+        return datetime.strptime(row[0], '%Y-%m-%d')
+    return None
+
+def discover_log_sources(znc_path):
+    """
+    Find every log directory in a ZNC data directory.
+    
+    The log module stores files in a different place depending on where it
+    is loaded:
+        network module: users/<user>/networks/<network>/moddata/log/<channel>/
+        user module:    users/<user>/moddata/log/<network>/<channel>/
+        global module:  moddata/log/<user>/<network>/<channel>/
+    
+    Returns {znc_user: {network_id: [log_base, ...]}} where each log_base
+    holds one directory per channel or query.
+    """
+    sources = {}
+    
+    def add(znc_user, network_id, log_base):
+        if os.path.isdir(log_base):
+            sources.setdefault(znc_user, {}).setdefault(network_id, []).append(log_base)
+    
+    def subdirs(path):
+        if not os.path.isdir(path):
+            return []
+        return sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+    
+    users_path = os.path.join(znc_path, 'users')
+    for znc_user in subdirs(users_path):
+        user_path = os.path.join(users_path, znc_user)
+        
+        # Network-level log module
+        networks_path = os.path.join(user_path, 'networks')
+        for network_id in subdirs(networks_path):
+            add(znc_user, network_id, os.path.join(networks_path, network_id, 'moddata', 'log'))
+        
+        # User-level log module
+        user_log_path = os.path.join(user_path, 'moddata', 'log')
+        for network_id in subdirs(user_log_path):
+            add(znc_user, network_id, os.path.join(user_log_path, network_id))
+    
+    # Global log module
+    global_log_path = os.path.join(znc_path, 'moddata', 'log')
+    for znc_user in subdirs(global_log_path):
+        for network_id in subdirs(os.path.join(global_log_path, znc_user)):
+            add(znc_user, network_id, os.path.join(global_log_path, znc_user, network_id))
+    
+    return sources
+
+def strip_log_extension(filename):
+    """Return filename without its log/compression suffix, or None if not a log"""
+    for ext in sorted(LOG_EXTENSIONS, key=len, reverse=True):
+        if filename.endswith(ext):
+            return filename[:-len(ext)]
+    return None
+
+def open_log_file(file_path):
+    """Open a (possibly compressed) log file as a streaming text reader"""
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', encoding='utf-8', errors='ignore')
+    if file_path.endswith('.xz'):
+        return lzma.open(file_path, 'rt', encoding='utf-8', errors='ignore')
+    if file_path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("zstandard module not installed (pip install zstandard)")
+        raw = open(file_path, 'rb')
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8', errors='ignore')
+    return open(file_path, 'r', encoding='utf-8', errors='ignore')
+
 def parse_log_date(filename):
-    """Parse date from log filename"""
-    date_str = filename.replace('.log', '')
+    """Parse date from log filename (plain or compressed)"""
+    date_str = strip_log_extension(filename)
+    if date_str is None:
+        return None
     
     # Try format with dashes first (2025-12-04)
     try:
@@ -145,8 +200,41 @@ def parse_log_date(filename):
     
     return None
 
-def import_network(conn, network_id, incremental=False, last_import_date=None):
-    """Import logs for a single network"""
+def import_log_file(cursor, file_path, znc_user, network_id, channel_name, log_date):
+    """Stream one log file into log_entries, returns number of lines imported"""
+    insert_sql = '''
+        INSERT INTO log_entries 
+        (network_id, channel_name, log_date, line_number, content, znc_user)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    
+    imported = 0
+    entries = []
+    with open_log_file(file_path) as f:
+        for line_num, line in enumerate(f, 1):
+            entries.append((
+                network_id,
+                channel_name,
+                log_date,
+                line_num,
+                line.rstrip(),
+                znc_user
+            ))
+            
+            # Batch insert for better performance
+            if len(entries) >= IMPORT_BATCH_SIZE:
+                cursor.executemany(insert_sql, entries)
+                imported += len(entries)
+                entries = []
+    
+    if entries:
+        cursor.executemany(insert_sql, entries)
+        imported += len(entries)
+    
+    return imported
+
+def import_network(conn, znc_user, network_id, log_bases, incremental=False, last_import_date=None):
+    """Import logs for a single network of one ZNC user"""
     cursor = conn.cursor()
     
     # Get or create network entry
@@ -155,98 +243,156 @@ def import_network(conn, network_id, incremental=False, last_import_date=None):
         INSERT OR REPLACE INTO networks (id, display_name) 
         VALUES (?, ?)
     ''', (network_id, display_name))
+    conn.commit()
     
-    log_base = os.path.join(ZNC_BASE_PATH, network_id, 'moddata/log')
-    
-    if not os.path.exists(log_base):
-        print(f"  ⚠ Log directory not found: {log_base}")
-        return 0
+    # Days removed by a retention prune are not imported again
+    prune_cutoff = get_prune_cutoff(conn, network_id)
     
     total_imported = 0
     
-    # Iterate through channels
-    for channel_name in os.listdir(log_base):
-        channel_path = os.path.join(log_base, channel_name)
-        
-        if not os.path.isdir(channel_path):
-            continue
-        
-        print(f"  Processing channel: {channel_name}")
-        
-        # Get or create channel entry
-        cursor.execute('''
-            INSERT OR IGNORE INTO channels (network_id, name) 
-            VALUES (?, ?)
-        ''', (network_id, channel_name))
-        
-        # Process log files in this channel
-        log_files = sorted([f for f in os.listdir(channel_path) if f.endswith('.log')])
-        
-        for log_file in log_files:
-            log_date = parse_log_date(log_file)
-            
-            if not log_date:
-                print(f"    ⚠ Skipping file with unparseable date: {log_file}")
-                continue
+    # Several log module layouts may hold the same channel; a day is only
+    # imported from the first one that has it
+    seen_dates = set()
+    
+    for log_base in log_bases:
+        # Iterate through channels
+        for channel_name in sorted(os.listdir(log_base)):
+            channel_path = os.path.join(log_base, channel_name)
             
-            # Skip if incremental and file is older than last import
-            if incremental and last_import_date and log_date < last_import_date:
+            if not os.path.isdir(channel_path):
                 continue
             
-            file_path = os.path.join(channel_path, log_file)
+            log(znc_user, f"  {network_id}: processing channel {channel_name}")
             
-            # Check if this file has already been imported
+            # Get or create channel entry
             cursor.execute('''
-                SELECT COUNT(*) FROM log_entries 
-                WHERE network_id = ? 
-                AND channel_name = ? 
-                AND log_date = ?
-            ''', (network_id, channel_name, log_date.strftime('%Y-%m-%d')))
-            
-            existing_count = cursor.fetchone()[0]
+                INSERT OR IGNORE INTO channels (network_id, name) 
+                VALUES (?, ?)
+            ''', (network_id, channel_name))
+            conn.commit()
             
-            if existing_count > 0 and incremental:
-                continue
+            # Process log files in this channel
+            log_files = sorted([f for f in os.listdir(channel_path)
+                                if strip_log_extension(f) is not None])
             
-            # Delete existing entries for this file (for full re-import)
-            if not incremental:
+            for log_file in log_files:
+                log_date = parse_log_date(log_file)
+                
+                if not log_date:
+                    log(znc_user, f"    ⚠ Skipping file with unparseable date: {log_file}")
+                    continue
+                
+                # A day may exist both as .log and as an archived copy; the
+                # plain file sorts first and wins
+                if (channel_name, log_date) in seen_dates:
+                    log(znc_user, f"    ⚠ Skipping duplicate log for {log_date.strftime('%Y-%m-%d')}: {log_file}")
+                    continue
+                seen_dates.add((channel_name, log_date))
+                
+                # Skip if incremental and file is older than last import
+                if incremental and last_import_date and log_date < last_import_date:
+                    continue
+                
+                if prune_cutoff and log_date < prune_cutoff:
+                    continue
+                
+                file_path = os.path.join(channel_path, log_file)
+                day_key = (network_id, channel_name, log_date.strftime('%Y-%m-%d'))
+                
+                # Check if this file has already been imported. Rows imported
+                # before lines were tagged with a ZNC user have an empty tag.
                 cursor.execute('''
-                    DELETE FROM log_entries 
+                    SELECT COUNT(*) FROM log_entries 
                     WHERE network_id = ? 
                     AND channel_name = ? 
                     AND log_date = ?
-                ''', (network_id, channel_name, log_date.strftime('%Y-%m-%d')))
-            
-            # Import the file
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    lines = f.readlines()
+                    AND znc_user IN (?, '')
+                ''', day_key + (znc_user,))
                 
-                # Batch insert for better performance
-                entries = []
-                for line_num, line in enumerate(lines, 1):
-                    entries.append((
-                        network_id,
-                        channel_name,
-                        log_date.strftime('%Y-%m-%d'),
-                        line_num,
-                        line.rstrip()
-                    ))
+                existing_count = cursor.fetchone()[0]
                 
-                cursor.executemany('''
-                    INSERT INTO log_entries 
-                    (network_id, channel_name, log_date, line_number, content)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', entries)
+                if existing_count > 0 and incremental:
+                    continue
                 
-                total_imported += len(entries)
-                print(f"    ✓ {log_file}: {len(entries)} lines")
+                # Delete existing entries for this file (for full re-import)
+                if not incremental:
+                    cursor.execute('''
+                        DELETE FROM log_entries 
+                        WHERE network_id = ? 
+                        AND channel_name = ? 
+                        AND log_date = ?
+                        AND znc_user IN (?, '')
+                    ''', day_key + (znc_user,))
                 
-            except Exception as e:
-                print(f"    ✗ Error reading {log_file}: {e}")
-                continue
+                # Import the file, streaming it in batches so compressed
+                # archives are never inflated into memory as a whole
+                try:
+                    file_lines = import_log_file(cursor, file_path, znc_user, *day_key)
+                    
+                    total_imported += file_lines
+                    log(znc_user, f"    ✓ {log_file}: {file_lines} lines")
+                
+                except Exception as e:
+                    # Drop any batches already inserted from a truncated or corrupt archive
+                    cursor.execute('''
+                        DELETE FROM log_entries 
+                        WHERE network_id = ? 
+                        AND channel_name = ? 
+                        AND log_date = ?
+                        AND znc_user = ?
+                    ''', day_key + (znc_user,))
+                    log(znc_user, f"    ✗ Error reading {log_file}: {e}")
+                
+                # Commit per file so concurrent workers only wait for one file's write
+                conn.commit()
     
+    return total_imported
+
+def optimize_db(conn):
+    """Refresh query planner statistics after a large import"""
+    conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        # Re-analyzes only the tables that grew enough for the plans to change
+        conn.execute('PRAGMA optimize = 0x10002')
+    else:
+        # PRAGMA optimize never gathers the first statistics
+        conn.execute('ANALYZE')
     conn.commit()
+
+def import_user(znc_user, networks, incremental=False, all_networks=True):
+    """Import every network of one ZNC user on its own connection"""
+    conn = get_db()
+    
+    try:
+        conn.execute('INSERT OR IGNORE INTO znc_users (name) VALUES (?)', (znc_user,))
+        conn.commit()
+        
+        # Get last import date for incremental imports
+        last_import_date = None
+        if incremental:
+            last_import_date = get_last_import_date(conn, znc_user)
+            if last_import_date:
+                log(znc_user, f"Incremental import: only importing logs after {last_import_date.strftime('%Y-%m-%d')}")
+            else:
+                log(znc_user, "No previous import found, performing full import...")
+        
+        started = datetime.now()
+        total_imported = 0
+        for network_id in sorted(networks):
+            log(znc_user, f"Importing network: {network_id}")
+            count = import_network(conn, znc_user, network_id, networks[network_id],
+                                   incremental, last_import_date)
+            total_imported += count
+            log(znc_user, f"  {network_id}: {count:,} lines imported")
+        
+        # With --network, the user's other networks were not imported, and a
+        # later --incremental run must still read their older files
+        if all_networks:
+            set_last_import_date(conn, started, znc_user)
+    finally:
+        conn.close()
+    
     return total_imported
 
 def main():
@@ -255,56 +401,90 @@ def main():
                        help='Only import new logs since last import')
     parser.add_argument('--network', type=str, 
                        help='Import only specific network')
+    parser.add_argument('--user', type=str,
+                       help='Import only specific ZNC user')
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS,
+                       help=f'Number of ZNC users imported in parallel (default: {IMPORT_WORKERS})')
     args = parser.parse_args()
     
-    # Check if ZNC base path exists
-    if not os.path.exists(ZNC_BASE_PATH):
-        print(f"Error: ZNC base path not found: {ZNC_BASE_PATH}")
-        print("Please update ZNC_BASE_PATH in this script.")
+    # Check if ZNC data path exists
+    if not os.path.exists(ZNC_DATA_PATH):
+        print(f"Error: ZNC data path not found: {ZNC_DATA_PATH}")
+        print("Please update ZNC_DATA_PATH in this script.")
         sys.exit(1)
     
     # Initialize database if needed
-    if not os.path.exists(DB_PATH):
+    if not os.path.exists(storage.DB_PATH):
         print("Initializing new encrypted database...")
-        init_db()
     
-    # Connect to database
+    # Connect to database, creating or upgrading the schema
     conn = get_db()
+    storage.init_db(conn)
     
-    # Get last import date for incremental imports
-    last_import_date = None
-    if args.incremental:
-        last_import_date = get_last_import_date(conn)
-        if last_import_date:
-            print(f"Incremental import: only importing logs after {last_import_date.strftime('%Y-%m-%d')}")
-        else:
-            print("No previous import found, performing full import...")
-    
-    print(f"\nScanning ZNC logs from: {ZNC_BASE_PATH}")
+    print(f"\nScanning ZNC logs from: {ZNC_DATA_PATH}")
     print("=" * 70)
     
-    # Get list of networks
-    networks = []
+    # Discover users and their networks
+    sources = discover_log_sources(ZNC_DATA_PATH)
+    
+    if args.user:
+        if args.user not in sources:
+            print(f"Error: ZNC user '{args.user}' not found")
+            sys.exit(1)
+        sources = {args.user: sources[args.user]}
+    
     if args.network:
-        if os.path.exists(os.path.join(ZNC_BASE_PATH, args.network)):
-            networks = [args.network]
-        else:
+        sources = {znc_user: {args.network: networks[args.network]}
+                   for znc_user, networks in sources.items()
+                   if args.network in networks}
+        if not sources:
             print(f"Error: Network '{args.network}' not found")
             sys.exit(1)
-    else:
-        networks = [d for d in os.listdir(ZNC_BASE_PATH) 
-                   if os.path.isdir(os.path.join(ZNC_BASE_PATH, d))]
     
-    # Import each network
+    if not sources:
+        print("No ZNC log directories found.")
+        sys.exit(1)
+    
+    workers = max(1, min(args.workers, len(sources)))
+    print(f"Found {len(sources)} ZNC user(s), importing with {workers} worker(s)")
+    
+    # Import each user concurrently; SQLite serializes the writes while
+    # file reading and decompression overlap
     total_imported = 0
-    for network_id in sorted(networks):
-        print(f"\nImporting network: {network_id}")
-        count = import_network(conn, network_id, args.incremental, last_import_date)
-        total_imported += count
-        print(f"  Total lines imported: {count:,}")
+    failed_users = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(import_user, znc_user, networks, args.incremental,
+                                   all_networks=not args.network): znc_user
+                   for znc_user, networks in sorted(sources.items())}
+        
+        for future in as_completed(futures):
+            znc_user = futures[future]
+            try:
+                count = future.result()
+                total_imported += count
+                log(znc_user, f"Done: {count:,} lines imported")
+            except Exception as e:
+                failed_users.append(znc_user)
+                log(znc_user, f"✗ Import failed: {e}")
+    
+    # Tell the web app that its cached statistics and lists are out of date;
+    # a failed user may still have committed some batches
+    if total_imported or failed_users:
+        storage.bump_generation()
     
     # Update last import date
-    set_last_import_date(conn, datetime.now())
+    if not args.user and not args.network and not failed_users:
+        set_last_import_date(conn, datetime.now())
+    
+    if total_imported >= OPTIMIZE_MIN_LINES:
+        print("\nUpdating query planner statistics...")
+        optimize_db(conn)
+    
+    # Keep the fuzzy search dictionary current once it has been built
+    if total_imported and fuzzy.terms_built(conn):
+        print("\nUpdating term dictionary...")
+        lines, indexed = fuzzy.build_terms(conn)
+        print(f"✓ {lines:,} lines read, {indexed:,} new searchable words")
     
     # Get final statistics
     cursor = conn.cursor()
@@ -326,9 +506,12 @@ def main():
     print("Import complete!")
     print(f"  New lines imported: {total_imported:,}")
     print(f"  Total lines in database: {total_entries:,}")
+    print(f"  ZNC users: {len(sources)}")
     print(f"  Networks: {network_count}")
     print(f"  Channels: {channel_count}")
     print(f"  Date range: {date_range[0]} to {date_range[1]}")
+    if failed_users:
+        print(f"  ⚠ Failed users: {', '.join(sorted(failed_users))}")
     print("\nDatabase encrypted and ready to use.")
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Admission control for expensive searches
+
+A search is classified as light or heavy by how much of the log it has to
+scan. Heavy searches need one of HEAVY_SEARCH_SLOTS slots to run, shared by
+all gunicorn workers through lock files in ADMISSION_DIR. A heavy search
+that finds every slot taken waits in one of HEAVY_QUEUE_SLOTS queue places
+for up to ADMISSION_QUEUE_SECONDS; when the queue is full as well it is
+rejected at once. This way heavy searches never hold more than
+HEAVY_SEARCH_SLOTS + HEAVY_QUEUE_SLOTS workers, and the rest stay free for
+light searches and the login page.
+
+Every search also runs with a time budget: a SQLite progress handler
+interrupts the query once the budget of its class is used up.
+"""
+
+import os
+import time
+import fcntl
+from datetime import datetime
+
+from query_language import parse_query, query_scope
+
+# Directory for slot lock files (relative to the working directory)
+ADMISSION_DIR = 'admission'
+
+# Heavy searches running at once, across all workers. Keep this below the
+# number of gunicorn workers (-w in the service file).
+HEAVY_SEARCH_SLOTS = 2
+
+# Heavy searches that may wait for a slot, and for how many seconds
+HEAVY_QUEUE_SLOTS = 1
+ADMISSION_QUEUE_SECONDS = 5
+
+# A search is heavy unless it is limited to one channel or to at most
+# LIGHT_SCAN_DAYS days; a query whose longest word is shorter than
+# SHORT_QUERY_LENGTH matches so many lines that it is heavy unless limited
+# to one channel and the date range
+LIGHT_SCAN_DAYS = 31
+SHORT_QUERY_LENGTH = 3
+
+# Seconds a search may run before it is interrupted, per class; below the
+# gunicorn worker timeout (30 seconds unless --timeout is set)
+SEARCH_TIME_BUDGETS = {
+    'light': 10,
+    'heavy': 20,
+}
+
+# SQLite virtual machine instructions between two checks of the budget
+PROGRESS_INTERVAL = 10000
+
+def scan_days(start_date, end_date):
+    """Days covered by a date range, None when it is open on either side"""
+    if not start_date or not end_date:
+        return None
+    try:
+        days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+    except ValueError:
+        return None
+    return max(days, 0)
+
+def estimate_cost(query, channel='', start_date=None, end_date=None):
+    """Classify a search as 'light' or 'heavy' by how much of the log it scans"""
+    # chan: and date: terms of the query narrow the scan like the filters do
+    scope = query_scope(parse_query(query))
+    channel = channel or scope['channel']
+    start_date = max(filter(None, (start_date, scope['start_date'])), default=None)
+    end_date = min(filter(None, (end_date, scope['end_date'])), default=None)
+    
+    days = scan_days(start_date, end_date)
+    short_range = days is not None and days <= LIGHT_SCAN_DAYS
+    
+    if scope['term_length'] < SHORT_QUERY_LENGTH:
+        return 'light' if channel and short_range else 'heavy'
+    return 'light' if channel or short_range else 'heavy'
+
+def try_lock(name, count):
+    """Take the first free lock file of a group, returns its open file or None"""
+    os.makedirs(ADMISSION_DIR, exist_ok=True)
+    for slot in range(count):
+        f = open(os.path.join(ADMISSION_DIR, f'{name}-{slot}.lock'), 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except BlockingIOError:
+            f.close()
+    return None
+
+def acquire(cost):
+    """
+    Admit a search of the given cost.
+    
+    Returns (slot, outcome): outcome is 'admitted', 'queued' (admitted after
+    waiting) or 'rejected'. slot is passed to release() once the search is
+    done.
+    """
+    if cost != 'heavy':
+        return None, 'admitted'
+    
+    slot = try_lock('heavy', HEAVY_SEARCH_SLOTS)
+    if slot:
+        return slot, 'admitted'
+    
+    # The lock is released automatically if the worker dies while queued
+    place = try_lock('queue', HEAVY_QUEUE_SLOTS)
+    if not place:
+        return None, 'rejected'
+    try:
+        deadline = time.monotonic() + ADMISSION_QUEUE_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            slot = try_lock('heavy', HEAVY_SEARCH_SLOTS)
+            if slot:
+                return slot, 'queued'
+    finally:
+        place.close()
+    return None, 'rejected'
+
+def release(slot):
+    """Give back a slot returned by acquire()"""
+    if slot:
+        slot.close()
+
+def set_time_budget(conn, cost):
+    """Interrupt queries on conn once the time budget of cost is used up"""
+    deadline = time.monotonic() + SEARCH_TIME_BUDGETS[cost]
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_INTERVAL)
@@ -1,111 +1,116 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, g, Response, make_response
 from flask_cors import CORS
 import os
+import json
+import time
+import gzip
+import zlib
 import hashlib
-from datetime import datetime
+import hmac
+import pstats
+import cProfile
+from datetime import datetime, timezone
 from functools import wraps
-from pysqlcipher3 import dbapi2 as sqlite
 import pyotp
 import qrcode
 import io
 import base64
+from pysqlcipher3 import dbapi2 as sqlite
+import storage
+import metrics
+import admission
+import jobs
+import fuzzy
+from queries import (SEARCH_LIMIT, NETWORKS_QUERY, CHANNELS_QUERY, build_search_query,
+                     search_result, build_facets_query, add_facet_counts, summarize_facets, rows_start_date,
+                     build_context_queries, build_day_total_query, fetch_context, explain_plan)
+from query_language import parse_query, QueryError
+from highlight import query_terms, highlight_patterns, add_highlights
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 # Serve favicon directly
 app.secret_key = 'secret_key'
 CORS(app)
 
-# Configuration
-DB_PATH = '/path/to/znc_search/znc_logs.db'
-DB_KEY = 'secret_key'
+# Database path and encryption key are configured in storage.py
 
 # Network display name mapping (OPTIONAL)
 NETWORK_NAMES = {}
 
+# Workload capture for 'db_utils.py bench --replay' (OPTIONAL). Set to a file
+# path to append the parameters of every /api/search and /api/context request.
+# No usernames, addresses or times are recorded; search terms are replaced by
+# their length unless WORKLOAD_KEEP_QUERIES is True.
+WORKLOAD_LOG = ''
+WORKLOAD_KEEP_QUERIES = False
+
+# Prometheus /metrics endpoint. Served to clients sending "Authorization:
+# Bearer <METRICS_TOKEN>", and to these client addresses. Behind a reverse
+# proxy on the same host every client arrives from 127.0.0.1, so only list
+# ('127.0.0.1', '::1') when the app is reached directly.
+METRICS_ALLOWED_ADDRESSES = ()
+METRICS_TOKEN = ''
+
+# Users who may profile a request by adding ?profile=1 to it. The JSON
+# response then carries the slowest functions and every SQL statement with
+# its query plan and row count.
+ADMIN_USERNAMES = ('admin',)
+PROFILE_TOP_FUNCTIONS = 25
+
+# Responses of at least COMPRESS_MIN_SIZE bytes, of these types, are
+# compressed for browsers that accept it: with brotli when the optional
+# 'brotli' package is installed, otherwise with gzip. Streamed responses are
+# compressed chunk by chunk whatever their size.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Rows read from the database per step while /api/day streams a transcript
+DAY_STREAM_BATCH = 1000
+
+# Seconds a browser may reuse a transcript of a past day without asking
+# again; today's transcript is always revalidated against its line count
+DAY_CACHE_SECONDS = 3600
+
 def get_db():
     """Get database connection with encryption"""
-    conn = sqlite.connect(DB_PATH)
-    conn.execute(f"PRAGMA key = '{DB_KEY}'")
-    conn.execute("PRAGMA cipher_compatibility = 4")
-    return conn
+    return metrics.connect(storage.get_db, 'web-read')
+
+def record_workload(endpoint, params, rows, elapsed):
+    """Append one anonymized request to the workload file"""
+    if not WORKLOAD_LOG:
+        return
+    
+    entry = {
+        'endpoint': endpoint,
+        'params': params,
+        'rows': rows,
+        'ms': round(elapsed * 1000, 2)
+    }
+    
+    # One write per line so concurrent gunicorn workers never interleave
+    try:
+        with open(WORKLOAD_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    except OSError as e:
+        app.logger.warning(f"Cannot write workload file {WORKLOAD_LOG}: {e}")
 
 def hash_password(password):
     """Hash password using SHA256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
 def init_db():
-    """Initialize the database schema"""
+    """Initialize the database schema and the default admin user"""
     conn = get_db()
     cursor = conn.cursor()
     
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS networks (
-            id TEXT PRIMARY KEY,
-            display_name TEXT NOT NULL
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS channels (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            network_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            FOREIGN KEY (network_id) REFERENCES networks(id),
-            UNIQUE(network_id, name)
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS log_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            network_id TEXT NOT NULL,
-            channel_name TEXT NOT NULL,
-            log_date DATE NOT NULL,
-            line_number INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            FOREIGN KEY (network_id) REFERENCES networks(id)
-        )
-    ''')
-    
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            totp_secret TEXT,
-            totp_enabled INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create indexes for efficient searching
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_network 
-        ON log_entries(network_id)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_channel 
-        ON log_entries(channel_name)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_date 
-        ON log_entries(log_date)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_content 
-        ON log_entries(content)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_log_composite 
-        ON log_entries(network_id, channel_name, log_date)
-    ''')
+    storage.init_db(conn)
     
     # Check if default admin user exists, if not create it
     cursor.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',))
@@ -121,6 +126,145 @@ def init_db():
     conn.commit()
     conn.close()
 
+@app.before_request
+def start_request_metrics():
+    # Routes rather than URLs, so /api/channels/<network> is one series
+    g.metrics = metrics.start_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.before_request
+def start_profiling():
+    if request.args.get('profile') != '1':
+        return None
+    if session.get('username') not in ADMIN_USERNAMES:
+        return jsonify({'error': 'Profiling is only available to admin users'}), 403
+    
+    g.metrics['statements'] = []
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+    return None
+
+def build_profile_report(profiler, state):
+    """Slowest functions and every SQL statement of a profiled request"""
+    total = time.perf_counter() - state['started']
+    
+    stats = pstats.Stats(profiler).stats
+    slowest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+    functions = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in slowest:
+        functions.append({
+            'function': f'{os.path.basename(filename)}:{line}({name})',
+            'calls': calls,
+            'own_ms': round(own * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3)
+        })
+    
+    # Plans are looked up on a separate connection after the request, so
+    # they do not add to the timings above
+    statements = []
+    conn = storage.get_db('web-read')
+    try:
+        for statement in state['statements']:
+            statements.append({
+                'sql': ' '.join(statement['sql'].split()),
+                'params': statement['params'],
+                'ms': round(statement['seconds'] * 1000, 3),
+                'rows': statement['rows'],
+                'plan': explain_plan(conn, statement['sql'], statement['params'])
+            })
+    finally:
+        conn.close()
+    
+    return {
+        'total_ms': round(total * 1000, 3),
+        'connect_ms': round(state['connect'] * 1000, 3),
+        'db_ms': round(state['db'] * 1000, 3),
+        'python_ms': round((total - state['connect'] - state['db']) * 1000, 3),
+        'functions': functions,
+        'statements': statements
+    }
+
+def response_encoding():
+    """Content coding the browser accepts that responses can be compressed with, None for none"""
+    if brotli and request.accept_encodings.quality('br') > 0:
+        return 'br'
+    if request.accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed response, flushing after every chunk so lines still arrive as they are read"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    
+    try:
+        for chunk in chunks:
+            yield compress(chunk.encode() if isinstance(chunk, str) else chunk) + flush()
+        yield finish()
+    finally:
+        # Lets the view close its database connection when the client goes away
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+# Registered before the other after_request hooks, so it runs after them and
+# compresses the final body
+@app.after_request
+def compress_response(response):
+    if (response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    
+    encoding = response_encoding()
+    if encoding is None:
+        return response
+    
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(data, GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    
+    # The compressed body differs byte for byte from the uncompressed one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.after_request
+def attach_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    
+    if response.is_json:
+        data = response.get_json()
+        if isinstance(data, dict):
+            data['profile'] = build_profile_report(profiler, g.metrics)
+            response.set_data(json.dumps(data))
+    return response
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics' in g:
+        metrics.finish_request(g.metrics, request.method, g.get('metrics_status', 500))
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -129,6 +273,39 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def generation_cached(f):
+    """Answer 304 Not Modified, without running the view, while no logs were imported or pruned"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        generation = storage.read_generation()
+        if generation is None or request.args.get('profile') == '1':
+            return f(*args, **kwargs)
+        number, modified = generation
+        
+        # A restored or rekeyed database file is a new file
+        try:
+            file_id = os.stat(storage.DB_PATH).st_ino
+        except OSError:
+            file_id = 0
+        etag = f'gen-{number}-{file_id:x}'
+        last_modified = datetime.fromtimestamp(int(modified), timezone.utc) if modified else None
+        
+        # If-Modified-Since only counts when the browser sent no ETag
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = bool(last_modified and request.if_modified_since
+                                and last_modified <= request.if_modified_since)
+        
+        response = Response(status=304) if not_modified else make_response(f(*args, **kwargs))
+        if response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
+
 @app.route('/')
 def index():
     # Redirect to login if not authenticated
@@ -397,19 +574,26 @@ def disable_2fa():
         'message': '2FA disabled successfully'
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request metrics of all workers in Prometheus text format"""
+    authorized = request.remote_addr in METRICS_ALLOWED_ADDRESSES
+    if METRICS_TOKEN and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        authorized = True
+    if not authorized:
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/networks', methods=['GET'])
 @login_required
+@generation_cached
 def get_networks():
     """List available networks from database"""
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT DISTINCT n.id, n.display_name 
-        FROM networks n
-        INNER JOIN log_entries le ON n.id = le.network_id
-        ORDER BY n.display_name
-    ''')
+    cursor.execute(NETWORKS_QUERY)
     
     networks = []
     for row in cursor.fetchall():
@@ -421,20 +605,29 @@ def get_networks():
     conn.close()
     return jsonify({'networks': networks})
 
+@app.route('/api/znc-users', methods=['GET'])
+@login_required
+@generation_cached
+def get_znc_users():
+    """List ZNC users whose logs have been imported"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT name FROM znc_users ORDER BY name')
+    znc_users = [row[0] for row in cursor.fetchall()]
+    
+    conn.close()
+    return jsonify({'znc_users': znc_users})
+
 @app.route('/api/channels/<network>', methods=['GET'])
 @login_required
+@generation_cached
 def get_channels(network):
     """List available channels for a network (only actual channels starting with #)"""
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT DISTINCT channel_name 
-        FROM log_entries 
-        WHERE network_id = ? 
-        AND channel_name LIKE '#%'
-        ORDER BY channel_name
-    ''', (network,))
+    cursor.execute(CHANNELS_QUERY, (network,))
     
     channels = [row[0] for row in cursor.fetchall()]
     
@@ -452,10 +645,12 @@ def get_context():
     center_line = data.get('line')
     lines_before = data.get('lines_before', 2)
     lines_after = data.get('lines_after', 2)
+    znc_user = data.get('znc_user')
     
     if not all([network, channel, log_date, center_line]):
         return jsonify({'error': 'Missing required parameters'}), 400
     
+    started = time.perf_counter()
     conn = get_db()
     cursor = conn.cursor()
     
@@ -463,15 +658,10 @@ def get_context():
     start_line = max(1, center_line - lines_before)
     end_line = center_line + lines_after
     
-    cursor.execute('''
-        SELECT line_number, content
-        FROM log_entries
-        WHERE network_id = ? 
-        AND channel_name = ? 
-        AND log_date = ?
-        AND line_number BETWEEN ? AND ?
-        ORDER BY line_number
-    ''', (network, channel, log_date, start_line, end_line))
+    lines_query, total_query = build_context_queries(network, channel, log_date,
+                                                     start_line, end_line, znc_user)
+    
+    cursor.execute(*lines_query)
     
     context = []
     for row in cursor.fetchall():
@@ -482,15 +672,22 @@ def get_context():
         })
     
     # Get total lines for this date
-    cursor.execute('''
-        SELECT COUNT(*) FROM log_entries
-        WHERE network_id = ? AND channel_name = ? AND log_date = ?
-    ''', (network, channel, log_date))
+    cursor.execute(*total_query)
     
     total_lines = cursor.fetchone()[0]
     
     conn.close()
     
+    record_workload('context', {
+        'network': network,
+        'channel': channel,
+        'date': log_date,
+        'line': center_line,
+        'lines_before': lines_before,
+        'lines_after': lines_after,
+        'znc_user': znc_user
+    }, len(context), time.perf_counter() - started)
+    
     return jsonify({
         'context': context,
         'start_line': start_line,
@@ -500,6 +697,64 @@ def get_context():
         'can_expand_down': end_line < total_lines
     })
 
+def add_inline_context(conn, results, lines):
+    """Fetch the context of every result at once; returns the ranges and sets each result's 'context_range'"""
+    ranges, result_ranges = fetch_context(conn, results, lines)
+    for result, range_index in zip(results, result_ranges):
+        result['context_range'] = range_index
+    return ranges
+
+@app.route('/api/day/<network>/<channel>/<log_date>', methods=['GET'])
+@login_required
+def get_day(network, channel, log_date):
+    """Stream the lines of a channel day as NDJSON, all of them or ?start=&end= line numbers"""
+    znc_user = request.args.get('znc_user')
+    try:
+        day = datetime.strptime(log_date, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Date must be YYYY-MM-DD'}), 400
+    
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(*build_day_total_query(network, channel, log_date, znc_user))
+        total_lines = cursor.fetchone()[0]
+        
+        start_line = max(request.args.get('start', 1, type=int), 1)
+        end_line = min(request.args.get('end', total_lines, type=int), total_lines)
+        
+        # Lines are only ever added to a day, so its line count identifies its content
+        etag = f'day-{total_lines}-{start_line}-{end_line}'
+        if request.if_none_match.contains_weak(etag):
+            conn.close()
+            response = Response(status=304)
+        else:
+            lines_query, _ = build_context_queries(network, channel, log_date, start_line, end_line, znc_user)
+            cursor.execute(*lines_query)
+            response = Response(stream_day_lines(conn, cursor), mimetype='application/x-ndjson')
+    except Exception:
+        conn.close()
+        raise
+    
+    response.set_etag(etag, weak=True)
+    response.headers['X-Total-Lines'] = str(total_lines)
+    if day < datetime.now().date():
+        response.headers['Cache-Control'] = f'private, max-age={DAY_CACHE_SECONDS}'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def stream_day_lines(conn, cursor):
+    """Yield the rows of a /api/day query as NDJSON, a batch at a time, then close the connection"""
+    try:
+        while True:
+            rows = cursor.fetchmany(DAY_STREAM_BATCH)
+            if not rows:
+                break
+            yield ''.join(json.dumps({'line': line, 'content': content}) + '\n' for line, content in rows)
+    finally:
+        conn.close()
+
 @app.route('/api/search', methods=['POST'])
 @login_required
 def search_logs():
@@ -510,6 +765,16 @@ def search_logs():
     start_date = data.get('start_date')
     end_date = data.get('end_date')
     case_sensitive = data.get('case_sensitive', False)
+    znc_user = data.get('znc_user', '')
+    # Hit counts per channel and per day, week or month: 'auto' or one of FACET_INTERVALS
+    facets = data.get('facets', False)
+    facet_interval = data.get('facet_interval', 'auto')
+    # Also match close variants of every word and nick, ranked by edit distance
+    fuzzy_search = data.get('fuzzy', False)
+    # Whole lines instead of snippets around the hits
+    full_lines = data.get('full_lines', False)
+    # Lines of context on either side of every hit, as /api/context would return them
+    context_lines = data.get('context', 0)
     
     if not query:
         return jsonify({'error': 'Query required'}), 400
@@ -517,71 +782,185 @@ def search_logs():
     if not network:
         return jsonify({'error': 'Network required'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Build query
-    sql_query = '''
-        SELECT 
-            le.network_id,
-            n.display_name,
-            le.channel_name,
-            le.log_date,
-            le.line_number,
-            le.content
-        FROM log_entries le
-        JOIN networks n ON le.network_id = n.id
-        WHERE le.network_id = ?
-    '''
-    params = [network]
-    
-    # Add channel filter if specified
-    if channel:
-        sql_query += ' AND le.channel_name = ?'
-        params.append(channel)
-    
-    # Add date range filters
-    if start_date:
-        sql_query += ' AND le.log_date >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        sql_query += ' AND le.log_date <= ?'
-        params.append(end_date)
-    
-    # Add search filter
-    if case_sensitive:
-        sql_query += ' AND le.content LIKE ?'
-        params.append(f'%{query}%')
+    try:
+        context_lines = int(context_lines)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Context must be a number of lines'}), 400
+    
+    try:
+        parse_query(query)
+    except QueryError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    
+    # Heavy searches share a few slots, so they cannot take every worker
+    cost = admission.estimate_cost(query, channel, start_date, end_date)
+    slot, outcome = admission.acquire(cost)
+    if outcome == 'rejected':
+        metrics.count_admission(cost, outcome)
+        return jsonify({
+            'error': 'The server is busy with other large searches. Try again in a moment, '
+                     'or narrow the search down to a channel or a shorter date range.',
+            'cost': cost
+        }), 503, {'Retry-After': str(admission.ADMISSION_QUEUE_SECONDS)}
+    
+    started = time.perf_counter()
+    
+    results = None
+    context_ranges = None
+    expansions = None
+    channel_counts = {}
+    day_counts = {}
+    try:
+        conn = get_db()
+        try:
+            admission.set_time_budget(conn, cost)
+            cursor = conn.cursor()
+            if fuzzy_search:
+                expansions = fuzzy.expand_query(conn, parse_query(query))
+            hits = None
+            rows_start = start_date
+            if facets:
+                cursor.execute(*build_facets_query(network, query, channel, znc_user,
+                                                   start_date, end_date, case_sensitive, expansions))
+                hits = add_facet_counts(cursor.fetchall(), channel_counts, day_counts)
+                # Exact results are the newest hits, so only their days are searched again
+                if not expansions:
+                    rows_start = rows_start_date(day_counts) or start_date
+            
+            # No need to look for rows the facets found none of
+            if hits == 0:
+                rows = []
+            else:
+                cursor.execute(*build_search_query(network, query, channel, znc_user, rows_start, end_date,
+                                                   case_sensitive, expansions=expansions))
+                rows = cursor.fetchall()
+            
+            # Fuzzy variants match regardless of case
+            patterns = highlight_patterns(query_terms(parse_query(query), expansions),
+                                          case_sensitive and not expansions)
+            found = [add_highlights(search_result(row), patterns, full_lines) for row in rows]
+            if context_lines > 0:
+                context_ranges = add_inline_context(conn, found, context_lines)
+            results = found
+        finally:
+            conn.close()
+    except sqlite.OperationalError as e:
+        # Raised when the time budget runs out
+        if 'interrupted' not in str(e):
+            raise
+        outcome = 'interrupted'
+    finally:
+        admission.release(slot)
+        metrics.count_admission(cost, outcome)
+    
+    if results is None:
+        return jsonify({
+            'error': f'Search stopped after {admission.SEARCH_TIME_BUDGETS[cost]} seconds. Narrow it down '
+                     'with a channel, a date range or a longer search term.',
+            'cost': cost
+        }), 504
+    
+    workload_params = {
+        'network': network,
+        'channel': channel,
+        'znc_user': znc_user,
+        'start_date': start_date,
+        'end_date': end_date,
+        'case_sensitive': case_sensitive,
+        # Options that change the statements a search runs, for db_utils.py bench --replay
+        'fuzzy': bool(fuzzy_search),
+        'facets': bool(facets),
+        'context': context_lines
+    }
+    if WORKLOAD_KEEP_QUERIES:
+        workload_params['query'] = query
     else:
-        sql_query += ' AND LOWER(le.content) LIKE LOWER(?)'
-        params.append(f'%{query}%')
+        workload_params['query_length'] = len(query)
+    record_workload('search', workload_params, len(results), time.perf_counter() - started)
     
-    sql_query += ' ORDER BY le.log_date DESC, le.line_number ASC LIMIT 1000'
-    
-    cursor.execute(sql_query, params)
+    response = {
+        'results': results,
+        'total': len(results),
+        'truncated': len(results) >= SEARCH_LIMIT
+    }
+    if facets:
+        response['facets'] = summarize_facets(channel_counts, day_counts, facet_interval)
+    if fuzzy_search:
+        response['expansions'] = expansions
+    if context_ranges is not None:
+        response['context_ranges'] = context_ranges
+    return jsonify(response)
+
+@app.route('/api/search/jobs', methods=['POST'])
+@login_required
+def start_search_job():
+    """Start a search in the background; takes the same parameters as /api/search"""
+    data = request.json
+    params = {
+        'query': data.get('query', ''),
+        'network': data.get('network', ''),
+        'channel': data.get('channel', ''),
+        'start_date': data.get('start_date'),
+        'end_date': data.get('end_date'),
+        'case_sensitive': data.get('case_sensitive', False),
+        'znc_user': data.get('znc_user', ''),
+        'facets': data.get('facets', False),
+        'facet_interval': data.get('facet_interval', 'auto'),
+        'fuzzy': data.get('fuzzy', False),
+        'full_lines': data.get('full_lines', False)
+    }
+    
+    if not params['query']:
+        return jsonify({'error': 'Query required'}), 400
     
-    results = []
-    for row in cursor.fetchall():
-        results.append({
-            'network': row[1],
-            'network_id': row[0],
-            'channel': row[2],
-            'date': row[3],
-            'line': row[4],
-            'content': row[5]
-        })
+    if not params['network']:
+        return jsonify({'error': 'Network required'}), 400
     
-    conn.close()
+    try:
+        parse_query(params['query'])
+    except QueryError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
     
-    return jsonify({
-        'results': results,
-        'total': len(results),
-        'truncated': len(results) >= 1000
-    })
+    job = jobs.start_job(params, session.get('username'))
+    return jsonify(jobs.job_page(job, limit=0)), 202
+
+@app.route('/api/search/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_search_job(job_id):
+    """Progress of a search job and a page of its results (?offset=&limit=&context=)"""
+    job = jobs.load_job(job_id)
+    if not job or job['username'] != session.get('username'):
+        return jsonify({'error': 'Search job not found'}), 404
+    jobs.mark_polled(job_id)
+    
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', jobs.JOB_PAGE_SIZE, type=int)
+    context_lines = request.args.get('context', 0, type=int)
+    page = jobs.job_page(job, max(offset, 0), limit)
+    
+    if context_lines > 0 and page['results']:
+        conn = get_db()
+        try:
+            page['context_ranges'] = add_inline_context(conn, page['results'], context_lines)
+        finally:
+            conn.close()
+    return jsonify(page)
+
+@app.route('/api/search/jobs/<job_id>', methods=['DELETE'])
+@login_required
+def cancel_search_job(job_id):
+    """Cancel a search job; the results found so far are kept"""
+    job = jobs.load_job(job_id)
+    if not job or job['username'] != session.get('username'):
+        return jsonify({'error': 'Search job not found'}), 404
+    
+    if job['status'] in ('queued', 'running'):
+        jobs.cancel_job(job_id)
+    return jsonify({'success': True})
 
 @app.route('/api/stats', methods=['GET'])
 @login_required
+@generation_cached
 def get_stats():
     """Get database statistics"""
     conn = get_db()
@@ -628,7 +1007,7 @@ def get_stats():
 
 if __name__ == '__main__':
     # Initialize database on first run
-    if not os.path.exists(DB_PATH):
+    if not os.path.exists(storage.DB_PATH):
         print("Initializing encrypted database...")
         init_db()
         print("Database initialized. Run import_logs.py to import your ZNC logs.")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+ASGI serving mode for the web app
+
+With 'gunicorn -w 4' sync workers, at most four requests are in progress:
+four slow searches leave nothing to answer a login or the network list. In
+this mode one uvicorn process runs an event loop that accepts every
+connection and hands each request to one of two bounded thread pools:
+
+    heavy   HEAVY_THREADS threads for searches, context and day transcripts
+    light   LIGHT_THREADS threads for everything else: login, settings,
+            stats, network and channel lists, search job polls
+
+Database work only ever happens on these threads, and searches can never
+take a thread the cheap endpoints need. Requests beyond a pool's size wait
+for a thread of their own pool without blocking the event loop.
+Background search jobs keep their own JOB_THREADS pool (jobs.py), and
+admission control (admission.py) still limits heavy searches.
+
+Usage:
+    pip3 install a2wsgi uvicorn
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+'python3 loadtest.py' compares this mode with the sync workers.
+"""
+
+from a2wsgi import WSGIMiddleware
+
+try:
+    from app import app as flask_app
+except ModuleNotFoundError as e:
+    # install.sh deploys app.py, older installs have znc_search.py
+    if e.name != 'app':
+        raise
+    from znc_search import app as flask_app
+
+# Threads running searches, context lookups and day transcripts at once.
+# Keep this at HEAVY_SEARCH_SLOTS + HEAVY_QUEUE_SLOTS (admission.py) or
+# more, so context lookups still get a thread while searches run.
+HEAVY_THREADS = 6
+
+# Threads for every other request
+LIGHT_THREADS = 8
+
+# Response chunks queued per request before the thread producing them waits
+# for the client, e.g. while a day transcript streams to a slow connection
+SEND_QUEUE_SIZE = 10
+
+# Requests served by the heavy pool: exact paths, then path prefixes
+HEAVY_PATHS = ('/api/search', '/api/context')
+HEAVY_PATH_PREFIXES = ('/api/day/',)
+
+heavy_pool = WSGIMiddleware(flask_app, workers=HEAVY_THREADS, send_queue_size=SEND_QUEUE_SIZE)
+light_pool = WSGIMiddleware(flask_app, workers=LIGHT_THREADS, send_queue_size=SEND_QUEUE_SIZE)
+
+def is_heavy(scope):
+    """Whether a request goes to the heavy pool"""
+    path = scope.get('path', '')
+    return path in HEAVY_PATHS or path.startswith(HEAVY_PATH_PREFIXES)
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'http' and is_heavy(scope):
+        await heavy_pool(scope, receive, send)
+    else:
+        # Also answers lifespan and websocket events
+        await light_pool(scope, receive, send)
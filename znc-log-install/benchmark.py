@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Scale benchmark for log import and search
+
+Generates a synthetic ZNC log tree with generate_logs.py, imports it into a
+fresh encrypted database with import_logs.py, and runs a fixed suite of
+searches and context lookups through app.py. Every run appends one JSON
+line to the results file and is compared with the previous run that used
+the same settings, so changes can be measured across commits and machines.
+
+Nothing in the production configuration is touched: the benchmark uses its
+own logs, database and key under --workdir.
+
+Usage:
+    python3 benchmark.py --lines 10M [options]
+
+Options:
+    --lines      Lines to generate, e.g. 1M, 10M, 100M, 1B
+    --workdir    Directory for generated logs and databases (default: bench/)
+    --reuse      Reuse logs and database from an earlier run with the same settings
+    --repeat     Times each search is repeated (default: 5)
+    --results    Results file (default: benchmark_results.jsonl)
+    --label      Free-form label stored with the results, e.g. a branch name
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import importlib
+import contextlib
+import subprocess
+from datetime import datetime, timedelta
+
+import generate_logs
+import storage
+import admission
+
+# Encryption key of the benchmark database (never the production key)
+BENCH_DB_KEY = 'benchmark'
+
+# Search suite: (name, term, filters). A term is a word's frequency rank in
+# the generated vocabulary, or a literal string.
+SEARCH_SUITE = [
+    ('common word', 1, {}),
+    ('common word, busiest channel', 1, {'channel': True}),
+    ('frequent word', 20, {}),
+    ('mid-frequency word', 500, {}),
+    ('rare word', 20000, {}),
+    ('rare word, busiest channel, 30 days', 20000, {'channel': True, 'days': 30}),
+    ('word, case sensitive', 500, {'case_sensitive': True}),
+    ('two letters', 'an', {}),
+    ('missing word', 'qqxzzv', {}),
+    ('missing word, 7 days', 'qqxzzv', {'days': 7}),
+    ('join events', '"*** Joins"', {'channel': True}),
+]
+
+# Context lookups made for the first hits of the busiest channel search
+CONTEXT_LOOKUPS = 20
+
+# Seconds a benchmark search may run. Replaces the web app's time budgets
+# (admission.py), which would interrupt network-wide searches at 100M+ lines.
+BENCH_TIME_BUDGET = 3600
+
+def load_module(*names):
+    """Import the first module that exists, e.g. import_logs or Import_logs"""
+    for name in names:
+        try:
+            return importlib.import_module(name)
+        except ModuleNotFoundError as e:
+            if e.name != name:
+                raise
+    raise ModuleNotFoundError(f"None of {', '.join(names)} found")
+
+def git_commit():
+    """Return the current git commit of the source tree, if any"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_import(importer, logs_dir, db_path, workers, log_path):
+    """Import the generated tree into a new database, returns elapsed seconds"""
+    importer.ZNC_DATA_PATH = logs_dir
+    storage.DB_PATH = db_path
+    storage.DB_KEY = BENCH_DB_KEY
+    
+    argv = sys.argv
+    sys.argv = ['import_logs.py', '--workers', str(workers)]
+    started = time.perf_counter()
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+            importer.main()
+    finally:
+        sys.argv = argv
+    return time.perf_counter() - started
+
+def timed_request(client, method, url, payload=None):
+    """Run one request through the Flask test client, returns (ms, json)"""
+    started = time.perf_counter()
+    if method == 'POST':
+        response = client.post(url, json=payload)
+    else:
+        response = client.get(url)
+    elapsed = (time.perf_counter() - started) * 1000
+    
+    if response.status_code != 200:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return elapsed, response.get_json()
+
+def summarize(timings):
+    """Cold, minimum and median of a list of millisecond timings"""
+    ordered = sorted(timings)
+    return {
+        'cold_ms': round(timings[0], 2),
+        'min_ms': round(ordered[0], 2),
+        'median_ms': round(ordered[len(ordered) // 2], 2),
+    }
+
+def run_search_suite(app_module, db_path, settings, repeat):
+    """Run the fixed search and context suite through app.py"""
+    storage.DB_PATH = db_path
+    storage.DB_KEY = BENCH_DB_KEY
+    admission.SEARCH_TIME_BUDGETS = {cost: BENCH_TIME_BUDGET for cost in admission.SEARCH_TIME_BUDGETS}
+    
+    vocabulary = generate_logs.build_vocabulary(settings['seed'])
+    plan = generate_logs.channel_line_counts(settings['lines'], settings['users'], settings['networks'],
+                                             settings['channels'], settings['seed'])
+    _, network, channel, _ = max(plan, key=lambda entry: entry[3])
+    end_date = datetime.strptime(settings['end_date'], '%Y-%m-%d')
+    
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['username'] = 'benchmark'
+    
+    results = {}
+    
+    for name, url in (('networks', '/api/networks'), ('channels', f'/api/channels/{network}'),
+                      ('stats', '/api/stats')):
+        timings = [timed_request(client, 'GET', url)[0] for _ in range(repeat)]
+        results[name] = summarize(timings)
+        print(f"  {name:<40} {results[name]['median_ms']:>10.1f} ms")
+    
+    context_source = None
+    for name, term, filters in SEARCH_SUITE:
+        payload = {
+            'query': vocabulary[term - 1] if isinstance(term, int) else term,
+            'network': network,
+            'case_sensitive': filters.get('case_sensitive', False),
+        }
+        if filters.get('channel'):
+            payload['channel'] = channel
+        if filters.get('days'):
+            payload['start_date'] = (end_date - timedelta(days=filters['days'] - 1)).strftime('%Y-%m-%d')
+            payload['end_date'] = end_date.strftime('%Y-%m-%d')
+        
+        timings = []
+        for _ in range(repeat):
+            elapsed, data = timed_request(client, 'POST', '/api/search', payload)
+            timings.append(elapsed)
+        
+        results[name] = summarize(timings)
+        results[name]['rows'] = data['total']
+        print(f"  {name:<40} {results[name]['median_ms']:>10.1f} ms  {data['total']:>6,} rows")
+        
+        if context_source is None and filters.get('channel') and data['results']:
+            context_source = data['results']
+    
+    # Expand the first hits one after another, like a user reviewing results
+    if context_source:
+        timings = []
+        for hit in context_source[:CONTEXT_LOOKUPS]:
+            elapsed, _ = timed_request(client, 'POST', '/api/context', {
+                'network': hit['network_id'],
+                'channel': hit['channel'],
+                'date': hit['date'],
+                'line': hit['line'],
+                'znc_user': hit['znc_user'],
+            })
+            timings.append(elapsed)
+        results['context lookups'] = summarize(timings)
+        results['context lookups']['rows'] = len(timings)
+        print(f"  {'context lookups':<40} {results['context lookups']['median_ms']:>10.1f} ms")
+    
+    return results
+
+def load_previous_run(results_path, settings):
+    """Return the most recent recorded run with the same settings, or None"""
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                run = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if run.get('settings') == settings:
+                previous = run
+    return previous
+
+def print_comparison(previous, current):
+    """Print median timings of two runs side by side"""
+    label = previous.get('label') or previous.get('commit') or previous['created']
+    print(f"\nCompared with {label} ({previous['created']}):")
+    
+    rows = []
+    if previous['import']['seconds'] and current['import']['seconds']:
+        rows.append(('import (s)', previous['import']['seconds'], current['import']['seconds']))
+    for name, stats in current['searches'].items():
+        if name in previous['searches']:
+            rows.append((name, previous['searches'][name]['median_ms'], stats['median_ms']))
+    
+    for name, before, after in rows:
+        change = f"{(after - before) / before * 100:+.0f}%" if before else 'n/a'
+        print(f"  {name:<40} {before:>10.1f} -> {after:>10.1f}  {change:>6}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Import and search benchmark on synthetic ZNC logs')
+    parser.add_argument('--lines', type=generate_logs.parse_count, required=True,
+                       help='Lines to generate, e.g. 1M, 10M, 100M, 1B')
+    parser.add_argument('--users', type=int, default=1,
+                       help='ZNC users (default: 1)')
+    parser.add_argument('--networks', type=int, default=2,
+                       help='Networks per user (default: 2)')
+    parser.add_argument('--channels', type=int, default=20,
+                       help='Channels per network (default: 20)')
+    parser.add_argument('--days', type=int, default=365,
+                       help='Days of history (default: 365)')
+    parser.add_argument('--seed', type=int, default=1,
+                       help='Random seed (default: 1)')
+    parser.add_argument('--workdir', default='bench',
+                       help='Directory for generated logs and databases (default: bench/)')
+    parser.add_argument('--reuse', action='store_true',
+                       help='Reuse logs and database from an earlier run with the same settings')
+    parser.add_argument('--import-workers', type=int, default=4,
+                       help='ZNC users imported in parallel (default: 4)')
+    parser.add_argument('--repeat', type=int, default=5,
+                       help='Times each search is repeated (default: 5)')
+    parser.add_argument('--results', default='benchmark_results.jsonl',
+                       help='Results file (default: benchmark_results.jsonl)')
+    parser.add_argument('--label',
+                       help='Label stored with the results, e.g. a branch name')
+    args = parser.parse_args()
+    
+    importer = load_module('import_logs', 'Import_logs')
+    app_module = load_module('app', 'znc_search')
+    
+    settings = {
+        'lines': args.lines,
+        'users': args.users,
+        'networks': args.networks,
+        'channels': args.channels,
+        'days': args.days,
+        'seed': args.seed,
+        'end_date': '2024-12-31',
+    }
+    
+    run_dir = os.path.abspath(os.path.join(
+        args.workdir, f"{args.lines}_{args.users}u_{args.networks}n_{args.channels}c_{args.days}d_s{args.seed}"))
+    logs_dir = os.path.join(run_dir, 'znc')
+    db_path = os.path.join(run_dir, 'znc_logs.db')
+    
+    print("=" * 70)
+    print(f"BENCHMARK: {args.lines:,} lines")
+    print("=" * 70)
+    
+    # Generate
+    if args.reuse and os.path.isdir(logs_dir):
+        print(f"\nReusing generated logs: {logs_dir}")
+    else:
+        shutil.rmtree(run_dir, ignore_errors=True)
+        os.makedirs(run_dir)
+        print()
+        generate_logs.generate_tree(logs_dir, args.lines, args.users, args.networks, args.channels,
+                                    args.days, datetime.strptime(settings['end_date'], '%Y-%m-%d'),
+                                    seed=args.seed)
+    
+    # Import
+    if args.reuse and os.path.exists(db_path):
+        print(f"Reusing imported database: {db_path}")
+        import_seconds = None
+    else:
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        print("\nImporting with import_logs.py...")
+        import_seconds = run_import(importer, logs_dir, db_path, args.import_workers,
+                                    os.path.join(run_dir, 'import.log'))
+        print(f"✓ Imported in {import_seconds:.1f}s ({args.lines / import_seconds:,.0f} lines/s)")
+    
+    db_size = os.path.getsize(db_path)
+    print(f"  Database size: {db_size / (1024*1024):.1f} MB")
+    
+    # Search
+    print(f"\nRunning search suite ({args.repeat} runs each, median shown)...")
+    searches = run_search_suite(app_module, db_path, settings, args.repeat)
+    
+    run = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'label': args.label,
+        'commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'settings': settings,
+        'import': {
+            'seconds': round(import_seconds, 2) if import_seconds is not None else None,
+            'lines_per_s': round(args.lines / import_seconds) if import_seconds else None,
+            'db_mb': round(db_size / (1024*1024), 1),
+        },
+        'searches': searches,
+    }
+    
+    previous = load_previous_run(args.results, settings)
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + '\n')
+    
+    if previous:
+        print_comparison(previous, run)
+    
+    print(f"\n✓ Results appended to: {os.path.abspath(args.results)}")
+
+if __name__ == '__main__':
+    main()
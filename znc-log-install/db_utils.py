@@ -6,39 +6,129 @@ This script provides common maintenance operations for the encrypted database.
 
 Usage:
     python3 db_utils.py [command] [options]
-    
+
 Commands:
     stats       - Show database statistics
-    vacuum      - Optimize database file
+    vacuum      - Reclaim free pages (incremental), or rebuild the file with --full
+    prune       - Delete log entries older than --older-than in small batches
     reindex     - Rebuild all indexes
+    build-terms - Build the term dictionary for fuzzy search (--rebuild to start over)
+    analyze     - Gather query planner statistics and compare the app's query plans
     verify      - Verify database integrity
-    export      - Export database to plaintext SQL
-    backup      - Create encrypted backup (saved to backup/ directory)
-    cleanup     - Remove old backups (default: older than 30 days)
+    export      - Export logs to plaintext SQL, NDJSON, ZNC text or Parquet,
+                  filtered by --network/--channel/--since/--until and compressed
+    backup      - Create verified online encrypted backup (saved to backup/ directory)
+                  --incremental stores only the pages changed since the last backup
+    restore     - Rebuild the database at a point in time from incremental backups
+    rekey       - Re-encrypt the database with a raw key file, skipping key derivation
+    cleanup     - Remove old backups and backup chains (default: older than 30 days)
+    bench       - Replay a workload captured by app.py (--replay) and report latency,
+                  compare the connection profiles in storage.py (--profiles), or
+                  time connection setup with a passphrase vs a raw key (--kdf)
 """
 
 import os
+import io
 import sys
+import gzip
+import lzma
 import argparse
-from datetime import datetime
-from pysqlcipher3 import dbapi2 as sqlite
+import re
+import json
+import time
+import queue
+import random
+import struct
 import shutil
+import secrets
+import tempfile
+import hashlib
+import threading
+import ctypes
+import ctypes.util
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pysqlcipher3 import dbapi2 as sqlite
+import storage
+import fuzzy
+from queries import (NETWORKS_QUERY, CHANNELS_QUERY, build_search_query, build_context_queries,
+                     explain_plan, build_facets_query, add_facet_counts, rows_start_date, search_result,
+                     build_inline_context_queries)
+from query_language import parse_query
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
-# Configuration - should match app.py
-DB_PATH = '/path/to/znc_search/znc_logs.db'
-DB_KEY = 'secret_key'  # Must match app.py
+# Configuration - database path and encryption key are set in storage.py
 BACKUP_DIR = 'backup'  # Directory for backups (relative to script location)
+STATS_DIR = 'stats'  # Directory for query plan snapshots
+
+# Rows deleted per transaction by prune, keeps each write lock short
+PRUNE_BATCH_SIZE = 10000
+
+# Free pages returned to the filesystem after each prune batch
+PRUNE_VACUUM_PAGES = 2000
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+# Pages copied per backup step, and pause between steps so the web app and
+# importer can take the database lock in between
+BACKUP_STEP_PAGES = 1024
+BACKUP_STEP_SLEEP = 0.05
+
+# Writes to the source restart the copy; after this many restarts the rest
+# is copied in one step (briefly blocking writers) so the backup finishes
+BACKUP_MAX_RESTARTS = 5
+
+# Incremental backups: a new chain starts from a full base copy after this
+# many days or incremental links, whichever comes first
+BACKUP_FULL_INTERVAL_DAYS = 7
+BACKUP_MAX_CHAIN_LENGTH = 14
+
+# Bytes of blake2b digest kept per page to detect changed pages
+PAGE_HASH_SIZE = 16
+
+# Attempts at getting a WAL-free read snapshot for incremental backups
+BACKUP_SNAPSHOT_RETRIES = 20
+
+# Export: rows fetched per round trip, channels exported in parallel and
+# rows per Parquet row group (bounds memory use per channel)
+EXPORT_BATCH_SIZE = 5000
+EXPORT_WORKERS = 4
+PARQUET_ROW_GROUP_SIZE = 100000
+
+# Rows sampled per index by 'analyze --quick'
+ANALYSIS_LIMIT = 1000
+
+# Workload replay: parallel connections, and random reads of 50 lines used
+# to find stand-in words for anonymized search terms
+BENCH_CONCURRENCY = 4
+BENCH_SAMPLE_ROUNDS = 200
+
+# Profile benchmark: runs per profile and workload, and rows inserted into a
+# scratch database (in import_logs.py sized batches) for the write workloads
+BENCH_PROFILE_RUNS = 5
+BENCH_PROFILE_ROWS = 200000
+BENCH_PROFILE_BATCH_SIZE = 5000
+
+# Connections opened per key mode by 'bench --kdf'
+BENCH_KDF_CONNECTIONS = 50
 
 def get_db():
     """Get database connection with encryption"""
-    if not os.path.exists(DB_PATH):
-        print(f"Error: Database not found: {DB_PATH}")
+    if not os.path.exists(storage.DB_PATH):
+        print(f"Error: Database not found: {storage.DB_PATH}")
         sys.exit(1)
     
-    conn = sqlite.connect(DB_PATH)
-    conn.execute(f"PRAGMA key = '{DB_KEY}'")
-    conn.execute("PRAGMA cipher_compatibility = 4")
-    return conn
+    return storage.get_db('maintenance')
 
 def show_stats():
     """Show detailed database statistics"""
@@ -76,9 +166,16 @@ def show_stats():
         print(f"Last import: {row[0]}")
     
     # Database file size
-    db_size = os.path.getsize(DB_PATH)
+    db_size = os.path.getsize(storage.DB_PATH)
     print(f"Database file size: {db_size / (1024*1024):.2f} MB")
     
+    # Space that vacuum can give back
+    page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+    free_pages = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+    auto_vacuum = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+    print(f"Reclaimable space: {free_pages * page_size / (1024*1024):.2f} MB "
+          f"(auto_vacuum: {AUTO_VACUUM_MODES.get(auto_vacuum, auto_vacuum)})")
+    
     print("\n" + "-" * 70)
     print("ENTRIES PER NETWORK")
     print("-" * 70)
@@ -112,17 +209,38 @@ def show_stats():
     conn.close()
     print()
 
-def vacuum_db():
-    """Optimize database file"""
-    print("\nVacuuming database...")
+def incremental_vacuum(conn, pages=None):
+    """Return up to `pages` free pages (all if None) to the filesystem"""
+    # Each step of the pragma frees one page; execute() only steps once for
+    # statements without result columns, executescript() runs it to completion
+    pragma = 'PRAGMA incremental_vacuum' if pages is None else f'PRAGMA incremental_vacuum({int(pages)})'
+    conn.executescript(pragma + ';')
+
+def vacuum_db(full=False, pages=None):
+    """Reclaim free pages, converting the database to incremental auto_vacuum if needed"""
     conn = get_db()
     
-    before_size = os.path.getsize(DB_PATH)
+    before_size = os.path.getsize(storage.DB_PATH)
+    auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    
+    if full or auto_vacuum != 2:
+        # auto_vacuum can only be changed by rebuilding the file, which needs
+        # free disk space for a full copy and holds an exclusive lock throughout
+        if auto_vacuum != 2:
+            print("\nConverting database to auto_vacuum=INCREMENTAL (one-time full rebuild)...")
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        else:
+            print("\nVacuuming database (full rebuild)...")
+        conn.execute('VACUUM')
+    else:
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        to_free = free_pages if pages is None else min(pages, free_pages)
+        print(f"\nIncremental vacuum: releasing {to_free:,} of {free_pages:,} free pages...")
+        incremental_vacuum(conn, to_free)
     
-    conn.execute('VACUUM')
     conn.close()
     
-    after_size = os.path.getsize(DB_PATH)
+    after_size = os.path.getsize(storage.DB_PATH)
     saved = before_size - after_size
     
     print(f"✓ Vacuum complete")
@@ -130,6 +248,127 @@ def vacuum_db():
     print(f"  After:  {after_size / (1024*1024):.2f} MB")
     print(f"  Saved:  {saved / (1024*1024):.2f} MB")
 
+def parse_cutoff_date(value):
+    """Turn '90d', '6m', '1y', '90' or 'YYYY-MM-DD' into a cutoff date string"""
+    value = value.strip()
+    
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+    
+    match = re.fullmatch(r'(\d+)\s*([dwmy]?)', value.lower())
+    if not match:
+        raise ValueError(f"Invalid date: {value} (use e.g. 90d, 12w, 6m, 1y or YYYY-MM-DD)")
+    
+    amount = int(match.group(1))
+    unit_days = {'': 1, 'd': 1, 'w': 7, 'm': 30, 'y': 365}[match.group(2)]
+    return (datetime.now() - timedelta(days=amount * unit_days)).strftime('%Y-%m-%d')
+
+def prune_db(older_than, network=None, batch_size=PRUNE_BATCH_SIZE, dry_run=False):
+    """Delete log entries older than a cutoff date in bounded batches"""
+    try:
+        cutoff = parse_cutoff_date(older_than)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    where = 'log_date < ?'
+    params = [cutoff]
+    if network:
+        where += ' AND network_id = ?'
+        params.append(network)
+    
+    cursor.execute(f'SELECT COUNT(*) FROM log_entries WHERE {where}', params)
+    to_delete = cursor.fetchone()[0]
+    
+    scope = f" on network '{network}'" if network else ''
+    print(f"\nPruning log entries before {cutoff}{scope}: {to_delete:,} entries")
+    
+    if dry_run or to_delete == 0:
+        if dry_run:
+            print("Dry run, nothing deleted")
+        conn.close()
+        return True
+    
+    incremental = conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    if not incremental:
+        print("⚠ auto_vacuum is not INCREMENTAL; freed space stays in the file until "
+              "'db_utils.py vacuum' converts it")
+    
+    before_size = os.path.getsize(storage.DB_PATH)
+    deleted = 0
+    
+    # Each batch is its own short transaction so the web app and importer are
+    # never locked out for long; indexes are updated within the same transaction
+    while True:
+        cursor.execute(f'''
+            DELETE FROM log_entries WHERE id IN (
+                SELECT id FROM log_entries WHERE {where} LIMIT ?
+            )
+        ''', params + [batch_size])
+        batch = cursor.rowcount
+        conn.commit()
+        
+        if batch <= 0:
+            break
+        
+        deleted += batch
+        
+        # Give a few pages back to the filesystem per batch
+        if incremental:
+            incremental_vacuum(conn, PRUNE_VACUUM_PAGES)
+        
+        print(f"  Deleted {deleted:,} / {to_delete:,} entries", end='\r', flush=True)
+    
+    print()
+    
+    # Drop channel and network rows that no longer have any log entries
+    cursor.execute('''
+        DELETE FROM channels WHERE NOT EXISTS (
+            SELECT 1 FROM log_entries le
+            WHERE le.network_id = channels.network_id
+            AND le.channel_name = channels.name
+        )
+    ''')
+    removed_channels = cursor.rowcount
+    
+    cursor.execute('''
+        DELETE FROM networks WHERE NOT EXISTS (
+            SELECT 1 FROM log_entries le WHERE le.network_id = networks.id
+        )
+    ''')
+    removed_networks = cursor.rowcount
+    
+    # Remember the cutoff so a full re-import does not bring the data back
+    key = f'prune_before:{network}' if network else 'prune_before'
+    cursor.execute('''
+        INSERT OR REPLACE INTO import_metadata (key, value)
+        VALUES (?, ?)
+    ''', (key, cutoff))
+    conn.commit()
+    storage.bump_generation()
+    
+    if incremental:
+        incremental_vacuum(conn)
+    
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    conn.close()
+    
+    after_size = os.path.getsize(storage.DB_PATH)
+    
+    print(f"✓ Prune complete")
+    print(f"  Deleted entries: {deleted:,}")
+    print(f"  Removed channels: {removed_channels}, networks: {removed_networks}")
+    print(f"  File size: {before_size / (1024*1024):.2f} MB -> {after_size / (1024*1024):.2f} MB")
+    if free_pages:
+        print(f"  Still reclaimable: {free_pages * page_size / (1024*1024):.2f} MB")
+    return True
+
 def reindex_db():
     """Rebuild all indexes"""
     print("\nRebuilding indexes...")
@@ -140,6 +379,173 @@ def reindex_db():
     
     print("✓ Reindex complete")
 
+def build_terms_db(rebuild=False):
+    """Add the words of new log lines to the term dictionary used by fuzzy search"""
+    print(f"\n{'Rebuilding' if rebuild else 'Updating'} term dictionary...")
+    conn = get_db()
+    storage.init_db(conn)
+    
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM log_entries')
+    total = cursor.fetchone()[0]
+    
+    def report(lines):
+        print(f"\r  Read {lines:,} lines ({lines * 100 // max(total, 1)}% of all)", end='', flush=True)
+    
+    started = time.time()
+    lines, indexed = fuzzy.build_terms(conn, rebuild, report)
+    if lines:
+        print()
+    
+    cursor.execute('SELECT COUNT(*), COUNT(NULLIF(indexed, 0)) FROM term_dictionary')
+    words, searchable = cursor.fetchone()
+    conn.close()
+    
+    print(f"✓ Term dictionary up to date in {time.time() - started:.1f}s")
+    print(f"  Lines read: {lines:,}, new searchable words: {indexed:,}")
+    print(f"  Words: {words:,}, searchable by fuzzy search: {searchable:,}")
+
+def plan_queries(sample):
+    """Build the fixed queries issued by app.py for a sample network, channel, day and line"""
+    network, channel, log_date = sample['network'], sample['channel'], sample['date']
+    context_lines, context_total = build_context_queries(network, channel, log_date,
+                                                         sample['line'], sample['line'] + 4)
+    return {
+        'search (network)': build_search_query(network, 'hello'),
+        'search (network, channel)': build_search_query(network, 'hello', channel),
+        'search (network, dates)': build_search_query(network, 'hello', start_date=log_date,
+                                                      end_date=log_date),
+        'search (network, channel, dates, user)': build_search_query(
+            network, 'hello', channel, sample['znc_user'], log_date, log_date, case_sensitive=True),
+        'context lines': context_lines,
+        'context total': context_total,
+        'networks': (NETWORKS_QUERY, []),
+        'channels': (CHANNELS_QUERY, [network]),
+    }
+
+def latest_sample(conn):
+    """Parameters for plan_queries() taken from the most recently imported line"""
+    row = conn.execute('''
+        SELECT network_id, channel_name, log_date, line_number, znc_user
+        FROM log_entries ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+    if row is None:
+        row = ('', '', '', 1, '')
+    return {
+        'network': row[0],
+        'channel': row[1],
+        'date': row[2],
+        'line': row[3],
+        'znc_user': row[4],
+    }
+
+def take_plan_snapshot(conn, label):
+    """Record planner statistics and the plan of every fixed query"""
+    # Use the most recently imported line as a realistic set of parameters
+    sample = latest_sample(conn)
+    
+    stats = []
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        stats = [list(r) for r in conn.execute('SELECT tbl, idx, stat FROM sqlite_stat1 ORDER BY tbl, idx')]
+    
+    plans = {}
+    for name, (sql, params) in plan_queries(sample).items():
+        plans[name] = explain_plan(conn, sql, params)
+    
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'label': label,
+        'sqlite_version': conn.execute('SELECT sqlite_version()').fetchone()[0],
+        'sqlite_stat1': stats,
+        'plans': plans,
+    }
+
+def save_plan_snapshot(snapshot):
+    """Write a plan snapshot to STATS_DIR and return its path"""
+    os.makedirs(STATS_DIR, exist_ok=True)
+    stamp = datetime.fromisoformat(snapshot['created']).strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(STATS_DIR, f"plans_{stamp}_{snapshot['label']}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2)
+    return path
+
+def load_latest_plan_snapshot():
+    """Return the most recent saved plan snapshot, or None"""
+    if not os.path.isdir(STATS_DIR):
+        return None
+    paths = [os.path.join(STATS_DIR, f) for f in os.listdir(STATS_DIR)
+             if f.startswith('plans_') and f.endswith('.json')]
+    if not paths:
+        return None
+    with open(max(paths, key=os.path.getmtime), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def compare_plan_snapshots(before, after):
+    """Print every fixed query whose plan differs between two snapshots"""
+    print(f"\nQuery plans: {before['label']} ({before['created']}) -> {after['label']} ({after['created']})")
+    changed = 0
+    for name, plan in after['plans'].items():
+        old_plan = before['plans'].get(name)
+        if old_plan == plan:
+            continue
+        changed += 1
+        print(f"\n  {name}:")
+        for line in old_plan or ['(not recorded)']:
+            print(f"    - {line}")
+        for line in plan:
+            print(f"    + {line}")
+    
+    if changed:
+        print(f"\n  {changed} of {len(after['plans'])} query plan(s) changed")
+    else:
+        print(f"  All {len(after['plans'])} query plans unchanged")
+
+def analyze_db(quick=False, plans_only=False):
+    """Gather query planner statistics and compare the app's query plans"""
+    conn = get_db()
+    
+    if plans_only:
+        # Compare the current plans with the last recorded snapshot
+        previous = load_latest_plan_snapshot()
+        snapshot = take_plan_snapshot(conn, 'current')
+        conn.close()
+        path = save_plan_snapshot(snapshot)
+        if previous:
+            compare_plan_snapshots(previous, snapshot)
+        else:
+            print("\nQuery plans:")
+            for name, plan in snapshot['plans'].items():
+                print(f"\n  {name}:")
+                for line in plan:
+                    print(f"    {line}")
+        print(f"\n✓ Plan snapshot saved: {path}")
+        return True
+    
+    before = take_plan_snapshot(conn, 'before')
+    save_plan_snapshot(before)
+    
+    print("\nAnalyzing tables and indexes...")
+    if quick:
+        # Sample a bounded number of rows per index instead of reading all of them
+        conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    started = time.time()
+    conn.execute('ANALYZE')
+    conn.commit()
+    elapsed = time.time() - started
+    
+    after = take_plan_snapshot(conn, 'after')
+    conn.close()
+    path = save_plan_snapshot(after)
+    
+    print(f"✓ Analyze complete in {elapsed:.1f}s")
+    for tbl, idx, stat in after['sqlite_stat1']:
+        if tbl == 'log_entries':
+            print(f"  {idx or tbl}: {stat}")
+    
+    compare_plan_snapshots(before, after)
+    print(f"\n✓ Plan snapshots saved to: {os.path.dirname(os.path.abspath(path))}")
+    return True
+
 def verify_db():
     """Verify database integrity"""
     print("\nVerifying database integrity...")
@@ -171,8 +577,180 @@ def verify_db():
     conn.close()
     return True
 
+# SQLite result codes used by the backup API and replay benchmark
+SQLITE_OK = 0
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+SQLITE_ROW = 100
+SQLITE_DONE = 101
+SQLITE_OPEN_READONLY = 0x01
+SQLITE_OPEN_READWRITE = 0x02
+SQLITE_OPEN_CREATE = 0x04
+
+# Statement and connection counters used by the replay benchmark
+SQLITE_TRANSIENT = ctypes.c_void_p(-1)
+SQLITE_STMTSTATUS_VM_STEP = 4
+SQLITE_DBSTATUS_CACHE_HIT = 7
+SQLITE_DBSTATUS_CACHE_MISS = 8
+SQLITE_SCANSTAT_NVISIT = 1
+SQLITE_INTEGER = 1
+SQLITE_FLOAT = 2
+SQLITE_NULL = 5
+
+def load_sqlcipher_library():
+    """Load the SQLCipher C library that pysqlcipher3 is built against"""
+    candidates = []
+    try:
+        from pysqlcipher3 import _sqlite3
+        candidates.append(_sqlite3.__file__)
+    except (ImportError, AttributeError):
+        pass
+    found = ctypes.util.find_library('sqlcipher')
+    if found:
+        candidates.append(found)
+    
+    for candidate in candidates:
+        try:
+            lib = ctypes.CDLL(candidate)
+        except OSError:
+            continue
+        if not hasattr(lib, 'sqlite3_backup_init'):
+            continue
+        
+        lib.sqlite3_open_v2.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_void_p),
+                                        ctypes.c_int, ctypes.c_char_p]
+        lib.sqlite3_exec.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_void_p,
+                                     ctypes.c_void_p, ctypes.c_void_p]
+        lib.sqlite3_errmsg.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_errmsg.restype = ctypes.c_char_p
+        lib.sqlite3_close.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_backup_init.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
+                                            ctypes.c_void_p, ctypes.c_char_p]
+        lib.sqlite3_backup_init.restype = ctypes.c_void_p
+        lib.sqlite3_backup_step.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.sqlite3_backup_remaining.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_backup_pagecount.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_backup_finish.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_prepare_v2.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+                                           ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p]
+        lib.sqlite3_bind_text.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p,
+                                          ctypes.c_int, ctypes.c_void_p]
+        lib.sqlite3_bind_int64.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int64]
+        lib.sqlite3_step.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_finalize.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_stmt_status.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        lib.sqlite3_column_count.argtypes = [ctypes.c_void_p]
+        lib.sqlite3_column_type.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.sqlite3_column_int64.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.sqlite3_column_int64.restype = ctypes.c_int64
+        lib.sqlite3_column_double.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.sqlite3_column_double.restype = ctypes.c_double
+        lib.sqlite3_column_text.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.sqlite3_column_text.restype = ctypes.c_char_p
+        lib.sqlite3_db_status.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+                                          ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+        if hasattr(lib, 'sqlite3_stmt_scanstatus'):
+            lib.sqlite3_stmt_scanstatus.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+                                                    ctypes.c_void_p]
+        return lib
+    
+    raise RuntimeError("SQLCipher library with the backup API not found")
+
+def open_raw_db(lib, path, flags, profile=None):
+    """Open and key a database handle directly through the C API"""
+    handle = ctypes.c_void_p()
+    rc = lib.sqlite3_open_v2(path.encode(), ctypes.byref(handle), flags, None)
+    if rc != SQLITE_OK:
+        message = lib.sqlite3_errmsg(handle).decode() if handle else f'error {rc}'
+        lib.sqlite3_close(handle)
+        raise RuntimeError(f"Cannot open {path}: {message}")
+    
+    for pragma in storage.connection_pragmas(profile, path):
+        rc = lib.sqlite3_exec(handle, pragma.encode(), None, None, None)
+        if rc != SQLITE_OK:
+            message = lib.sqlite3_errmsg(handle).decode()
+            lib.sqlite3_close(handle)
+            raise RuntimeError(f"Cannot key {path}: {message}")
+    return handle
+
+def online_backup(source_path, dest_path, progress=None):
+    """
+    Copy a live database with the SQLite backup API.
+    
+    Pages are copied BACKUP_STEP_PAGES at a time and the source is only
+    locked during each step, so readers and writers keep going. If another
+    connection writes to the source, SQLite restarts the copy so the result
+    is always a consistent snapshot. A busy source that keeps restarting
+    the copy is finished in a single step after BACKUP_MAX_RESTARTS.
+    """
+    lib = load_sqlcipher_library()
+    source = open_raw_db(lib, source_path, SQLITE_OPEN_READONLY)
+    dest = None
+    
+    try:
+        dest = open_raw_db(lib, dest_path, SQLITE_OPEN_READWRITE | SQLITE_OPEN_CREATE)
+        
+        backup = lib.sqlite3_backup_init(dest, b'main', source, b'main')
+        if not backup:
+            raise RuntimeError(f"Backup init failed: {lib.sqlite3_errmsg(dest).decode()}")
+        
+        try:
+            step_pages = BACKUP_STEP_PAGES
+            restarts = 0
+            last_remaining = None
+            
+            while True:
+                rc = lib.sqlite3_backup_step(backup, step_pages)
+                remaining = lib.sqlite3_backup_remaining(backup)
+                
+                if last_remaining is not None and remaining > last_remaining:
+                    restarts += 1
+                    if restarts >= BACKUP_MAX_RESTARTS:
+                        step_pages = -1
+                last_remaining = remaining
+                
+                if progress:
+                    total = lib.sqlite3_backup_pagecount(backup)
+                    progress(total - remaining, total)
+                
+                if rc == SQLITE_DONE:
+                    break
+                if rc not in (SQLITE_OK, SQLITE_BUSY, SQLITE_LOCKED):
+                    raise RuntimeError(f"Backup step failed: {lib.sqlite3_errmsg(dest).decode()}")
+                
+                time.sleep(BACKUP_STEP_SLEEP)
+        finally:
+            rc = lib.sqlite3_backup_finish(backup)
+        
+        if rc != SQLITE_OK:
+            raise RuntimeError(f"Backup failed: {lib.sqlite3_errmsg(dest).decode()}")
+    finally:
+        if dest:
+            lib.sqlite3_close(dest)
+        lib.sqlite3_close(source)
+
+def verify_backup(path, raw_key=None):
+    """Check a backup copy with cipher_integrity_check and quick_check, returns list of errors"""
+    conn = storage.get_db('maintenance', path, raw_key)
+    try:
+        # cipher_integrity_check returns one row per page that fails its HMAC
+        errors = [row[0] for row in conn.execute('PRAGMA cipher_integrity_check').fetchall()]
+        
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+        if result != 'ok':
+            errors.append(result)
+    except sqlite.DatabaseError as e:
+        errors = [str(e)]
+    finally:
+        conn.close()
+    return errors
+
 def backup_db(output_path=None):
-    """Create encrypted backup of database"""
+    """Create a consistent encrypted backup of the live database"""
+    if not os.path.exists(storage.DB_PATH):
+        print(f"Error: Database not found: {storage.DB_PATH}")
+        sys.exit(1)
+    
     # Create backup directory if it doesn't exist
     os.makedirs(BACKUP_DIR, exist_ok=True)
     
@@ -180,53 +758,1229 @@ def backup_db(output_path=None):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         output_path = os.path.join(BACKUP_DIR, f'znc_logs_backup_{timestamp}.db')
     
+    # Write to a temporary name so a failed or unverified backup never
+    # looks like a good one
+    partial_path = output_path + '.partial'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    
     print(f"\nCreating backup: {output_path}")
     
+    def report(done, total):
+        percent = done * 100 / total if total else 100
+        print(f"  Copied {done:,} / {total:,} pages ({percent:.0f}%)", end='\r', flush=True)
+    
     try:
-        shutil.copy2(DB_PATH, output_path)
+        online_backup(storage.DB_PATH, partial_path, report)
+        print()
+        
+        print("  Verifying backup...")
+        errors = verify_backup(partial_path)
+        if errors:
+            print(f"✗ Backup verification failed: {len(errors)} problem(s)")
+            for error in errors[:5]:
+                print(f"  {error}")
+            os.remove(partial_path)
+            return False
+        
+        os.replace(partial_path, output_path)
         
         backup_size = os.path.getsize(output_path)
-        print(f"✓ Backup created successfully")
+        print(f"✓ Backup created and verified successfully")
         print(f"  Size: {backup_size / (1024*1024):.2f} MB")
         print(f"  Path: {os.path.abspath(output_path)}")
-        
+    
     except Exception as e:
+        print()
         print(f"✗ Backup failed: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return False
+    
+    return True
+
+def list_chains():
+    """Return incremental backup chains as [(chain_dir, [manifest, ...]), ...], oldest first"""
+    chains = []
+    if not os.path.isdir(BACKUP_DIR):
+        return chains
+    
+    for name in sorted(os.listdir(BACKUP_DIR)):
+        chain_dir = os.path.join(BACKUP_DIR, name)
+        if not name.startswith('chain_') or not os.path.isdir(chain_dir):
+            continue
+        
+        # A link only counts once its manifest has been written
+        manifests = []
+        for filename in sorted(os.listdir(chain_dir)):
+            if filename.endswith('.json'):
+                with open(os.path.join(chain_dir, filename), 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+        
+        if manifests and manifests[0]['type'] == 'base':
+            chains.append((chain_dir, manifests))
+    
+    return chains
+
+def read_database_pages(page_size):
+    """
+    Yield (page_number, page_bytes) for the raw, still encrypted database file.
+    
+    Must be called while a connection holds a read transaction: writers cannot
+    change the main file until it ends (rollback journal), and checkpoints
+    cannot backfill into it (WAL, after a truncating checkpoint).
+    """
+    with open(storage.DB_PATH, 'rb') as f:
+        page_number = 0
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            page_number += 1
+            yield page_number, page
+
+def begin_snapshot_read(conn):
+    """Start a read transaction that pins the main database file"""
+    journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    wal_path = storage.DB_PATH + '-wal'
+    
+    for _ in range(BACKUP_SNAPSHOT_RETRIES):
+        if journal_mode == 'wal':
+            # Move everything into the main file first, so our snapshot
+            # does not depend on frames in the WAL
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        
+        conn.execute('BEGIN')
+        conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        
+        if journal_mode != 'wal' or not os.path.exists(wal_path) or os.path.getsize(wal_path) == 0:
+            return
+        
+        # A writer committed between the checkpoint and our read; try again
+        conn.rollback()
+        time.sleep(BACKUP_STEP_SLEEP)
+    
+    raise RuntimeError("Could not get a quiet snapshot of the database, try again later")
+
+def incremental_backup(force_full=False):
+    """Store only the pages changed since the previous backup in the current chain"""
+    if not os.path.exists(storage.DB_PATH):
+        print(f"Error: Database not found: {storage.DB_PATH}")
+        sys.exit(1)
+    
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    
+    conn = get_db()
+    conn.isolation_level = None
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    
+    with open(storage.DB_PATH, 'rb') as f:
+        salt = f.read(16).hex()
+    
+    # Decide whether this run extends the newest chain or starts a new one
+    chains = list_chains()
+    chain_dir, manifests = chains[-1] if chains else (None, [])
+    reason = None
+    if force_full:
+        reason = 'forced with --full'
+    elif not manifests:
+        reason = 'no previous chain'
+    else:
+        base_age = datetime.now() - datetime.fromisoformat(manifests[0]['created'])
+        if base_age > timedelta(days=BACKUP_FULL_INTERVAL_DAYS):
+            reason = f'base is older than {BACKUP_FULL_INTERVAL_DAYS} days'
+        elif len(manifests) > BACKUP_MAX_CHAIN_LENGTH:
+            reason = f'chain has {BACKUP_MAX_CHAIN_LENGTH} incremental backups'
+        elif manifests[-1]['page_size'] != page_size or manifests[-1]['salt'] != salt:
+            reason = 'database was rebuilt or rekeyed'
+    
+    created = datetime.now()
+    if reason:
+        chain_dir = os.path.join(BACKUP_DIR, f"chain_{created.strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(chain_dir)
+        previous_hashes = b''
+        seq = 0
+        print(f"\nStarting new backup chain ({reason}): {chain_dir}")
+    else:
+        with open(os.path.join(chain_dir, manifests[-1]['hashes']), 'rb') as f:
+            previous_hashes = f.read()
+        seq = manifests[-1]['seq'] + 1
+        print(f"\nCreating incremental backup #{seq} in: {chain_dir}")
+    
+    kind = 'base' if seq == 0 else 'incr'
+    stem = f'{seq:04d}_{kind}'
+    data_name = f'{stem}.db' if kind == 'base' else f'{stem}.pages'
+    data_path = os.path.join(chain_dir, data_name)
+    hashes_path = os.path.join(chain_dir, f'{stem}.hashes')
+    
+    hashes = bytearray()
+    changed = 0
+    page_count = 0
+    
+    try:
+        begin_snapshot_read(conn)
+        try:
+            with open(data_path + '.partial', 'wb') as out:
+                for page_number, page in read_database_pages(page_size):
+                    digest = hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+                    hashes += digest
+                    page_count = page_number
+                    
+                    offset = (page_number - 1) * PAGE_HASH_SIZE
+                    if kind == 'base':
+                        out.write(page)
+                        changed += 1
+                    elif previous_hashes[offset:offset + PAGE_HASH_SIZE] != digest:
+                        out.write(struct.pack('>I', page_number))
+                        out.write(page)
+                        changed += 1
+                    
+                    if page_number % 10000 == 0:
+                        print(f"  Scanned {page_number:,} pages, {changed:,} changed", end='\r', flush=True)
+        finally:
+            conn.rollback()
+            conn.close()
+        
+        with open(hashes_path + '.partial', 'wb') as f:
+            f.write(hashes)
+        os.replace(data_path + '.partial', data_path)
+        os.replace(hashes_path + '.partial', hashes_path)
+        
+        # The manifest is written last; its presence marks the link as complete
+        manifest = {
+            'seq': seq,
+            'type': 'base' if kind == 'base' else 'incremental',
+            'created': created.isoformat(timespec='seconds'),
+            'page_size': page_size,
+            'page_count': page_count,
+            'changed_pages': changed,
+            'salt': salt,
+            'data': data_name,
+            'hashes': os.path.basename(hashes_path),
+        }
+        with open(os.path.join(chain_dir, f'{stem}.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    
+    except Exception as e:
+        print()
+        print(f"✗ Incremental backup failed: {e}")
+        for path in (data_path + '.partial', hashes_path + '.partial'):
+            if os.path.exists(path):
+                os.remove(path)
         return False
     
+    stored = os.path.getsize(data_path)
+    print()
+    print(f"✓ {'Base' if kind == 'base' else 'Incremental'} backup created successfully")
+    print(f"  Pages: {page_count:,} total, {changed:,} stored")
+    print(f"  Size: {stored / (1024*1024):.2f} MB")
+    print(f"  Path: {os.path.abspath(data_path)}")
     return True
 
-def export_db(output_path=None):
-    """Export database to SQL file (WARNING: Not encrypted!)"""
+def parse_restore_point(value):
+    """Parse a --at value such as '2025-01-31', '2025-01-31 14:00' or '20250131_140000'"""
+    for fmt in ('%Y%m%d_%H%M%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        # A bare date means "as of the end of that day"
+        if fmt == '%Y-%m-%d':
+            parsed += timedelta(days=1, seconds=-1)
+        return parsed
+    raise ValueError(f"Invalid --at value: {value}")
+
+def restore_db(output_path=None, at=None, list_only=False):
+    """Rebuild the database as of a point in time from an incremental backup chain"""
+    chains = list_chains()
+    if not chains:
+        print(f"\nNo incremental backup chains found in: {BACKUP_DIR}")
+        return False
+    
+    if list_only:
+        print("\nAvailable restore points:")
+        for chain_dir, manifests in chains:
+            print(f"  {os.path.basename(chain_dir)}")
+            for manifest in manifests:
+                print(f"    {manifest['created']}  {manifest['type']:<12} "
+                      f"{manifest['changed_pages']:,} pages")
+        return True
+    
+    try:
+        target = parse_restore_point(at) if at else datetime.max
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+    
+    # Pick the newest link created at or before the requested time
+    chosen = None
+    for chain_dir, manifests in chains:
+        links = [m for m in manifests if datetime.fromisoformat(m['created']) <= target]
+        if links:
+            chosen = (chain_dir, links)
+    
+    if chosen is None:
+        print(f"Error: No backup exists at or before {at}")
+        return False
+    
+    chain_dir, links = chosen
+    point = links[-1]
+    
     if output_path is None:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_path = f'znc_logs_export_{timestamp}.sql'
+        stamp = datetime.fromisoformat(point['created']).strftime('%Y%m%d_%H%M%S')
+        output_path = f'znc_logs_restored_{stamp}.db'
+    partial_path = output_path + '.partial'
     
-    print(f"\nExporting database to: {output_path}")
-    print("WARNING: The exported SQL file will NOT be encrypted!")
+    print(f"\nRestoring backup from {point['created']} to: {output_path}")
+    print(f"  Chain: {os.path.basename(chain_dir)}, {len(links) - 1} incremental backup(s) on top of the base")
     
     try:
-        conn = get_db()
+        with open(os.path.join(chain_dir, links[0]['data']), 'rb') as src, \
+             open(partial_path, 'wb') as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            for line in conn.iterdump():
-                f.write(f"{line}\n")
+        with open(partial_path, 'r+b') as dst:
+            for manifest in links[1:]:
+                page_size = manifest['page_size']
+                record_size = 4 + page_size
+                with open(os.path.join(chain_dir, manifest['data']), 'rb') as pages:
+                    while True:
+                        record = pages.read(record_size)
+                        if len(record) < record_size:
+                            break
+                        page_number = struct.unpack('>I', record[:4])[0]
+                        dst.seek((page_number - 1) * page_size)
+                        dst.write(record[4:])
+                print(f"  Applied {manifest['created']}: {manifest['changed_pages']:,} pages")
+            
+            # The database may have shrunk after a prune or vacuum
+            dst.truncate(point['page_count'] * point['page_size'])
+        
+        print("  Verifying restored database...")
+        errors = verify_backup(partial_path)
+        if errors:
+            print(f"✗ Restored database failed verification: {len(errors)} problem(s)")
+            for error in errors[:5]:
+                print(f"  {error}")
+            os.remove(partial_path)
+            return False
+        
+        os.replace(partial_path, output_path)
+    
+    except Exception as e:
+        print(f"✗ Restore failed: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return False
+    
+    print(f"✓ Restore complete")
+    print(f"  Path: {os.path.abspath(output_path)}")
+    print("  Stop the web service and replace the database file with it to go back to this point.")
+    return True
+
+def rekey_db(key_file=None):
+    """Re-encrypt the database with a raw 256-bit key kept in a key file"""
+    if not os.path.exists(storage.DB_PATH):
+        print(f"Error: Database not found: {storage.DB_PATH}")
+        sys.exit(1)
+    
+    key_file = os.path.abspath(key_file or os.path.splitext(storage.DB_PATH)[0] + '.key')
+    if storage.DB_KEY_FILE and os.path.abspath(storage.DB_KEY_FILE) == key_file:
+        print(f"Error: The database already uses the key in {key_file}")
+        return False
+    
+    if os.path.exists(key_file):
+        # Left behind by an interrupted rekey, or prepared by hand
+        try:
+            raw_key = storage.read_key_file(key_file)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return False
+        print(f"\nUsing existing key file: {key_file}")
+    else:
+        raw_key = secrets.token_hex(32)
+        # Created readable by the owner only, never world-readable even briefly
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            f.write(raw_key + '\n')
+        print(f"\n✓ New raw key written to: {key_file}")
+    
+    rekeyed_path = storage.DB_PATH + '.rekey'
+    if os.path.exists(rekeyed_path):
+        os.remove(rekeyed_path)
+    
+    print(f"Re-encrypting {storage.DB_PATH}...")
+    print("  Stop the web service and imports first: changes made meanwhile are not carried over.")
+    
+    total = os.path.getsize(storage.DB_PATH)
+    finished = threading.Event()
+    
+    def report():
+        while not finished.wait(0.5):
+            written = os.path.getsize(rekeyed_path) if os.path.exists(rekeyed_path) else 0
+            percent = min(written * 100 / total, 99) if total else 99
+            print(f"  Written {written / (1024*1024):,.1f} / {total / (1024*1024):,.1f} MB ({percent:.0f}%)",
+                  end='\r', flush=True)
+    
+    reporter = threading.Thread(target=report, daemon=True)
+    conn = get_db()
+    try:
+        conn.execute(f"ATTACH DATABASE ? AS rekeyed KEY \"x'{raw_key}'\"", (rekeyed_path,))
+        conn.execute('PRAGMA rekeyed.cipher_compatibility = 4')
+        conn.execute('PRAGMA rekeyed.auto_vacuum = INCREMENTAL')
+        reporter.start()
+        
+        # Copies schema and data into the attached database, encrypting every
+        # page with the new key; the original stays untouched until verified
+        conn.execute("SELECT sqlcipher_export('rekeyed')")
+        conn.execute('DETACH DATABASE rekeyed')
+    except sqlite.Error as e:
+        finished.set()
+        conn.close()
+        print()
+        print(f"✗ Re-encryption failed: {e}")
+        if os.path.exists(rekeyed_path):
+            os.remove(rekeyed_path)
+        return False
+    
+    finished.set()
+    if reporter.is_alive():
+        reporter.join()
+    conn.close()
+    written = os.path.getsize(rekeyed_path)
+    print(f"  Written {written / (1024*1024):,.1f} MB (100%)" + ' ' * 30)
+    
+    print("  Verifying re-encrypted database...")
+    errors = verify_backup(rekeyed_path, raw_key)
+    if errors:
+        print(f"✗ Re-encrypted database failed verification: {len(errors)} problem(s)")
+        for error in errors[:5]:
+            print(f"  {error}")
+        os.remove(rekeyed_path)
+        return False
+    
+    # Keep the original, still readable with the old key, until the new one
+    # is known to work
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    previous_path = os.path.join(BACKUP_DIR, f'znc_logs_before_rekey_{timestamp}.db')
+    shutil.move(storage.DB_PATH, previous_path)
+    os.replace(rekeyed_path, storage.DB_PATH)
+    
+    print(f"✓ Database re-encrypted with the raw key")
+    print(f"  Previous database (old key): {os.path.abspath(previous_path)}")
+    print("\nNext steps:")
+    print(f"  1. Set DB_KEY_FILE = '{key_file}' in storage.py")
+    print("  2. Restart the web service")
+    print("  3. Start a new backup chain: python3 db_utils.py backup --incremental --full")
+    print("\n⚠ Back up the key file separately: the database cannot be opened without it.")
+    return True
+
+def open_export_file(path, compress):
+    """Open a text file for writing through the chosen compressor; returns (file, path)"""
+    if compress == 'gz':
+        path += '.gz'
+        return gzip.open(path, 'wt', encoding='utf-8', compresslevel=6), path
+    if compress == 'xz':
+        path += '.xz'
+        return lzma.open(path, 'wt', encoding='utf-8'), path
+    if compress == 'zst':
+        path += '.zst'
+        writer = zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'), closefd=True)
+        return io.TextIOWrapper(writer, encoding='utf-8'), path
+    return open(path, 'w', encoding='utf-8'), path
+
+def safe_filename(name):
+    """Make a network or channel name safe to use as a path component"""
+    return name.replace(os.sep, '_') or '_'
+
+def export_channel(network_id, channel_name, filters, fmt, compress, output_dir):
+    """Stream one channel to its own export file(s); returns (lines, bytes written)"""
+    where = 'network_id = ? AND channel_name = ?'
+    params = [network_id, channel_name]
+    if filters.get('since'):
+        where += ' AND log_date >= ?'
+        params.append(filters['since'])
+    if filters.get('until'):
+        where += ' AND log_date <= ?'
+        params.append(filters['until'])
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT log_date, line_number, znc_user, content
+        FROM log_entries
+        WHERE {where}
+        ORDER BY log_date, line_number
+    ''', params)
+    
+    lines = 0
+    written = []
+    channel_dir = os.path.join(output_dir, safe_filename(network_id))
+    
+    try:
+        if fmt == 'ndjson':
+            out = None
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                if out is None:
+                    os.makedirs(channel_dir, exist_ok=True)
+                    out, path = open_export_file(
+                        os.path.join(channel_dir, f'{safe_filename(channel_name)}.ndjson'), compress)
+                    written.append(path)
+                for log_date, line_number, znc_user, content in rows:
+                    out.write(json.dumps({
+                        'network': network_id,
+                        'channel': channel_name,
+                        'date': log_date,
+                        'line': line_number,
+                        'znc_user': znc_user,
+                        'content': content,
+                    }, ensure_ascii=False))
+                    out.write('\n')
+                lines += len(rows)
+            if out is not None:
+                out.close()
+        
+        elif fmt == 'text':
+            # Same layout as ZNC's network-level log module, so an export can be
+            # imported again by pointing ZNC_DATA_PATH at the export directory
+            open_days = {}
+            current_date = None
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                for log_date, line_number, znc_user, content in rows:
+                    if log_date != current_date:
+                        for out in open_days.values():
+                            out.close()
+                        open_days = {}
+                        current_date = log_date
+                    out = open_days.get(znc_user)
+                    if out is None:
+                        day_dir = os.path.join(output_dir, 'users', safe_filename(znc_user or 'unknown'),
+                                               'networks', safe_filename(network_id),
+                                               'moddata', 'log', safe_filename(channel_name))
+                        os.makedirs(day_dir, exist_ok=True)
+                        out, path = open_export_file(os.path.join(day_dir, f'{log_date}.log'), compress)
+                        open_days[znc_user] = out
+                        written.append(path)
+                    out.write(content)
+                    out.write('\n')
+                lines += len(rows)
+            for out in open_days.values():
+                out.close()
         
+        elif fmt == 'parquet':
+            codec = {'gz': 'gzip', 'zst': 'zstd', 'none': 'none'}[compress]
+            schema = pyarrow.schema([
+                ('network', pyarrow.string()),
+                ('channel', pyarrow.string()),
+                ('date', pyarrow.string()),
+                ('line', pyarrow.int32()),
+                ('znc_user', pyarrow.string()),
+                ('content', pyarrow.string()),
+            ])
+            writer = None
+            group = []
+            
+            def flush():
+                columns = list(zip(*group))
+                writer.write_table(pyarrow.table([
+                    pyarrow.array([network_id] * len(group), pyarrow.string()),
+                    pyarrow.array([channel_name] * len(group), pyarrow.string()),
+                    pyarrow.array(columns[0], pyarrow.string()),
+                    pyarrow.array(columns[1], pyarrow.int32()),
+                    pyarrow.array(columns[2], pyarrow.string()),
+                    pyarrow.array(columns[3], pyarrow.string()),
+                ], names=schema.names))
+                group.clear()
+            
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                if writer is None:
+                    os.makedirs(channel_dir, exist_ok=True)
+                    path = os.path.join(channel_dir, f'{safe_filename(channel_name)}.parquet')
+                    writer = pyarrow.parquet.ParquetWriter(path, schema, compression=codec)
+                    written.append(path)
+                group.extend(rows)
+                lines += len(rows)
+                if len(group) >= PARQUET_ROW_GROUP_SIZE:
+                    flush()
+            if writer is not None:
+                if group:
+                    flush()
+                writer.close()
+    finally:
         conn.close()
+    
+    return lines, sum(os.path.getsize(path) for path in written)
+
+def export_sql(output_path, compress):
+    """Dump the whole database as SQL statements through a compressor"""
+    conn = get_db()
+    try:
+        out, output_path = open_export_file(output_path, compress)
+        with out:
+            for line in conn.iterdump():
+                out.write(f"{line}\n")
+    finally:
+        conn.close()
+    return output_path
+
+def export_db(output_path=None, fmt='sql', compress='gz', network=None, channel=None,
+              since=None, until=None, workers=EXPORT_WORKERS):
+    """Export logs, optionally filtered, as SQL, NDJSON, ZNC text or Parquet (WARNING: Not encrypted!)"""
+    filtered = network or channel or since or until
+    if fmt == 'sql' and filtered:
+        print("Error: --network, --channel, --since and --until need --format ndjson, text or parquet")
+        return False
+    if compress == 'zst' and zstandard is None:
+        print("Error: zstandard module not installed (pip install zstandard)")
+        return False
+    if fmt == 'parquet':
+        if pyarrow is None:
+            print("Error: pyarrow module not installed (pip install pyarrow)")
+            return False
+        if compress == 'xz':
+            print("Error: Parquet supports gz, zst or none compression")
+            return False
+    
+    filters = {}
+    try:
+        if since:
+            filters['since'] = parse_cutoff_date(since)
+        if until:
+            filters['until'] = parse_cutoff_date(until)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    if fmt == 'sql':
+        if output_path is None:
+            output_path = f'znc_logs_export_{timestamp}.sql'
+        print(f"\nExporting database to: {output_path}")
+        print("WARNING: The exported SQL file will NOT be encrypted!")
+        
+        try:
+            output_path = export_sql(output_path, compress)
+        except Exception as e:
+            print(f"✗ Export failed: {e}")
+            return False
         
         export_size = os.path.getsize(output_path)
         print(f"✓ Export completed successfully")
         print(f"  Size: {export_size / (1024*1024):.2f} MB")
         print(f"  Path: {os.path.abspath(output_path)}")
+        return True
+    
+    if output_path is None:
+        output_path = f'znc_logs_export_{timestamp}'
+    
+    conn = get_db()
+    where = '1 = 1'
+    params = []
+    if network:
+        where += ' AND network_id = ?'
+        params.append(network)
+    if channel:
+        where += ' AND name = ?'
+        params.append(channel)
+    channels = conn.execute(f'''
+        SELECT network_id, name FROM channels
+        WHERE {where}
+        ORDER BY network_id, name
+    ''', params).fetchall()
+    conn.close()
+    
+    if not channels:
+        print("No channels match the given filters")
+        return False
+    
+    os.makedirs(output_path, exist_ok=True)
+    
+    date_range = f"{filters.get('since', 'start')} to {filters.get('until', 'end')}"
+    print(f"\nExporting {len(channels)} channel(s), {date_range}, as {fmt} to: {output_path}/")
+    print("WARNING: The exported files will NOT be encrypted!")
+    
+    total_lines = 0
+    total_size = 0
+    failed = 0
+    
+    # Every channel is an independent stream with its own connection and
+    # output file, so they can be read and compressed in parallel
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(export_channel, network_id, channel_name, filters, fmt, compress, output_path):
+                (network_id, channel_name)
+            for network_id, channel_name in channels
+        }
+        for future in as_completed(futures):
+            network_id, channel_name = futures[future]
+            try:
+                lines, size = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"  ✗ {network_id}/{channel_name}: {e}")
+                continue
+            total_lines += lines
+            total_size += size
+            if lines:
+                print(f"  ✓ {network_id}/{channel_name}: {lines:,} lines")
+    
+    if failed:
+        print(f"✗ Export finished with {failed} failed channel(s)")
+        return False
+    
+    print(f"✓ Export completed successfully")
+    print(f"  Lines: {total_lines:,}")
+    print(f"  Size: {total_size / (1024*1024):.2f} MB")
+    print(f"  Path: {os.path.abspath(output_path)}")
+    return True
+
+def load_workload(path):
+    """Read a workload file written by app.py, skipping malformed lines"""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠ Skipping malformed line {line_number}")
+                continue
+            if entry.get('endpoint') in ('search', 'context'):
+                entries.append(entry)
+    return entries
+
+def sample_search_terms(conn, lengths, rng):
+    """Collect real words from the logs to stand in for anonymized search terms"""
+    max_id = conn.execute('SELECT MAX(id) FROM log_entries').fetchone()[0] or 0
+    words = {}
+    
+    for _ in range(BENCH_SAMPLE_ROUNDS):
+        if not max_id or all(length in words for length in lengths):
+            break
+        for (content,) in conn.execute('SELECT content FROM log_entries WHERE id >= ? LIMIT 50',
+                                       (rng.randint(1, max_id),)):
+            for word in re.findall(r'[^\W\d_]+', content):
+                words.setdefault(len(word), set()).add(word.lower())
+    
+    # Fall back to the nearest length when no word of the exact length was seen
+    terms = {}
+    for length in lengths:
+        if not words:
+            terms[length] = ['a' * length]
+            continue
+        nearest = min(words, key=lambda n: (abs(n - length), n))
+        terms[length] = sorted(words[nearest])
+    return terms
+
+def replay_search(params, query):
+    """
+    Statements of one /api/search request, in the order app.py runs them.
+    
+    A generator that is sent the rows of every statement it yields: the
+    fuzzy variants, the days searched for rows after the facets, and the
+    inline context all depend on rows of an earlier statement.
+    """
+    tree = parse_query(query)
+    expansions = None
+    if params.get('fuzzy'):
+        expansions = {}
+        for term in fuzzy.query_words(tree):
+            lookup = fuzzy.build_lookup_query(term)
+            rows = (yield lookup) if lookup else []
+            expansions[term] = fuzzy.rank_variants(term, rows)
+    
+    filters = (params['network'], query, params.get('channel', ''), params.get('znc_user', ''))
+    start_date = rows_start = params.get('start_date')
+    end_date = params.get('end_date')
+    case_sensitive = params.get('case_sensitive', False)
+    
+    if params.get('facets'):
+        rows = yield build_facets_query(*filters, start_date, end_date, case_sensitive, expansions)
+        day_counts = {}
+        if not add_facet_counts(rows, {}, day_counts):
+            return
+        if not expansions:
+            rows_start = rows_start_date(day_counts) or start_date
+    
+    rows = yield build_search_query(*filters, rows_start, end_date, case_sensitive, expansions=expansions)
+    if params.get('context', 0) > 0:
+        for statement in build_inline_context_queries([search_result(row) for row in rows], params['context']):
+            yield statement
+
+def replay_statements(statements):
+    """Statements that do not depend on each other, as a generator like replay_search()"""
+    for statement in statements:
+        yield statement
+
+def build_workload_statements(entry, terms, rng):
+    """Turn one workload entry into the statements app.py would run for it, see replay_search()"""
+    params = entry['params']
+    
+    if entry['endpoint'] == 'search':
+        query = params.get('query')
+        if query is None:
+            query = rng.choice(terms[params.get('query_length', 0)])
+        return replay_search(params, query)
+    
+    start_line = max(1, params['line'] - params.get('lines_before', 2))
+    end_line = params['line'] + params.get('lines_after', 2)
+    return replay_statements(build_context_queries(params['network'], params['channel'], params['date'],
+                                                   start_line, end_line, params.get('znc_user')))
+
+def column_value(lib, stmt, index):
+    """Value of one column of the current row of a statement"""
+    column_type = lib.sqlite3_column_type(stmt, index)
+    if column_type == SQLITE_INTEGER:
+        return lib.sqlite3_column_int64(stmt, index)
+    if column_type == SQLITE_FLOAT:
+        return lib.sqlite3_column_double(stmt, index)
+    if column_type == SQLITE_NULL:
+        return None
+    return lib.sqlite3_column_text(stmt, index).decode('utf-8', 'replace')
+
+def run_raw_statement(lib, handle, sql, params):
+    """Run one statement through the C API, returns (rows returned, rows scanned, the rows as tuples)"""
+    stmt = ctypes.c_void_p()
+    rc = lib.sqlite3_prepare_v2(handle, sql.encode(), -1, ctypes.byref(stmt), None)
+    if rc != SQLITE_OK:
+        raise RuntimeError(lib.sqlite3_errmsg(handle).decode())
+    
+    try:
+        for index, value in enumerate(params, 1):
+            if isinstance(value, int):
+                lib.sqlite3_bind_int64(stmt, index, value)
+            else:
+                lib.sqlite3_bind_text(stmt, index, str(value).encode(), -1, SQLITE_TRANSIENT)
         
-    except Exception as e:
-        print(f"✗ Export failed: {e}")
+        # Rows are read like app.py fetches them, and later statements of a
+        # replayed search depend on them
+        columns = lib.sqlite3_column_count(stmt)
+        fetched = []
+        while True:
+            rc = lib.sqlite3_step(stmt)
+            if rc == SQLITE_ROW:
+                fetched.append(tuple(column_value(lib, stmt, index) for index in range(columns)))
+            elif rc == SQLITE_DONE:
+                break
+            else:
+                raise RuntimeError(lib.sqlite3_errmsg(handle).decode())
+        
+        if hasattr(lib, 'sqlite3_stmt_scanstatus'):
+            # Rows visited by every loop of the query plan
+            scanned = 0
+            visited = ctypes.c_int64()
+            loop = 0
+            while lib.sqlite3_stmt_scanstatus(stmt, loop, SQLITE_SCANSTAT_NVISIT, ctypes.byref(visited)) == 0:
+                scanned += visited.value
+                loop += 1
+        else:
+            scanned = lib.sqlite3_stmt_status(stmt, SQLITE_STMTSTATUS_VM_STEP, 0)
+    finally:
+        lib.sqlite3_finalize(stmt)
+    
+    return len(fetched), scanned, fetched
+
+def read_cache_counters(lib, handle):
+    """Return (page cache hits, misses) for a connection"""
+    hits, misses, highwater = ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+    lib.sqlite3_db_status(handle, SQLITE_DBSTATUS_CACHE_HIT, ctypes.byref(hits), ctypes.byref(highwater), 0)
+    lib.sqlite3_db_status(handle, SQLITE_DBSTATUS_CACHE_MISS, ctypes.byref(misses), ctypes.byref(highwater), 0)
+    return hits.value, misses.value
+
+def bench_worker(lib, db_path, jobs, reconnect):
+    """Replay workload requests from a queue, returns (samples, cache hits, cache misses)"""
+    samples = []
+    hits = misses = 0
+    handle = None if reconnect else open_raw_db(lib, db_path, SQLITE_OPEN_READONLY, 'web-read')
+    
+    try:
+        while True:
+            try:
+                endpoint, statements = jobs.get_nowait()
+            except queue.Empty:
+                break
+            
+            started = time.perf_counter()
+            if reconnect:
+                handle = open_raw_db(lib, db_path, SQLITE_OPEN_READONLY, 'web-read')
+            
+            rows = scanned = 0
+            error = False
+            fetched = None
+            try:
+                while True:
+                    try:
+                        sql, params = statements.send(fetched)
+                    except StopIteration:
+                        break
+                    statement_rows, statement_scanned, fetched = run_raw_statement(lib, handle, sql, params)
+                    rows += statement_rows
+                    scanned += statement_scanned
+            except RuntimeError:
+                error = True
+            
+            if reconnect:
+                request_hits, request_misses = read_cache_counters(lib, handle)
+                hits += request_hits
+                misses += request_misses
+                lib.sqlite3_close(handle)
+                handle = None
+            
+            samples.append((endpoint, time.perf_counter() - started, rows, scanned, error))
+    finally:
+        if handle:
+            hits, misses = read_cache_counters(lib, handle)
+            lib.sqlite3_close(handle)
+    
+    return samples, hits, misses
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize_samples(samples):
+    """Latency percentiles and row counts for a list of benchmark samples"""
+    latencies = sorted(sample[1] * 1000 for sample in samples)
+    count = len(samples)
+    return {
+        'requests': count,
+        'errors': sum(1 for sample in samples if sample[4]),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'rows_per_request': round(sum(sample[2] for sample in samples) / count, 1) if count else 0.0,
+        'scanned_per_request': round(sum(sample[3] for sample in samples) / count, 1) if count else 0.0,
+    }
+
+def bench_replay(workload_path, db_path=None, concurrency=BENCH_CONCURRENCY, reconnect=False,
+                 output_path=None, seed=0):
+    """Replay a captured query workload and report latency, rows scanned and cache hits"""
+    db_path = db_path or storage.DB_PATH
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found: {db_path}")
+        return False
+    
+    try:
+        entries = load_workload(workload_path)
+    except OSError as e:
+        print(f"Error: Cannot read workload file: {e}")
+        return False
+    if not entries:
+        print("Error: Workload file contains no search or context requests")
+        return False
+    
+    # Anonymized search terms are replaced by real words of the same length,
+    # chosen reproducibly so that runs against different databases compare
+    rng = random.Random(seed)
+    lengths = {entry['params'].get('query_length', 0) for entry in entries
+               if entry['endpoint'] == 'search' and 'query' not in entry['params']}
+    terms = {}
+    if lengths:
+        conn = storage.get_db('web-read', db_path)
+        terms = sample_search_terms(conn, lengths, rng)
+        conn.close()
+    
+    jobs = queue.Queue()
+    for entry in entries:
+        jobs.put((entry['endpoint'], build_workload_statements(entry, terms, rng)))
+    
+    lib = load_sqlcipher_library()
+    scan_metric = 'rows scanned' if hasattr(lib, 'sqlite3_stmt_scanstatus') else 'VM steps'
+    
+    print(f"\nReplaying {len(entries):,} requests against {db_path}")
+    print(f"  Concurrency: {concurrency}, {'new connection per request' if reconnect else 'persistent connections'}")
+    
+    started = time.perf_counter()
+    samples = []
+    hits = misses = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(bench_worker, lib, db_path, jobs, reconnect)
+                   for _ in range(max(1, concurrency))]
+        for future in futures:
+            worker_samples, worker_hits, worker_misses = future.result()
+            samples.extend(worker_samples)
+            hits += worker_hits
+            misses += worker_misses
+    elapsed = time.perf_counter() - started
+    
+    summary = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'workload': os.path.abspath(workload_path),
+        'database': os.path.abspath(db_path),
+        'concurrency': concurrency,
+        'reconnect': reconnect,
+        'seed': seed,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'scan_metric': scan_metric,
+        'cache_hits': hits,
+        'cache_misses': misses,
+        'cache_hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        'endpoints': {},
+    }
+    for endpoint in ('search', 'context'):
+        endpoint_samples = [sample for sample in samples if sample[0] == endpoint]
+        if endpoint_samples:
+            summary['endpoints'][endpoint] = summarize_samples(endpoint_samples)
+    summary['endpoints']['all'] = summarize_samples(samples)
+    
+    print(f"\n✓ Replayed {len(samples):,} requests in {elapsed:.2f}s ({summary['requests_per_s']} req/s)")
+    print(f"\n  {'':<9}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'rows/req':>11}{scan_metric + '/req':>20}")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"  {endpoint:<9}{stats['requests']:>8,}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['rows_per_request']:>11,.1f}"
+              f"{stats['scanned_per_request']:>20,.1f}")
+    
+    if summary['cache_hit_ratio'] is not None:
+        print(f"\n  Page cache hit ratio: {summary['cache_hit_ratio'] * 100:.1f}% "
+              f"({hits:,} hits, {misses:,} misses)")
+    errors = summary['endpoints']['all']['errors']
+    if errors:
+        print(f"  ⚠ {errors:,} request(s) failed")
+    if scan_metric == 'VM steps':
+        print("  Note: this SQLCipher build lacks SQLITE_ENABLE_STMT_SCANSTATUS, so work is "
+              "reported in VM steps instead of rows scanned")
+    
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f"  Results saved: {os.path.abspath(output_path)}")
+    
+    return True
+
+def scratch_log_rows(count, seed=0):
+    """Synthetic log lines for the scratch database used by 'bench --profiles'"""
+    rng = random.Random(seed)
+    words = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(2, 9))) for _ in range(5000)]
+    first_day = datetime(2024, 1, 1)
+    
+    rows = []
+    for i in range(count):
+        log_date = (first_day + timedelta(days=i * 365 // count)).strftime('%Y-%m-%d')
+        content = (f"[{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}] "
+                   f"<nick{rng.randrange(50)}> " + ' '.join(rng.choices(words, k=rng.randint(3, 15))))
+        rows.append((f'net{i % 4}', f'#chan{rng.randrange(20)}', log_date, i + 1, content, 'bench'))
+    return rows
+
+def time_read_workload(db_path, statements, profile):
+    """Run every app.py query on its own connection, like web requests; returns seconds"""
+    started = time.perf_counter()
+    for sql, params in statements:
+        conn = storage.get_db(profile, db_path)
+        try:
+            conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    return time.perf_counter() - started
+
+def time_import_workload(path, rows, profile):
+    """Insert rows into a new scratch database in import-sized batches; returns seconds"""
+    if os.path.exists(path):
+        os.remove(path)
+    
+    conn = storage.get_db(profile, path)
+    try:
+        storage.init_db(conn)
+        started = time.perf_counter()
+        for start in range(0, len(rows), BENCH_PROFILE_BATCH_SIZE):
+            conn.executemany('''
+                INSERT INTO log_entries
+                (network_id, channel_name, log_date, line_number, content, znc_user)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows[start:start + BENCH_PROFILE_BATCH_SIZE])
+            conn.commit()
+        return time.perf_counter() - started
+    finally:
+        conn.close()
+
+def time_maintenance_workload(path, profile):
+    """Gather statistics, rebuild the content index and check integrity; returns seconds"""
+    conn = storage.get_db(profile, path)
+    try:
+        started = time.perf_counter()
+        conn.execute('ANALYZE')
+        conn.execute('REINDEX idx_log_content')
+        conn.commit()
+        conn.execute('PRAGMA integrity_check').fetchall()
+        return time.perf_counter() - started
+    finally:
+        conn.close()
+
+def bench_profiles(db_path=None, runs=BENCH_PROFILE_RUNS, rows=BENCH_PROFILE_ROWS, output_path=None):
+    """Compare each connection profile in storage.py with an untuned connection"""
+    db_path = db_path or storage.DB_PATH
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found: {db_path}")
+        return False
+    
+    conn = storage.get_db('web-read', db_path)
+    statements = list(plan_queries(latest_sample(conn)).values())
+    conn.close()
+    
+    # Writes go to a scratch database next to the real one, so both are on the same disk
+    scratch_dir = tempfile.mkdtemp(prefix='bench_profiles_', dir=os.path.dirname(os.path.abspath(db_path)))
+    scratch_path = os.path.join(scratch_dir, 'scratch.db')
+    log_rows = scratch_log_rows(rows)
+    
+    workloads = [
+        ('web-read', f'{len(statements)} app.py queries, one connection each',
+         lambda profile: time_read_workload(db_path, statements, profile)),
+        ('bulk-import', f'{rows:,} rows inserted in batches',
+         lambda profile: time_import_workload(scratch_path, log_rows, profile)),
+        ('maintenance', 'ANALYZE, REINDEX, integrity_check',
+         lambda profile: time_maintenance_workload(scratch_path, profile)),
+    ]
+    
+    print(f"\nComparing connection profiles with untuned connections ({runs} runs each, median shown)")
+    print(f"  Database: {db_path}")
+    print(f"\n  {'profile':<14}{'workload':<40}{'untuned ms':>12}{'tuned ms':>12}{'change':>9}")
+    
+    summary = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'database': os.path.abspath(db_path),
+        'runs': runs,
+        'rows': rows,
+        'profiles': {},
+    }
+    try:
+        for profile, description, workload in workloads:
+            untuned, tuned = [], []
+            for run in range(max(1, runs)):
+                # Alternate the order so neither side always runs on a warmer OS cache
+                if run % 2 == 0:
+                    untuned.append(workload(None))
+                    tuned.append(workload(profile))
+                else:
+                    tuned.append(workload(profile))
+                    untuned.append(workload(None))
+            
+            untuned_ms = percentile(sorted(untuned), 0.50) * 1000
+            tuned_ms = percentile(sorted(tuned), 0.50) * 1000
+            change = (tuned_ms - untuned_ms) / untuned_ms * 100 if untuned_ms else 0.0
+            summary['profiles'][profile] = {
+                'workload': description,
+                'pragmas': storage.PRAGMA_PROFILES[profile],
+                'untuned_ms': round(untuned_ms, 2),
+                'tuned_ms': round(tuned_ms, 2),
+                'change_pct': round(change, 1),
+            }
+            print(f"  {profile:<14}{description:<40}{untuned_ms:>12.1f}{tuned_ms:>12.1f}{change:>+8.0f}%")
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\n  Results saved: {os.path.abspath(output_path)}")
+    
+    return True
+
+def time_connection_setup(path, key_pragma):
+    """Open, key and read one page of a database, returns seconds"""
+    started = time.perf_counter()
+    conn = sqlite.connect(path)
+    try:
+        conn.execute(key_pragma)
+        conn.execute('PRAGMA cipher_compatibility = 4')
+        # SQLCipher derives the key on the first read, not on PRAGMA key
+        conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+    finally:
+        conn.close()
+    return time.perf_counter() - started
+
+def bench_kdf(db_path=None, connections=BENCH_KDF_CONNECTIONS, output_path=None):
+    """Compare connection setup with the DB_KEY passphrase and with a raw key"""
+    db_path = db_path or storage.DB_PATH
+    
+    # A scratch database keyed with the passphrase, so the comparison also
+    # works once the real database has been converted with rekey
+    scratch_dir = tempfile.mkdtemp(prefix='bench_kdf_', dir=os.path.dirname(os.path.abspath(db_path)))
+    scratch_path = os.path.join(scratch_dir, 'scratch.db')
+    passphrase_pragma = f"PRAGMA key = '{storage.DB_KEY}'"
+    
+    print(f"\nComparing connection setup: passphrase vs raw key ({connections} connections each)")
+    
+    try:
+        conn = sqlite.connect(scratch_path)
+        conn.execute(passphrase_pragma)
+        conn.execute('PRAGMA cipher_compatibility = 4')
+        storage.init_db(conn)
+        conn.close()
+        
+        started = time.perf_counter()
+        raw_key = storage.derive_raw_key(storage.DB_KEY, scratch_path)
+        derive_ms = (time.perf_counter() - started) * 1000
+        raw_pragma = storage.key_pragma(scratch_path, raw_key)
+        
+        passphrase, raw = [], []
+        for run in range(max(1, connections)):
+            # Alternate the order so neither side always runs second
+            if run % 2 == 0:
+                passphrase.append(time_connection_setup(scratch_path, passphrase_pragma))
+                raw.append(time_connection_setup(scratch_path, raw_pragma))
+            else:
+                raw.append(time_connection_setup(scratch_path, raw_pragma))
+                passphrase.append(time_connection_setup(scratch_path, passphrase_pragma))
+    except sqlite.DatabaseError as e:
+        print(f"✗ Benchmark failed: {e}")
+        print("  The raw key derived from DB_KEY does not open the database; check KDF_ITERATIONS in storage.py")
         return False
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    
+    summary = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'connections': connections,
+        'kdf_iterations': storage.KDF_ITERATIONS,
+        'derive_once_ms': round(derive_ms, 3),
+        'modes': {},
+    }
+    print(f"\n  {'':<12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for mode, timings in (('passphrase', passphrase), ('raw key', raw)):
+        latencies = sorted(t * 1000 for t in timings)
+        summary['modes'][mode] = {
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'max_ms': round(latencies[-1], 3),
+        }
+        stats = summary['modes'][mode]
+        print(f"  {mode:<12}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+    
+    saved = summary['modes']['passphrase']['p50_ms'] - summary['modes']['raw key']['p50_ms']
+    print(f"\n  Saved per connection: {saved:.2f} ms (every web request and CLI command opens one)")
+    print(f"  Deriving the raw key once (DERIVE_KEY_ONCE) costs {derive_ms:.2f} ms per process")
+    
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f"  Results saved: {os.path.abspath(output_path)}")
     
     return True
 
 def cleanup_backups(keep_days=30):
-    """Remove backups older than specified days"""
+    """Remove backups and backup chains older than specified days"""
     if not os.path.exists(BACKUP_DIR):
         print(f"\nNo backup directory found at: {BACKUP_DIR}")
         return
@@ -251,6 +2005,21 @@ def cleanup_backups(keep_days=30):
             removed_size += file_size
             print(f"  Removed: {filename}")
     
+    # Links in a chain depend on everything before them, so a chain is only
+    # removed as a whole once its newest link has expired. The newest chain
+    # is always kept so the next incremental backup has something to build on.
+    chains = list_chains()
+    for chain_dir, manifests in chains[:-1]:
+        newest = datetime.fromisoformat(manifests[-1]['created']).timestamp()
+        if newest >= cutoff_time:
+            continue
+        
+        chain_size = sum(os.path.getsize(os.path.join(chain_dir, f)) for f in os.listdir(chain_dir))
+        shutil.rmtree(chain_dir)
+        removed_count += 1
+        removed_size += chain_size
+        print(f"  Removed chain: {os.path.basename(chain_dir)} ({len(manifests)} backup(s))")
+    
     if removed_count > 0:
         print(f"\n✓ Cleanup complete")
         print(f"  Removed {removed_count} backup(s)")
@@ -261,29 +2030,117 @@ def cleanup_backups(keep_days=30):
 def main():
     parser = argparse.ArgumentParser(description='ZNC Log Database Utilities')
     parser.add_argument('command', 
-                       choices=['stats', 'vacuum', 'reindex', 'verify', 'export', 'backup', 'cleanup'],
+                       choices=['stats', 'vacuum', 'prune', 'reindex', 'build-terms', 'analyze', 'verify',
+                                'export', 'backup', 'restore', 'rekey', 'cleanup', 'bench'],
                        help='Command to execute')
     parser.add_argument('-o', '--output', 
-                       help='Output file path (for export/backup)')
+                       help='Output file path (for export/backup/restore/bench)')
     parser.add_argument('--keep-days', type=int, default=30,
                        help='Days to keep backups (for cleanup, default: 30)')
+    parser.add_argument('--older-than',
+                       help='Prune cutoff: age such as 90d, 12w, 6m, 1y, or a YYYY-MM-DD date (for prune)')
+    parser.add_argument('--network',
+                       help='Only prune or export this network (for prune/export)')
+    parser.add_argument('--channel',
+                       help='Only export this channel (for export)')
+    parser.add_argument('--since',
+                       help='Export from this date: YYYY-MM-DD or an age such as 90d (for export)')
+    parser.add_argument('--until',
+                       help='Export up to and including this date (for export)')
+    parser.add_argument('--format', choices=['sql', 'ndjson', 'text', 'parquet'], default='sql',
+                       help='Export format (for export, default: sql)')
+    parser.add_argument('--compress', choices=['gz', 'xz', 'zst', 'none'], default='gz',
+                       help='Compression for exported files (for export, default: gz)')
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS,
+                       help=f'Channels exported in parallel (for export, default: {EXPORT_WORKERS})')
+    parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE,
+                       help=f'Rows deleted per transaction (for prune, default: {PRUNE_BATCH_SIZE})')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Only report what would be deleted (for prune)')
+    parser.add_argument('--full', action='store_true',
+                       help='Rebuild the whole file instead of an incremental vacuum (for vacuum), '
+                            'or start a new chain (for backup --incremental)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Only store pages changed since the previous backup (for backup)')
+    parser.add_argument('--at',
+                       help='Point in time to restore, e.g. "2025-01-31 14:00" (for restore, default: latest)')
+    parser.add_argument('--list', action='store_true',
+                       help='List available restore points (for restore)')
+    parser.add_argument('--quick', action='store_true',
+                       help=f'Sample {ANALYSIS_LIMIT} rows per index instead of reading all (for analyze)')
+    parser.add_argument('--plans-only', action='store_true',
+                       help='Only record query plans and compare with the last snapshot (for analyze)')
+    parser.add_argument('--replay',
+                       help='Workload file written by app.py (for bench)')
+    parser.add_argument('--db',
+                       help='Database to run against (for bench, default: DB_PATH in storage.py)')
+    parser.add_argument('--concurrency', type=int, default=BENCH_CONCURRENCY,
+                       help=f'Parallel connections (for bench, default: {BENCH_CONCURRENCY})')
+    parser.add_argument('--reconnect', action='store_true',
+                       help='Open a new connection for every request, like app.py (for bench)')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='Seed for substituted search terms (for bench, default: 0)')
+    parser.add_argument('--profiles', action='store_true',
+                       help='Compare connection profiles with untuned connections (for bench)')
+    parser.add_argument('--runs', type=int, default=BENCH_PROFILE_RUNS,
+                       help=f'Runs per profile and workload (for bench --profiles, default: {BENCH_PROFILE_RUNS})')
+    parser.add_argument('--rows', type=int, default=BENCH_PROFILE_ROWS,
+                       help=f'Rows in the scratch database (for bench --profiles, default: {BENCH_PROFILE_ROWS})')
+    parser.add_argument('--kdf', action='store_true',
+                       help='Time connection setup with the passphrase vs a raw key (for bench)')
+    parser.add_argument('--connections', type=int, default=BENCH_KDF_CONNECTIONS,
+                       help=f'Connections per key mode (for bench --kdf, default: {BENCH_KDF_CONNECTIONS})')
+    parser.add_argument('--key-file',
+                       help='Raw key file to create or use (for rekey, default: next to the database)')
+    parser.add_argument('--pages', type=int,
+                       help='Maximum number of free pages to release (for vacuum)')
+    parser.add_argument('--rebuild', action='store_true',
+                       help='Empty the term dictionary and read every line again (for build-terms)')
     
     args = parser.parse_args()
     
     if args.command == 'stats':
         show_stats()
     elif args.command == 'vacuum':
-        vacuum_db()
+        vacuum_db(args.full, args.pages)
+    elif args.command == 'prune':
+        if not args.older_than:
+            print("Error: --older-than is required for prune")
+            sys.exit(1)
+        prune_db(args.older_than, args.network, args.batch_size, args.dry_run)
     elif args.command == 'reindex':
         reindex_db()
+    elif args.command == 'build-terms':
+        build_terms_db(args.rebuild)
+    elif args.command == 'analyze':
+        analyze_db(args.quick, args.plans_only)
     elif args.command == 'verify':
         verify_db()
     elif args.command == 'backup':
-        backup_db(args.output)
+        if args.incremental:
+            incremental_backup(args.full)
+        else:
+            backup_db(args.output)
+    elif args.command == 'restore':
+        restore_db(args.output, args.at, args.list)
+    elif args.command == 'rekey':
+        rekey_db(args.key_file)
     elif args.command == 'export':
-        export_db(args.output)
+        export_db(args.output, args.format, args.compress, args.network, args.channel,
+                  args.since, args.until, args.workers)
     elif args.command == 'cleanup':
         cleanup_backups(args.keep_days)
+    elif args.command == 'bench':
+        if args.profiles:
+            bench_profiles(args.db, args.runs, args.rows, args.output)
+            return
+        if args.kdf:
+            bench_kdf(args.db, args.connections, args.output)
+            return
+        if not args.replay:
+            print("Error: --replay, --profiles or --kdf is required for bench")
+            sys.exit(1)
+        bench_replay(args.replay, args.db, args.concurrency, args.reconnect, args.output, args.seed)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Typo-tolerant search terms
+
+'db_utils.py build-terms' reads the words of every log line into
+term_dictionary, with how often each occurs, and stores every string that
+is at most FUZZY_MAX_DISTANCE deletions away from the start of each word in
+term_deletes (symmetric delete spelling correction). A search term is
+expanded by computing the same deletions of the term and looking them up in
+term_deletes: a handful of primary key lookups, whatever the size of the
+logs. Candidates are then checked with the real edit distance.
+
+After the first build, import_logs.py adds the words of newly imported
+lines at the end of every import.
+"""
+
+import re
+from collections import Counter
+
+# Largest edit distance of a variant; terms shorter than 5 characters get
+# at most 1, and terms shorter than FUZZY_MIN_LENGTH are never expanded
+FUZZY_MAX_DISTANCE = 2
+FUZZY_MIN_LENGTH = 3
+
+# Only the first characters of a word are used for deletions, which keeps
+# term_deletes small; longer words are checked in full afterwards
+FUZZY_PREFIX_LENGTH = 7
+
+# Variants searched per term, closest and most frequent first
+FUZZY_MAX_VARIANTS = 8
+
+# Words seen fewer times than this are left out of term_deletes; most of
+# them are typos themselves
+FUZZY_MIN_FREQUENCY = 2
+
+# Longest word stored in the dictionary
+TERM_MAX_LENGTH = 32
+
+# Log lines read per batch by build_terms()
+TERM_BATCH_SIZE = 20000
+
+# Words of a log line, after its "[HH:MM:SS] " timestamp
+WORD = re.compile(r"\w[\w'-]*")
+TIMESTAMP = re.compile(r'^\[\d\d:\d\d:\d\d\] ')
+
+def line_terms(content):
+    """Dictionary words of one log line"""
+    words = WORD.findall(TIMESTAMP.sub('', content, count=1).lower())
+    return [word for word in words
+            if FUZZY_MIN_LENGTH <= len(word) <= TERM_MAX_LENGTH and not word.isdigit()]
+
+def deletes(word, distance):
+    """Every string made by deleting up to distance characters of word, word included"""
+    found = {word}
+    edge = {word}
+    for _ in range(distance):
+        edge = {variant[:i] + variant[i + 1:] for variant in edge for i in range(len(variant))} - found
+        found |= edge
+    return found
+
+def edit_distance(a, b):
+    """Damerau-Levenshtein distance (adjacent transpositions count as one edit)"""
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+def max_distance(term):
+    """Edit distance allowed for a term of this length"""
+    if len(term) < FUZZY_MIN_LENGTH:
+        return 0
+    if len(term) < 5:
+        return min(1, FUZZY_MAX_DISTANCE)
+    return FUZZY_MAX_DISTANCE
+
+def build_lookup_query(term):
+    """Build the lookup of a lower case term in term_deletes; returns (sql, params), None if it is not expanded"""
+    distance = max_distance(term)
+    if not distance or not WORD.fullmatch(term):
+        return None
+    
+    variants = sorted(deletes(term[:FUZZY_PREFIX_LENGTH], distance))
+    placeholders = ', '.join('?' * len(variants))
+    sql_query = f'''
+        SELECT DISTINCT t.term, t.frequency
+        FROM term_deletes d
+        JOIN term_dictionary t ON t.term = d.term
+        WHERE d.variant IN ({placeholders})
+    '''
+    return sql_query, variants
+
+def expand_term(conn, term):
+    """Variants of a term within its edit distance, as [(variant, distance)] with the term itself first"""
+    term = term.lower()
+    lookup = build_lookup_query(term)
+    if lookup is None:
+        return [(term, 0)]
+    return rank_variants(term, conn.execute(*lookup).fetchall())
+
+def rank_variants(term, rows):
+    """Variants of a lower case term among the (word, frequency) rows of build_lookup_query()"""
+    distance = max_distance(term)
+    candidates = []
+    for candidate, frequency in rows:
+        if candidate == term or abs(len(candidate) - len(term)) > distance:
+            continue
+        candidate_distance = edit_distance(term, candidate)
+        if candidate_distance <= distance:
+            candidates.append((candidate_distance, -frequency, candidate))
+    
+    candidates.sort()
+    return [(term, 0)] + [(candidate, d) for d, _, candidate in candidates[:FUZZY_MAX_VARIANTS - 1]]
+
+def query_words(tree):
+    """Lower case words and nicks of a parsed query, in order and without repeats"""
+    words = []
+    
+    def visit(node):
+        if node[0] in ('and', 'or'):
+            for child in node[1]:
+                visit(child)
+        elif node[0] == 'not':
+            visit(node[1])
+        elif node[0] in ('text', 'nick') and node[1].lower() not in words:
+            words.append(node[1].lower())
+    
+    visit(tree)
+    return words
+
+def expand_query(conn, tree):
+    """Variants of every word and nick of a parsed query, {term: [(variant, distance)]}"""
+    return {term: expand_term(conn, term) for term in query_words(tree)}
+
+def index_new_terms(conn):
+    """Add the deletions of words that reached FUZZY_MIN_FREQUENCY to term_deletes, returns how many words"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT term FROM term_dictionary WHERE indexed = 0 AND frequency >= ?',
+                   (FUZZY_MIN_FREQUENCY,))
+    terms = [row[0] for row in cursor.fetchall()]
+    
+    for start in range(0, len(terms), TERM_BATCH_SIZE):
+        batch = terms[start:start + TERM_BATCH_SIZE]
+        cursor.executemany('INSERT OR IGNORE INTO term_deletes (variant, term) VALUES (?, ?)',
+                           [(variant, term) for term in batch
+                            for variant in deletes(term[:FUZZY_PREFIX_LENGTH], max_distance(term))])
+        cursor.executemany('UPDATE term_dictionary SET indexed = 1 WHERE term = ?', [(term,) for term in batch])
+        conn.commit()
+    return len(terms)
+
+def build_terms(conn, rebuild=False, progress=None):
+    """
+    Add the words of log lines not read before to the term dictionary.
+    
+    With rebuild, the dictionary is emptied and every line is read again,
+    which also drops words of pruned lines. progress(lines_read) is called
+    after every batch. Returns (lines read, new words indexed).
+    """
+    cursor = conn.cursor()
+    if rebuild:
+        cursor.execute('DELETE FROM term_deletes')
+        cursor.execute('DELETE FROM term_dictionary')
+        cursor.execute("DELETE FROM import_metadata WHERE key = 'terms_last_id'")
+        conn.commit()
+    
+    cursor.execute("SELECT value FROM import_metadata WHERE key = 'terms_last_id'")
+    row = cursor.fetchone()
+    last_id = int(row[0]) if row else 0
+    
+    lines = 0
+    while True:
+        cursor.execute('SELECT id, content FROM log_entries WHERE id > ? ORDER BY id LIMIT ?',
+                       (last_id, TERM_BATCH_SIZE))
+        batch = cursor.fetchall()
+        if not batch:
+            break
+        
+        counts = Counter()
+        for _, content in batch:
+            counts.update(line_terms(content))
+        last_id = batch[-1][0]
+        lines += len(batch)
+        
+        # Counts and position are committed together, so an interrupted
+        # build continues where it stopped without counting lines twice
+        cursor.executemany('''
+            INSERT INTO term_dictionary (term, frequency) VALUES (?, ?)
+            ON CONFLICT(term) DO UPDATE SET frequency = frequency + excluded.frequency
+        ''', counts.items())
+        cursor.execute('''
+            INSERT OR REPLACE INTO import_metadata (key, value)
+            VALUES ('terms_last_id', ?)
+        ''', (str(last_id),))
+        conn.commit()
+        
+        if progress:
+            progress(lines)
+    
+    return lines, index_new_terms(conn)
+
+def terms_built(conn):
+    """Whether build_terms() has run on this database"""
+    row = conn.execute("SELECT 1 FROM import_metadata WHERE key = 'terms_last_id'").fetchone()
+    return row is not None
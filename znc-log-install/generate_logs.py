@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic ZNC logs for import and search benchmarks
+
+Writes a ZNC data directory with the same layout as the network-level log
+module, which import_logs.py reads like a real bouncer:
+
+    <output>/users/<user>/networks/<network>/moddata/log/<channel>/YYYY-MM-DD.log
+
+Days contain timestamped messages, actions, joins, parts, quits and nick
+changes. Words follow a Zipf-like distribution over a fixed vocabulary, and
+channels and nicks have Zipf-like activity, so index selectivity looks like
+real traffic: a few very common words and channels, and a long tail.
+
+Output is deterministic for a given --seed, so two benchmark runs on the
+same settings search exactly the same data.
+
+Usage:
+    python3 generate_logs.py --output DIR --lines 10M [options]
+
+Options:
+    --lines      Total number of lines, e.g. 500k, 10M, 100M, 1B
+    --users      ZNC users (default: 1)
+    --networks   Networks per user (default: 2)
+    --channels   Channels per network (default: 20)
+    --days       Days of history, ending at --end-date (default: 365)
+    --compress   Also compress files older than 30 days: gz, xz (default: none)
+    --workers    Channels generated in parallel (default: CPU count)
+    --seed       Random seed (default: 1)
+"""
+
+import os
+import sys
+import gzip
+import lzma
+import random
+import argparse
+from functools import lru_cache
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Vocabulary size and Zipf exponent for message words
+VOCABULARY_SIZE = 50000
+WORD_ZIPF_EXPONENT = 1.07
+
+# Activity skew between channels and between nicks within a channel
+CHANNEL_ZIPF_EXPONENT = 0.8
+NICK_ZIPF_EXPONENT = 1.2
+NICKS_PER_CHANNEL = 60
+
+# Share of each line type; the remainder are normal messages
+EVENT_MIX = {
+    'action': 0.03,
+    'join': 0.03,
+    'part': 0.015,
+    'quit': 0.015,
+    'nick': 0.005,
+}
+
+# Files older than this many days are compressed when --compress is given
+ARCHIVE_AFTER_DAYS = 30
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'shi', 'po', 'an', 'el', 'or', 'ix',
+             'ber', 'dra', 'ven', 'tor', 'qu', 'zy', 'sol', 'mar', 'ing', 'ed', 'ly', 'st']
+NETWORK_NAMES = ['libera', 'oftc', 'efnet', 'rizon', 'quakenet', 'undernet', 'ircnet', 'hackint']
+TOPIC_WORDS = ['linux', 'python', 'rust', 'debian', 'znc', 'help', 'dev', 'offtopic', 'music',
+               'games', 'security', 'networking', 'kernel', 'perl', 'chat', 'ops']
+QUIT_REASONS = ['Quit: Leaving', 'Ping timeout: 240 seconds', 'Remote host closed the connection',
+                'Client Quit', 'Read error: Connection reset by peer', 'Quit: ZNC - https://znc.in']
+
+def parse_count(value):
+    """Turn '500k', '10M', '1B' or '250000' into an integer"""
+    value = value.strip().lower().replace('_', '').replace(',', '')
+    multiplier = {'k': 1000, 'm': 1000000, 'b': 1000000000}.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid count: {value}")
+
+def make_word(rng, min_syllables=1, max_syllables=4):
+    """Build a pronounceable pseudo-word"""
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(min_syllables, max_syllables)))
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative weights of a Zipf-like distribution over ranks 1..count"""
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cum_weights.append(total)
+    return cum_weights
+
+@lru_cache(maxsize=None)
+def word_cum_weights(size):
+    """Cumulative Zipf weights for the vocabulary, computed once per process"""
+    return zipf_cum_weights(size, WORD_ZIPF_EXPONENT)
+
+@lru_cache(maxsize=None)
+def build_vocabulary(seed, size=VOCABULARY_SIZE):
+    """
+    Return the message vocabulary, most frequent word first.
+    
+    Deterministic for a seed, so the benchmark can pick search terms by
+    frequency rank without reading the generated files.
+    """
+    rng = random.Random(f'vocabulary-{seed}')
+    words = []
+    seen = set()
+    while len(words) < size:
+        # Frequent words are short, rare words are long
+        max_syllables = 2 if len(words) < 200 else 3 if len(words) < 5000 else 5
+        word = make_word(rng, 1, max_syllables)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return tuple(words)
+
+def build_layout(users, networks, channels, seed):
+    """Return [(znc_user, network, channel), ...] for the generated tree"""
+    rng = random.Random(f'layout-{seed}')
+    layout = []
+    for user_index in range(users):
+        znc_user = f'user{user_index + 1}' if users > 1 else 'bench'
+        for network_index in range(networks):
+            network = NETWORK_NAMES[network_index % len(NETWORK_NAMES)]
+            if network_index >= len(NETWORK_NAMES):
+                network += str(network_index // len(NETWORK_NAMES) + 1)
+            names = set()
+            while len(names) < channels:
+                name = '#' + rng.choice(TOPIC_WORDS)
+                if rng.random() < 0.5 or name in names:
+                    name += '-' + make_word(rng, 1, 2)
+                names.add(name)
+            for channel in sorted(names):
+                layout.append((znc_user, network, channel))
+    return layout
+
+def open_output(path, compress):
+    """Open a day file for writing, compressed if requested"""
+    if compress == 'gz':
+        return gzip.open(path + '.gz', 'wt', encoding='utf-8', compresslevel=6)
+    if compress == 'xz':
+        return lzma.open(path + '.xz', 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+def generate_channel(output, znc_user, network, channel, lines, days, end_date, compress, seed):
+    """Write every day file of one channel, returns the number of lines written"""
+    rng = random.Random(f'{seed}-{znc_user}-{network}-{channel}')
+    vocabulary = build_vocabulary(seed)
+    word_weights = word_cum_weights(len(vocabulary))
+    
+    nicks = []
+    while len(nicks) < NICKS_PER_CHANNEL:
+        nick = make_word(rng, 1, 3) + (str(rng.randint(1, 99)) if rng.random() < 0.2 else '')
+        if nick not in nicks:
+            nicks.append(nick)
+    nick_weights = zipf_cum_weights(len(nicks), NICK_ZIPF_EXPONENT)
+    
+    event_types = list(EVENT_MIX) + ['message']
+    event_weights = list(EVENT_MIX.values()) + [1.0 - sum(EVENT_MIX.values())]
+    
+    log_dir = os.path.join(output, 'users', znc_user, 'networks', network, 'moddata', 'log', channel)
+    os.makedirs(log_dir, exist_ok=True)
+    
+    # Busy and quiet days around the channel average; the last day takes the
+    # rounding remainder so the channel total is exact
+    day_weights = [rng.uniform(0.4, 1.6) for _ in range(days)]
+    total_weight = sum(day_weights)
+    day_counts = [int(lines * weight / total_weight) for weight in day_weights]
+    day_counts[-1] += lines - sum(day_counts)
+    
+    written = 0
+    for day, count in enumerate(day_counts):
+        if count <= 0:
+            continue
+        
+        log_date = end_date - timedelta(days=days - 1 - day)
+        archived = compress != 'none' and (end_date - log_date).days > ARCHIVE_AFTER_DAYS
+        path = os.path.join(log_dir, log_date.strftime('%Y-%m-%d') + '.log')
+        
+        seconds = sorted(rng.randrange(86400) for _ in range(count))
+        speakers = rng.choices(nicks, cum_weights=nick_weights, k=count)
+        events = rng.choices(event_types, weights=event_weights, k=count)
+        
+        # Draw the words of every message of the day in one call
+        lengths = [min(40, int(rng.expovariate(1 / 7)) + 1) for _ in range(count)]
+        words = rng.choices(vocabulary, cum_weights=word_weights, k=sum(lengths))
+        position = 0
+        
+        with open_output(path, compress if archived else 'none') as f:
+            for second, nick, event, length in zip(seconds, speakers, events, lengths):
+                stamp = f'[{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}]'
+                host = f'~{nick[:8]}@{nick}.users.example'
+                
+                if event == 'message' or event == 'action':
+                    text = ' '.join(words[position:position + length])
+                    position += length
+                    if rng.random() < 0.02:
+                        text += f' https://example.org/{make_word(rng)}/{rng.randint(1, 99999)}'
+                    if event == 'action':
+                        f.write(f'{stamp} * {nick} {text}\n')
+                    else:
+                        f.write(f'{stamp} <{nick}> {text}\n')
+                elif event == 'join':
+                    f.write(f'{stamp} *** Joins: {nick} ({host})\n')
+                elif event == 'part':
+                    f.write(f'{stamp} *** Parts: {nick} ({host}) ()\n')
+                elif event == 'quit':
+                    f.write(f'{stamp} *** Quits: {nick} ({host}) ({rng.choice(QUIT_REASONS)})\n')
+                else:
+                    f.write(f'{stamp} *** {nick} is now known as {nick}_\n')
+        
+        written += count
+    
+    return written
+
+def channel_line_counts(total_lines, users, networks, channels, seed):
+    """Return [(znc_user, network, channel, lines), ...] with Zipf-like busy and quiet channels"""
+    layout = build_layout(users, networks, channels, seed)
+    
+    rng = random.Random(f'shares-{seed}')
+    ranks = list(range(1, len(layout) + 1))
+    rng.shuffle(ranks)
+    shares = [1.0 / rank ** CHANNEL_ZIPF_EXPONENT for rank in ranks]
+    total_share = sum(shares)
+    counts = [int(total_lines * share / total_share) for share in shares]
+    counts[0] += total_lines - sum(counts)
+    
+    return [entry + (count,) for entry, count in zip(layout, counts)]
+
+def generate_tree(output, total_lines, users=1, networks=2, channels=20, days=365,
+                  end_date=None, compress='none', workers=None, seed=1, quiet=False):
+    """Generate a full ZNC log tree, returns the number of lines written"""
+    end_date = end_date or datetime(2024, 12, 31)
+    plan = channel_line_counts(total_lines, users, networks, channels, seed)
+    
+    if not quiet:
+        print(f"Generating {total_lines:,} lines in {len(plan)} channels over {days} days: {output}")
+    
+    written = 0
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_channel, output, znc_user, network, channel,
+                                   count, days, end_date, compress, seed)
+                   for znc_user, network, channel, count in plan]
+        for future in as_completed(futures):
+            written += future.result()
+            done += 1
+            if not quiet:
+                print(f"  {done}/{len(futures)} channels, {written:,} lines", end='\r', flush=True)
+    
+    if not quiet:
+        print()
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic ZNC logs for benchmarks')
+    parser.add_argument('--output', required=True,
+                       help='ZNC data directory to create')
+    parser.add_argument('--lines', type=parse_count, required=True,
+                       help='Total number of lines, e.g. 500k, 10M, 100M, 1B')
+    parser.add_argument('--users', type=int, default=1,
+                       help='ZNC users (default: 1)')
+    parser.add_argument('--networks', type=int, default=2,
+                       help='Networks per user (default: 2)')
+    parser.add_argument('--channels', type=int, default=20,
+                       help='Channels per network (default: 20)')
+    parser.add_argument('--days', type=int, default=365,
+                       help='Days of history (default: 365)')
+    parser.add_argument('--end-date', default='2024-12-31',
+                       help='Date of the newest log file (default: 2024-12-31)')
+    parser.add_argument('--compress', choices=['none', 'gz', 'xz'], default='none',
+                       help=f'Compress files older than {ARCHIVE_AFTER_DAYS} days (default: none)')
+    parser.add_argument('--workers', type=int,
+                       help='Channels generated in parallel (default: CPU count)')
+    parser.add_argument('--seed', type=int, default=1,
+                       help='Random seed (default: 1)')
+    args = parser.parse_args()
+    
+    try:
+        end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
+    except ValueError:
+        print(f"Error: Invalid --end-date: {args.end_date}")
+        sys.exit(1)
+    
+    started = datetime.now()
+    written = generate_tree(args.output, args.lines, args.users, args.networks, args.channels,
+                            args.days, end_date, args.compress, args.workers, args.seed)
+    elapsed = (datetime.now() - started).total_seconds()
+    
+    print(f"✓ Generated {written:,} lines in {elapsed:.1f}s")
+    print(f"  Import with ZNC_DATA_PATH = '{os.path.abspath(args.output)}'")
+
+if __name__ == '__main__':
+    main()
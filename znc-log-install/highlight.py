@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Match offsets and snippets of search results
+
+/api/search returns each log line trimmed to a snippet of about
+SNIPPET_LENGTH characters around its first hit, with the offsets of every
+hit in it. The browser then only has to wrap those ranges in <mark> tags:
+long pasted lines are not sent in full, and the query is not matched a
+second time in JavaScript. The full line comes with the context of a
+result, or with every result when a search is posted with "full_lines".
+
+Offsets count characters (code points) from the start of the returned
+content, [start, end) like a Python slice. Words are found regardless of
+case, the same way LIKE matches them in SQLite, unless the search is case
+sensitive.
+"""
+
+import re
+
+# Longest snippet of a line, in characters
+SNIPPET_LENGTH = 200
+
+# Characters kept before the first hit of a trimmed line
+SNIPPET_LEAD = 40
+
+# A snippet edge moves to the nearest space at most this many characters
+# away, so words are not cut in half
+SNIPPET_WORD_SLACK = 15
+
+def query_terms(node, expansions=None):
+    """Words, phrases and nicks a line matching a parsed query may contain, as (kind, text) pairs"""
+    terms = []
+    
+    def visit(node):
+        # Terms under a NOT are never in a matching line
+        if node[0] in ('and', 'or'):
+            for child in node[1]:
+                visit(child)
+        elif node[0] in ('text', 'nick'):
+            variants = (expansions or {}).get(node[1].lower())
+            for text in [variant for variant, _ in variants] if variants else [node[1]]:
+                if (node[0], text) not in terms:
+                    terms.append((node[0], text))
+    
+    visit(node)
+    return terms
+
+def highlight_patterns(terms, case_sensitive=False):
+    """
+    Compile the terms of query_terms() into (text pattern, nick pattern);
+    either may be None. Nicks match regardless of case, like in SQL.
+    """
+    # Longest first, so "passwords" is marked whole rather than as "password"
+    texts = sorted({text for kind, text in terms if kind == 'text'}, key=len, reverse=True)
+    nicks = sorted({text for kind, text in terms if kind == 'nick'}, key=len, reverse=True)
+    
+    text_pattern = None
+    if texts:
+        text_pattern = re.compile('|'.join(re.escape(text) for text in texts),
+                                  0 if case_sensitive else re.IGNORECASE)
+    
+    nick_pattern = None
+    if nicks:
+        # "[12:00:00] <nick> text" and "[12:00:00] * nick action", as in query_language.term_condition()
+        names = '|'.join(re.escape(nick) for nick in nicks)
+        nick_pattern = re.compile(rf'\[[^\]]*\] (?:<(?P<said>{names})> |\* (?P<action>{names}) )',
+                                  re.IGNORECASE)
+    return text_pattern, nick_pattern
+
+def find_matches(content, patterns):
+    """Sorted, non-overlapping [start, end] ranges of the hits in a line"""
+    text_pattern, nick_pattern = patterns
+    spans = []
+    if nick_pattern:
+        match = nick_pattern.match(content)
+        if match:
+            spans.append(list(match.span(match.lastgroup)))
+    if text_pattern:
+        spans.extend([match.start(), match.end()] for match in text_pattern.finditer(content))
+    
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def snippet_window(content, first):
+    """(start, end) of the part of a line to return, for a first hit at offset first"""
+    if len(content) <= SNIPPET_LENGTH:
+        return 0, len(content)
+    
+    start = max(0, min(first - SNIPPET_LEAD, len(content) - SNIPPET_LENGTH))
+    if start > 0:
+        space = content.find(' ', start, min(start + SNIPPET_WORD_SLACK, first))
+        if space != -1:
+            start = space + 1
+    
+    end = min(start + SNIPPET_LENGTH, len(content))
+    if end < len(content):
+        space = content.rfind(' ', max(end - SNIPPET_WORD_SLACK, start), end)
+        if space != -1:
+            end = space
+    return start, end
+
+def add_highlights(result, patterns, full_lines=False):
+    """Trim the content of a search_result() to a snippet and add the offsets of its hits"""
+    content = result['content']
+    matches = find_matches(content, patterns)
+    
+    # The nick is always at the start, so the snippet goes to the first word hit
+    text_pattern = patterns[0]
+    first_word = text_pattern.search(content) if text_pattern else None
+    first = first_word.start() if first_word else (matches[0][0] if matches else 0)
+    start, end = (0, len(content)) if full_lines else snippet_window(content, first)
+    
+    result['content'] = content[start:end]
+    result['content_start'] = start
+    result['content_length'] = len(content)
+    result['matches'] = [[max(match_start, start) - start, min(match_end, end) - start]
+                         for match_start, match_end in matches
+                         if match_end > start and match_start < end]
+    return result
@@ -38,19 +38,19 @@ fi
 # Determine installation paths
 APP_PATH="$USER_HOME/apps/znc_search"
 VENV_PATH="$APP_PATH/venv"  # Local venv in app directory
-ZNC_BASE_PATH="$USER_HOME/.znc/users/$CURRENT_USER/networks"
+ZNC_DATA_PATH="$USER_HOME/.znc"
 DB_PATH="$APP_PATH/znc_logs.db"
 
 echo "Installation paths:"
 echo "  Application: $APP_PATH"
 echo "  Virtual env: $VENV_PATH"
-echo "  ZNC logs:    $ZNC_BASE_PATH"
+echo "  ZNC logs:    $ZNC_DATA_PATH"
 echo "  Database:    $DB_PATH"
 echo ""
 
 # Check if ZNC logs exist
-if [ ! -d "$ZNC_BASE_PATH" ]; then
-    echo -e "${YELLOW}WARNING: ZNC log path not found at $ZNC_BASE_PATH${NC}"
+if [ ! -d "$ZNC_DATA_PATH" ]; then
+    echo -e "${YELLOW}WARNING: ZNC log path not found at $ZNC_DATA_PATH${NC}"
     echo "Make sure ZNC is installed and logging is enabled"
     echo ""
     read -p "Continue anyway? (y/n) " -n 1 -r
@@ -120,7 +120,8 @@ echo "========================================================================"
 echo ""
 # Check if DB_KEY already exists in any config file
 echo "Checking for existing encryption keys..."
-CONFIG_FILES=("$APP_PATH/app.py" "$APP_PATH/import_logs.py" "$APP_PATH/db_utils.py")
+# (storage.py holds the key; older installs kept a copy in each script)
+CONFIG_FILES=("$APP_PATH/storage.py" "$APP_PATH/app.py" "$APP_PATH/import_logs.py" "$APP_PATH/db_utils.py")
 EXISTING_KEYS=()
 DIFFERENT_KEYS=false
 
@@ -224,6 +225,18 @@ else
     SKIP_KEY_GEN=false
 fi
 
+# Raw key settings of an existing storage.py (after 'db_utils.py rekey'):
+# the database can only be opened with them, so they are carried over
+EXISTING_KEY_FILE=""
+EXISTING_DERIVE_KEY_ONCE=""
+if [ -f "$APP_PATH/storage.py" ]; then
+    EXISTING_KEY_FILE=$(grep "^DB_KEY_FILE = '[^']*'" "$APP_PATH/storage.py" | sed "s/^DB_KEY_FILE = '\([^']*\)'.*/\1/")
+    EXISTING_DERIVE_KEY_ONCE=$(grep "^DERIVE_KEY_ONCE = " "$APP_PATH/storage.py" | sed "s/^DERIVE_KEY_ONCE = \([A-Za-z]*\).*/\1/")
+    if [ -n "$EXISTING_KEY_FILE" ]; then
+        echo -e "${YELLOW}Found raw key file in storage.py: $EXISTING_KEY_FILE (kept)${NC}"
+    fi
+fi
+
 echo ""
 
 # Generate encryption key (if not using existing)
@@ -313,7 +326,7 @@ echo ""
 if [ "$SCRIPT_DIR" != "$APP_PATH" ]; then
     echo "Copying application files..."
 
-    for file in app.py import_logs.py db_utils.py requirements.txt; do
+    for file in app.py import_logs.py db_utils.py storage.py metrics.py admission.py jobs.py queries.py query_language.py fuzzy.py highlight.py asgi.py requirements.txt; do
         # Check both lowercase and capitalized versions
         if [ -f "$SCRIPT_DIR/$file" ]; then
             cp "$SCRIPT_DIR/$file" "$APP_PATH/"
@@ -342,7 +355,7 @@ if [ "$SCRIPT_DIR" != "$APP_PATH" ]; then
 else
     echo "Files already in place (running from installation directory)"
     # Verify required files exist
-    for file in app.py import_logs.py db_utils.py requirements.txt; do
+    for file in app.py import_logs.py db_utils.py storage.py metrics.py admission.py jobs.py queries.py query_language.py fuzzy.py highlight.py asgi.py requirements.txt; do
         if [ -f "$APP_PATH/$file" ]; then
             echo -e "${GREEN}✓ Found $file${NC}"
         else
@@ -354,16 +367,31 @@ else
     done
 fi
 
-# Configure app.py
-if [ -f "$APP_PATH/app.py" ]; then
+# Configure storage.py (database path and key shared by all scripts)
+if [ -f "$APP_PATH/storage.py" ]; then
     echo ""
-    echo "Configuring app.py..."
+    echo "Configuring storage.py..."
     
     # Update DB_PATH
-    sed -i "s|DB_PATH = '.*'|DB_PATH = '$DB_PATH'|g" "$APP_PATH/app.py"
+    sed -i "s|DB_PATH = '.*'|DB_PATH = '$DB_PATH'|g" "$APP_PATH/storage.py"
     
     # Update DB_KEY
-    sed -i "s|DB_KEY = '.*'|DB_KEY = '$ENCRYPTION_KEY'|g" "$APP_PATH/app.py"
+    sed -i "s|DB_KEY = '.*'|DB_KEY = '$ENCRYPTION_KEY'|g" "$APP_PATH/storage.py"
+    
+    # Keep the raw key settings of the previous storage.py
+    if [ -n "$EXISTING_KEY_FILE" ]; then
+        sed -i "s|^DB_KEY_FILE = '.*'|DB_KEY_FILE = '$EXISTING_KEY_FILE'|" "$APP_PATH/storage.py"
+    fi
+    if [ -n "$EXISTING_DERIVE_KEY_ONCE" ]; then
+        sed -i "s|^DERIVE_KEY_ONCE = .*|DERIVE_KEY_ONCE = $EXISTING_DERIVE_KEY_ONCE|" "$APP_PATH/storage.py"
+    fi
+    
+    echo -e "${GREEN}✓ storage.py configured${NC}"
+fi
+
+# Configure app.py
+if [ -f "$APP_PATH/app.py" ]; then
+    echo "Configuring app.py..."
     
     # Update secret key
     sed -i "s|app.secret_key = '.*'|app.secret_key = '$SECRET_KEY'|g" "$APP_PATH/app.py"
@@ -378,31 +406,12 @@ fi
 if [ -f "$APP_PATH/import_logs.py" ]; then
     echo "Configuring import_logs.py..."
     
-    # Update ZNC_BASE_PATH
-    sed -i "s|ZNC_BASE_PATH = '.*'|ZNC_BASE_PATH = '$ZNC_BASE_PATH'|g" "$APP_PATH/import_logs.py"
-    
-    # Update DB_PATH
-    sed -i "s|DB_PATH = '.*'|DB_PATH = '$DB_PATH'|g" "$APP_PATH/import_logs.py"
-    
-    # Update DB_KEY
-    sed -i "s|DB_KEY = '.*'|DB_KEY = '$ENCRYPTION_KEY'|g" "$APP_PATH/import_logs.py"
+    # Update ZNC_DATA_PATH
+    sed -i "s|ZNC_DATA_PATH = '.*'|ZNC_DATA_PATH = '$ZNC_DATA_PATH'|g" "$APP_PATH/import_logs.py"
     
     echo -e "${GREEN}✓ import_logs.py configured${NC}"
 fi
 
-# Configure db_utils.py
-if [ -f "$APP_PATH/db_utils.py" ]; then
-    echo "Configuring db_utils.py..."
-    
-    # Update DB_PATH
-    sed -i "s|DB_PATH = '.*'|DB_PATH = '$DB_PATH'|g" "$APP_PATH/db_utils.py"
-    
-    # Update DB_KEY
-    sed -i "s|DB_KEY = '.*'|DB_KEY = '$ENCRYPTION_KEY'|g" "$APP_PATH/db_utils.py"
-    
-    echo -e "${GREEN}✓ db_utils.py configured${NC}"
-fi
-
 # Make scripts executable
 chmod +x "$APP_PATH/import_logs.py" 2>/dev/null || true
 chmod +x "$APP_PATH/db_utils.py" 2>/dev/null || true
@@ -414,7 +423,7 @@ echo "========================================================================"
 echo ""
 
 # Ask if user wants to import logs now
-if [ -d "$ZNC_BASE_PATH" ]; then
+if [ -d "$ZNC_DATA_PATH" ]; then
     read -p "Import your ZNC logs now? This may take a while. (y/n) " -n 1 -r
     echo
     if [[ $REPLY =~ ^[Yy]$ ]]; then
@@ -568,7 +577,7 @@ echo -e "${GREEN}Configuration Summary:${NC}"
 echo "  User:          $CURRENT_USER"
 echo "  App Path:      $APP_PATH"
 echo "  Venv Path:     $VENV_PATH"
-echo "  ZNC Path:      $ZNC_BASE_PATH"
+echo "  ZNC Path:      $ZNC_DATA_PATH"
 echo "  Database:      $DB_PATH"
 echo ""
 echo -e "${YELLOW}Login Credentials:${NC}"
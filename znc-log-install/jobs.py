@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Background search jobs for the web interface
+
+A search over the full history of a busy network can take longer than the
+gunicorn worker timeout. POST /api/search/jobs runs it in a background
+thread of the worker instead and returns a job id at once; the browser then
+polls /api/search/jobs/<id> for progress and for the results found so far,
+page by page.
+
+A job searches its date range from the newest day backwards, about
+JOB_CHUNK_ROWS lines at a time, so the results found so far are already in
+their final order. The job state is written to JOBS_DIR after every chunk,
+so whichever worker answers a poll can report it. Cancelling a job leaves a
+marker file there that the running job checks between SQLite steps; every
+poll touches another one, and a job nobody polls any more stops as if
+cancelled. Heavy jobs wait for one of JOB_HEAVY_SLOTS, apart from the slots
+of synchronous searches.
+
+With facets, every chunk is counted per channel and day first; chunks
+without hits are not searched for rows at all, an exact search only looks
+at the newest days of a chunk that hold the results still missing, and
+once the results are complete the rest of the range is only counted.
+
+A fuzzy search ranks closer variants first, so an older chunk can still
+push results down the list. Its results are merged after every chunk, and
+the job's revision goes up whenever results already reported move, so the
+browser knows to fetch them again.
+"""
+
+import os
+import re
+import json
+import time
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pysqlcipher3 import dbapi2 as sqlite
+
+import storage
+import metrics
+import admission
+import fuzzy
+from queries import (SEARCH_LIMIT, build_search_query, build_date_counts_query, search_result,
+                     build_facets_query, add_facet_counts, summarize_facets, rows_start_date)
+from query_language import parse_query, query_scope
+from highlight import query_terms, highlight_patterns, add_highlights
+
+# Directory for job state files (relative to the working directory)
+JOBS_DIR = 'jobs'
+
+# Jobs running at once in each gunicorn worker; more wait in line
+JOB_THREADS = 2
+
+# Lines searched per step; the job state is written after every step
+JOB_CHUNK_ROWS = 100000
+
+# Seconds a job may run before it is stopped
+JOB_TIME_BUDGET = 900
+
+# Heavy jobs running at once across all workers. Jobs have slots of their
+# own, so long jobs never hold the HEAVY_SEARCH_SLOTS of /api/search.
+JOB_HEAVY_SLOTS = 2
+
+# A job nobody has polled for this many seconds is cancelled, e.g. after its
+# tab was closed; browsers poll from hidden tabs about once a minute
+JOB_ABANDON_SECONDS = 90
+
+# Job files are deleted this many seconds after their last update
+JOB_KEEP_SECONDS = 3600
+
+# Most results returned by one poll
+JOB_PAGE_SIZE = 200
+
+# Seconds between checks for a cancel marker while a query runs
+CANCEL_CHECK_INTERVAL = 0.25
+
+# Created on first use, so each gunicorn worker gets its own threads
+_executor = None
+_executor_lock = threading.Lock()
+
+def job_file(job_id, suffix='.json'):
+    """Path of a job's state file, or of its cancel or poll marker with suffix='.cancel' or '.polled'"""
+    return os.path.join(JOBS_DIR, job_id + suffix)
+
+def write_job(job):
+    """Write the job state; replaced atomically so a poll never reads half a file"""
+    job['updated'] = time.time()
+    path = job_file(job['id'])
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(path + '.tmp', path)
+
+def load_job(job_id):
+    """Read the state of a job, None if there is no such job"""
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', job_id):
+        return None
+    try:
+        with open(job_file(job_id), 'r', encoding='utf-8') as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    # A worker restarted by gunicorn takes its jobs with it
+    if job['status'] in ('queued', 'running') and not metrics.process_alive(job['pid']):
+        job['status'] = 'failed'
+        job['error'] = 'The server restarted while this search was running. Please search again.'
+    return job
+
+def cleanup_jobs():
+    """Delete the files of jobs not updated for JOB_KEEP_SECONDS"""
+    cutoff = time.time() - JOB_KEEP_SECONDS
+    for name in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def get_executor():
+    """Thread pool of this worker"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix='search-job')
+        return _executor
+
+def start_job(params, username):
+    """Queue a search, params as posted to /api/search; returns the new job"""
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    cleanup_jobs()
+    
+    job = {
+        'id': secrets.token_urlsafe(12),
+        'username': username,
+        'pid': os.getpid(),
+        'status': 'queued',
+        'created': time.time(),
+        'params': params,
+        'cost': admission.estimate_cost(params['query'], params['channel'],
+                                        params['start_date'], params['end_date']),
+        'rows_total': None,
+        'rows_scanned': 0,
+        'results': [],
+        'truncated': False,
+        'channel_counts': {},
+        'day_counts': {},
+        'expansions': None,
+        'revision': 0,
+        'error': None,
+    }
+    write_job(job)
+    mark_polled(job['id'])
+    get_executor().submit(run_job, job)
+    return job
+
+def cancel_job(job_id):
+    """Ask a job to stop; it keeps the results found so far"""
+    with open(job_file(job_id, '.cancel'), 'w'):
+        pass
+
+def cancelled(job_id):
+    """Whether cancel_job() was called for a job"""
+    return os.path.exists(job_file(job_id, '.cancel'))
+
+def mark_polled(job_id):
+    """Record that someone still waits for a job"""
+    with open(job_file(job_id, '.polled'), 'w'):
+        pass
+
+def abandoned(job_id):
+    """Whether nobody has polled a job for JOB_ABANDON_SECONDS"""
+    try:
+        return time.time() - os.path.getmtime(job_file(job_id, '.polled')) > JOB_ABANDON_SECONDS
+    except OSError:
+        return False
+
+def interrupt_check(job_id, deadline):
+    """Progress handler stopping a query once the job is cancelled or out of time"""
+    next_check = time.monotonic()
+    
+    def check():
+        nonlocal next_check
+        now = time.monotonic()
+        if now < next_check:
+            return False
+        next_check = now + CANCEL_CHECK_INTERVAL
+        return now > deadline or cancelled(job_id) or abandoned(job_id)
+    return check
+
+def date_chunks(day_counts):
+    """Group (date, lines) pairs, newest first, into (first, last, lines) ranges of about JOB_CHUNK_ROWS lines"""
+    chunk = []
+    lines = 0
+    for log_date, day_lines in day_counts:
+        chunk.append(log_date)
+        lines += day_lines
+        if lines >= JOB_CHUNK_ROWS:
+            yield chunk[-1], chunk[0], lines
+            chunk = []
+            lines = 0
+    if chunk:
+        yield chunk[-1], chunk[0], lines
+
+def wait_for_slot(job):
+    """Wait for one of the JOB_HEAVY_SLOTS; None if the job is cancelled or abandoned first"""
+    while True:
+        slot = admission.try_lock('job', JOB_HEAVY_SLOTS)
+        if slot or cancelled(job['id']) or abandoned(job['id']):
+            return slot
+        time.sleep(0.2)
+
+def results_final(job):
+    """Whether no later chunk can change the results of a job"""
+    if not job['truncated']:
+        return False
+    # A fuzzy search is only settled once every result is an exact match
+    return not job['params'].get('fuzzy') or all(not result.get('distance') for result in job['results'])
+
+def merge_results(job, rows, patterns):
+    """Add the rows of one chunk to the results of a job, highlighted with patterns"""
+    found = [add_highlights(search_result(row), patterns, job['params'].get('full_lines')) for row in rows]
+    if not job['params'].get('fuzzy'):
+        job['results'].extend(found)
+        job['truncated'] = len(job['results']) >= SEARCH_LIMIT
+        return
+    
+    # Chunks come newest first, so a stable sort on the distance alone
+    # keeps every distance in date order
+    reported = job['results']
+    merged = sorted(reported + found, key=lambda result: result.get('distance', 0))
+    job['truncated'] = len(merged) >= SEARCH_LIMIT
+    job['results'] = merged[:SEARCH_LIMIT]
+    if job['results'][:len(reported)] != reported:
+        job['revision'] += 1
+
+def run_job(job):
+    """Run a search job in the background, writing its state as it goes"""
+    params = job['params']
+    slot = None
+    try:
+        if job['cost'] == 'heavy':
+            slot = wait_for_slot(job)
+            if not slot:
+                job['status'] = 'cancelled'
+                return
+        
+        job['status'] = 'running'
+        write_job(job)
+        
+        conn = storage.get_db('web-read')
+        try:
+            deadline = time.monotonic() + JOB_TIME_BUDGET
+            conn.set_progress_handler(interrupt_check(job['id'], deadline), admission.PROGRESS_INTERVAL)
+            cursor = conn.cursor()
+            
+            expansions = None
+            if params.get('fuzzy'):
+                expansions = fuzzy.expand_query(conn, parse_query(params['query']))
+                job['expansions'] = expansions
+            # Fuzzy variants match regardless of case
+            patterns = highlight_patterns(query_terms(parse_query(params['query']), expansions),
+                                          params['case_sensitive'] and not expansions)
+            
+            # chan: and date: terms of the query also narrow the days to search
+            scope = query_scope(parse_query(params['query']))
+            cursor.execute(*build_date_counts_query(
+                params['network'], params['channel'] or scope['channel'], params['znc_user'],
+                max(filter(None, (params['start_date'], scope['start_date'])), default=None),
+                min(filter(None, (params['end_date'], scope['end_date'])), default=None)))
+            day_counts = cursor.fetchall()
+            job['rows_total'] = sum(day_lines for _, day_lines in day_counts)
+            write_job(job)
+            
+            for first, last, lines in date_chunks(day_counts):
+                limit = SEARCH_LIMIT if expansions else SEARCH_LIMIT - len(job['results'])
+                # With facets the whole range is counted, also after the results are complete
+                hits = None
+                rows_start = first
+                if params.get('facets'):
+                    cursor.execute(*build_facets_query(params['network'], params['query'], params['channel'],
+                                                       params['znc_user'], first, last, params['case_sensitive'],
+                                                       expansions))
+                    facet_rows = cursor.fetchall()
+                    hits = add_facet_counts(facet_rows, job['channel_counts'], job['day_counts'])
+                    # Exact results are the newest hits, so only their days of the chunk are searched again
+                    if not expansions:
+                        chunk_days = {}
+                        add_facet_counts(facet_rows, {}, chunk_days)
+                        rows_start = rows_start_date(chunk_days, limit) or first
+                
+                if not results_final(job) and hits != 0:
+                    cursor.execute(*build_search_query(params['network'], params['query'], params['channel'],
+                                                       params['znc_user'], rows_start, last,
+                                                       params['case_sensitive'], limit=limit, expansions=expansions))
+                    merge_results(job, cursor.fetchall(), patterns)
+                
+                job['rows_scanned'] += lines
+                if results_final(job) and not params.get('facets'):
+                    break
+                write_job(job)
+        finally:
+            conn.close()
+        
+        job['status'] = 'done'
+    except sqlite.OperationalError as e:
+        if 'interrupted' not in str(e):
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        elif cancelled(job['id']) or abandoned(job['id']):
+            job['status'] = 'cancelled'
+        else:
+            job['status'] = 'failed'
+            job['error'] = (f'Search stopped after {JOB_TIME_BUDGET} seconds. Narrow it down '
+                            'with a channel, a date range or a longer search term.')
+    except Exception as e:
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    finally:
+        admission.release(slot)
+        write_job(job)
+
+def job_page(job, offset=0, limit=JOB_PAGE_SIZE):
+    """Progress of a job and one page of the results found so far, with the facets counted so far"""
+    limit = max(0, min(limit, JOB_PAGE_SIZE))
+    page = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'rows_total': job['rows_total'],
+        'rows_scanned': job['rows_scanned'],
+        'matches': len(job['results']),
+        'truncated': job['truncated'],
+        'revision': job['revision'],
+        'error': job['error'],
+        'offset': offset,
+        'results': job['results'][offset:offset + limit],
+    }
+    if job['params'].get('facets'):
+        page['facets'] = summarize_facets(job['channel_counts'], job['day_counts'],
+                                          job['params'].get('facet_interval', 'auto'))
+    if job['params'].get('fuzzy'):
+        page['expansions'] = job['expansions']
+    return page
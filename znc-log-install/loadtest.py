@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Load test of the web app under slow searches
+
+Starts the app in each serving mode on a spare local port, against the
+database configured in storage.py, and keeps it busy for --duration
+seconds: --searches clients post heavy searches back to back while
+--light-clients clients repeat the cheap requests every page load makes
+(login, stats, networks, channels). What matters is how long those cheap
+requests wait while the searches run, and how many searches complete.
+
+    sync    gunicorn -w 4 sync workers, as in the systemd service
+    asgi    uvicorn with asgi.py (bounded heavy and light thread pools)
+
+Each run appends one JSON line to the results file. Only reads are made;
+log in with a user that does not have 2FA enabled.
+
+Usage:
+    python3 loadtest.py --username loadtest --password secret [options]
+
+Options:
+    --modes          Serving modes to compare (default: sync asgi)
+    --url            Test a server that is already running instead
+    --network        Network to search (default: the first one)
+    --query          Search of the heavy clients (default: a common word)
+    --searches       Clients running searches at once (default: 8)
+    --light-clients  Clients making cheap requests (default: 2)
+    --duration       Seconds per mode (default: 30)
+    --results        Results file (default: loadtest_results.jsonl)
+    --label          Free-form label stored with the results
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import threading
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+# Server commands per serving mode; {port} and {app} are filled in
+SERVE_COMMANDS = {
+    'sync': [sys.executable, '-m', 'gunicorn', '-w', '4', '-b', '127.0.0.1:{port}', '{app}:app'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', '{port}',
+             '--no-access-log'],
+}
+
+# Seconds to wait for a started server to answer
+SERVER_START_TIMEOUT = 30
+
+# Seconds a single request may take before it counts as failed; above the
+# heavy search budget of admission.py
+REQUEST_TIMEOUT = 60
+
+# Pause of a light client between two page loads
+LIGHT_INTERVAL = 0.25
+
+# Pause of a search client after the server answered busy (503), like a
+# user trying again
+BUSY_BACKOFF = 1.0
+
+# Default search: matches most lines, so it scans the whole network
+DEFAULT_QUERY = 'e'
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class Client:
+    """One browser session: a cookie jar, the ETags of earlier answers and timed JSON requests"""
+    
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.etags = {}
+    
+    def request(self, method, path, payload=None):
+        """Make one request, returns (ms, status, json or None); status 0 on a connection error"""
+        data = json.dumps(payload).encode() if payload is not None else None
+        headers = {'Content-Type': 'application/json'}
+        # Revalidate like a browser does, so unchanged lists come back as 304
+        if method == 'GET' and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=REQUEST_TIMEOUT) as response:
+                status, body = response.status, response.read()
+                if method == 'GET' and response.headers.get('ETag'):
+                    self.etags[path] = response.headers['ETag']
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (OSError, urllib.error.URLError):
+            status, body = 0, b''
+        elapsed = (time.perf_counter() - started) * 1000
+        
+        try:
+            return elapsed, status, json.loads(body)
+        except ValueError:
+            return elapsed, status, None
+    
+    def login(self, username, password):
+        _, status, data = self.request('POST', '/api/login', {'username': username, 'password': password})
+        if status != 200 or not (data or {}).get('success'):
+            raise RuntimeError(f"Login as '{username}' failed ({status}): {data}")
+
+def free_port():
+    """A local TCP port nothing listens on"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_server(base_url, process):
+    """Wait until a started server answers, raises RuntimeError if it exits or times out"""
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + '/login', timeout=2):
+                return
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not answer within {SERVER_START_TIMEOUT}s")
+
+def start_server(mode, log_path):
+    """Start the app in a serving mode, returns (process, base URL)"""
+    port = free_port()
+    # install.sh deploys app.py, older installs have znc_search.py
+    app_module = 'app' if os.path.exists(os.path.join(SCRIPT_DIR, 'app.py')) else 'znc_search'
+    command = [part.format(port=port, app=app_module) for part in SERVE_COMMANDS[mode]]
+    
+    log = open(log_path, 'w', encoding='utf-8')
+    process = subprocess.Popen(command, cwd=SCRIPT_DIR, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_for_server(base_url, process)
+    except RuntimeError:
+        process.terminate()
+        process.wait()
+        raise
+    return process, base_url
+
+def stop_server(process):
+    """Stop a started server"""
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def search_client(client, payload, deadline, samples, lock):
+    """Post searches back to back until the deadline"""
+    while time.monotonic() < deadline:
+        elapsed, status, _ = client.request('POST', '/api/search', payload)
+        with lock:
+            samples.append((elapsed, status))
+        if status == 503:
+            time.sleep(BUSY_BACKOFF)
+
+def light_client(client, username, password, network, deadline, samples, lock):
+    """Repeat the cheap requests of a page load until the deadline"""
+    requests = [
+        ('POST', '/api/login', {'username': username, 'password': password}),
+        ('GET', '/api/stats', None),
+        ('GET', '/api/networks', None),
+        ('GET', f'/api/channels/{network}', None),
+    ]
+    while time.monotonic() < deadline:
+        for method, path, payload in requests:
+            elapsed, status, _ = client.request(method, path, payload)
+            with lock:
+                samples.append((elapsed, status))
+        time.sleep(LIGHT_INTERVAL)
+
+def percentile(sorted_values, fraction):
+    """Value at a fraction (0-1) of a sorted list, by nearest rank"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(samples, duration):
+    """Count, throughput and latency percentiles of (ms, status) samples"""
+    timings = sorted(elapsed for elapsed, status in samples if status in (200, 304))
+    return {
+        'ok': len(timings),
+        'rejected': sum(1 for _, status in samples if status in (503, 504)),
+        'failed': sum(1 for _, status in samples if status not in (200, 304, 503, 504)),
+        'per_s': round(len(timings) / duration, 2),
+        'p50_ms': round(percentile(timings, 0.5), 1) if timings else None,
+        'p95_ms': round(percentile(timings, 0.95), 1) if timings else None,
+        'max_ms': round(timings[-1], 1) if timings else None,
+    }
+
+def run_load(base_url, args):
+    """Run the search and light clients against a server, returns the summary"""
+    clients = [Client(base_url) for _ in range(args.searches + args.light_clients)]
+    for client in clients:
+        client.login(args.username, args.password)
+    
+    network = args.network
+    if not network:
+        _, _, data = clients[0].request('GET', '/api/networks')
+        if not (data or {}).get('networks'):
+            raise RuntimeError("No networks in the database; import logs first")
+        network = data['networks'][0]['id']
+    payload = {'query': args.query, 'network': network}
+    
+    search_samples = []
+    light_samples = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    
+    threads = [threading.Thread(target=search_client, args=(client, payload, deadline, search_samples, lock))
+               for client in clients[:args.searches]]
+    threads += [threading.Thread(target=light_client,
+                                 args=(client, args.username, args.password, network, deadline,
+                                       light_samples, lock))
+                for client in clients[args.searches:]]
+    
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Searches still running at the deadline are counted when they end
+    duration = time.monotonic() - started
+    
+    return {
+        'searches': summarize(search_samples, duration),
+        'light': summarize(light_samples, duration),
+    }
+
+def print_summary(name, summary):
+    """Print one mode's results"""
+    for kind in ('light', 'searches'):
+        stats = summary[kind]
+        p50 = f"{stats['p50_ms']:>9.1f}" if stats['p50_ms'] is not None else f"{'-':>9}"
+        p95 = f"{stats['p95_ms']:>9.1f}" if stats['p95_ms'] is not None else f"{'-':>9}"
+        print(f"  {name:<6} {kind:<9} {stats['ok']:>7,} ok {stats['per_s']:>8.2f}/s  "
+              f"p50 {p50} ms  p95 {p95} ms  {stats['rejected']:>5} busy  {stats['failed']:>5} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the web app serving modes under slow searches')
+    parser.add_argument('--username', required=True,
+                       help='Web user to log in as (without 2FA)')
+    parser.add_argument('--password', required=True,
+                       help='Password of that user')
+    parser.add_argument('--modes', nargs='+', choices=sorted(SERVE_COMMANDS), default=['sync', 'asgi'],
+                       help='Serving modes to compare (default: sync asgi)')
+    parser.add_argument('--url',
+                       help='Test a server that is already running, e.g. http://localhost:5000')
+    parser.add_argument('--network',
+                       help='Network to search (default: the first one)')
+    parser.add_argument('--query', default=DEFAULT_QUERY,
+                       help=f'Search of the heavy clients (default: {DEFAULT_QUERY!r})')
+    parser.add_argument('--searches', type=int, default=8,
+                       help='Clients running searches at once (default: 8)')
+    parser.add_argument('--light-clients', type=int, default=2,
+                       help='Clients making cheap requests (default: 2)')
+    parser.add_argument('--duration', type=float, default=30,
+                       help='Seconds per mode (default: 30)')
+    parser.add_argument('--results', default='loadtest_results.jsonl',
+                       help='Results file (default: loadtest_results.jsonl)')
+    parser.add_argument('--label',
+                       help='Label stored with the results, e.g. a branch name')
+    args = parser.parse_args()
+    
+    modes = ['url'] if args.url else args.modes
+    
+    print("=" * 70)
+    print(f"LOAD TEST: {args.searches} search clients, {args.light_clients} light clients, "
+          f"{args.duration:g}s per mode")
+    print("=" * 70)
+    
+    summaries = {}
+    for mode in modes:
+        if args.url:
+            print(f"\nTesting {args.url}...")
+            summaries[mode] = run_load(args.url.rstrip('/'), args)
+            continue
+        
+        print(f"\nStarting {mode} server...")
+        try:
+            process, base_url = start_server(mode, os.path.join(SCRIPT_DIR, f'loadtest_{mode}.log'))
+        except (OSError, RuntimeError) as e:
+            print(f"✗ Cannot start {mode} server: {e} (see loadtest_{mode}.log)")
+            continue
+        try:
+            print(f"Running load for {args.duration:g}s...")
+            summaries[mode] = run_load(base_url, args)
+        finally:
+            stop_server(process)
+    
+    if not summaries:
+        sys.exit(1)
+    
+    print("\nResults (light: login, stats, networks and channels while searches run):")
+    for mode, summary in summaries.items():
+        print_summary(mode, summary)
+    
+    run = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'label': args.label,
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'settings': {
+            'query': args.query,
+            'network': args.network,
+            'searches': args.searches,
+            'light_clients': args.light_clients,
+            'duration': args.duration,
+        },
+        'modes': summaries,
+    }
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + '\n')
+    
+    print(f"\n✓ Results appended to: {os.path.abspath(args.results)}")
+
+if __name__ == '__main__':
+    main()
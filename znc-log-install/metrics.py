@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Request metrics for the search web interface in Prometheus text format
+
+app.py wraps every request in start_request()/finish_request() and opens
+its connections through connect(), which times connection setup, queries
+and rows fetched. /metrics serves render().
+
+Each gunicorn worker keeps its own numbers and writes them to METRICS_DIR
+every few seconds, so a scrape reports the sum over all workers no matter
+which worker answers it.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import ctypes
+import threading
+import importlib
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    # Python before 3.8: the pysqlcipher3 version cannot be checked
+    importlib_metadata = None
+
+# Directory for per-worker snapshots (relative to the working directory)
+METRICS_DIR = 'metrics'
+
+# Seconds between snapshot writes of a worker; the worker answering a
+# scrape always writes its own first
+METRICS_FLUSH_INTERVAL = 5
+
+# Snapshots of workers that have exited are dropped after this many seconds
+METRICS_STALE_SECONDS = 86400
+
+# pysqlcipher3 versions whose connection layout page_cache_counters() knows.
+# On these the SQLite page cache hits and misses of every connection are
+# read through the C API of the library pysqlcipher3 is linked with; on any
+# other version a wrong pointer would crash the worker, so the cache
+# metrics are left out of /metrics.
+PAGE_CACHE_VERSIONS = ('1.2.0',)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+# Name, type, help text and histogram buckets of every metric, in output order
+METRICS = (
+    ('znc_search_requests_total', 'counter', 'Requests by route, method and status', None),
+    ('znc_search_request_duration_seconds', 'histogram', 'Request latency by route', LATENCY_BUCKETS),
+    ('znc_search_db_query_duration_seconds', 'histogram',
+     'Time per request spent in SQLite queries, including fetching rows', LATENCY_BUCKETS),
+    ('znc_search_db_connect_duration_seconds', 'histogram',
+     'Time per request spent opening and keying database connections', LATENCY_BUCKETS),
+    ('znc_search_db_rows_returned', 'histogram', 'Rows fetched from SQLite per request', ROW_BUCKETS),
+    ('znc_search_db_cache_hits_total', 'counter', 'SQLite page cache hits', None),
+    ('znc_search_db_cache_misses_total', 'counter', 'SQLite page cache misses', None),
+    ('znc_search_admissions_total', 'counter',
+     'Searches by estimated cost and admission outcome (admitted, queued, rejected, interrupted)', None),
+    ('znc_search_requests_in_flight', 'gauge', 'Requests being handled right now', None),
+)
+BUCKETS = {name: buckets for name, _, _, buckets in METRICS}
+
+# Metrics only reported with page cache counters
+CACHE_METRICS = ('znc_search_db_cache_hits_total', 'znc_search_db_cache_misses_total')
+
+SQLITE_DBSTATUS_CACHE_HIT = 7
+SQLITE_DBSTATUS_CACHE_MISS = 8
+
+# Numbers of this process: {metric: {labels: value}}, where a histogram
+# value is [count per bucket..., count above the last bucket, sum]
+_counters = {}
+_histograms = {}
+_in_flight = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+_snapshot_name = None
+_route_labels = {}
+
+# Request being handled by the current thread
+_current = threading.local()
+
+# Library for page cache counters: None until looked up, False if
+# unavailable or the pysqlcipher3 version is not in PAGE_CACHE_VERSIONS
+_cache_lib = None
+
+def escape_label(value):
+    """Escape a Prometheus label value"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def route_labels(route):
+    """Label string of a route, built once per route"""
+    labels = _route_labels.get(route)
+    if labels is None:
+        labels = _route_labels[route] = f'route="{escape_label(route)}"'
+    return labels
+
+def observe(metric, labels, value):
+    """Add a value to a histogram (call with _lock held)"""
+    buckets = BUCKETS[metric]
+    series = _histograms.setdefault(metric, {})
+    values = series.get(labels)
+    if values is None:
+        values = series[labels] = [0] * (len(buckets) + 1) + [0.0]
+    values[bisect.bisect_left(buckets, value)] += 1
+    values[-1] += value
+
+def count(metric, labels, amount=1):
+    """Add to a counter (call with _lock held)"""
+    series = _counters.setdefault(metric, {})
+    series[labels] = series.get(labels, 0) + amount
+
+def count_admission(cost, outcome):
+    """Count a search admission decision of admission.py"""
+    with _lock:
+        count('znc_search_admissions_total', f'cost="{cost}",outcome="{outcome}"')
+
+def start_request(route):
+    """Start timing a request, returns its state for finish_request()"""
+    labels = route_labels(route)
+    with _lock:
+        _in_flight[labels] = _in_flight.get(labels, 0) + 1
+    
+    state = {
+        'labels': labels,
+        'started': time.perf_counter(),
+        'connect': 0.0,
+        'db': 0.0,
+        'rows': 0,
+        'hits': 0,
+        'misses': 0,
+    }
+    _current.state = state
+    return state
+
+def finish_request(state, method, status):
+    """Record a finished request"""
+    elapsed = time.perf_counter() - state['started']
+    _current.state = None
+    labels = state['labels']
+    
+    with _lock:
+        _in_flight[labels] -= 1
+        count('znc_search_requests_total', f'{labels},method="{method}",status="{status}"')
+        observe('znc_search_request_duration_seconds', labels, elapsed)
+        if state['connect']:
+            observe('znc_search_db_connect_duration_seconds', labels, state['connect'])
+            observe('znc_search_db_query_duration_seconds', labels, state['db'])
+            observe('znc_search_db_rows_returned', labels, state['rows'])
+        if state['hits'] or state['misses']:
+            count('znc_search_db_cache_hits_total', labels, state['hits'])
+            count('znc_search_db_cache_misses_total', labels, state['misses'])
+    
+    if time.time() - _last_flush >= METRICS_FLUSH_INTERVAL:
+        flush()
+
+class TimedCursor:
+    """Cursor that adds query time and rows fetched to the current request"""
+    
+    def __init__(self, cursor, state):
+        self._cursor = cursor
+        self._state = state
+        self._statement = None
+    
+    def _record(self, elapsed, rows=0):
+        self._state['db'] += elapsed
+        self._state['rows'] += rows
+        if self._statement is not None:
+            self._statement['seconds'] += elapsed
+            self._statement['rows'] += rows
+    
+    def _start_statement(self, sql, params):
+        # Only profiled requests keep a list of their statements
+        statements = self._state.get('statements')
+        if statements is not None:
+            self._statement = {'sql': sql, 'params': list(params), 'seconds': 0.0, 'rows': 0}
+            statements.append(self._statement)
+    
+    def execute(self, sql, params=()):
+        self._start_statement(sql, params)
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params)
+        finally:
+            self._record(time.perf_counter() - started)
+        return self
+    
+    def executemany(self, sql, seq_of_params):
+        self._start_statement(sql, [])
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._record(time.perf_counter() - started)
+        return self
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._record(time.perf_counter() - started, 0 if row is None else 1)
+        return row
+    
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(*args)
+        self._record(time.perf_counter() - started, len(rows))
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._record(time.perf_counter() - started, len(rows))
+        return rows
+    
+    def __iter__(self):
+        return iter(self.fetchall())
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class TimedConnection:
+    """Connection whose cursors are timed; records page cache use on close"""
+    
+    def __init__(self, conn, state):
+        self._conn = conn
+        self._state = state
+    
+    def cursor(self):
+        return TimedCursor(self._conn.cursor(), self._state)
+    
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+    
+    def close(self):
+        hits, misses = page_cache_counters(self._conn)
+        self._state['hits'] += hits
+        self._state['misses'] += misses
+        self._conn.close()
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def connect(open_connection, *args):
+    """Open a connection with open_connection(*args), timed when inside a request"""
+    state = getattr(_current, 'state', None)
+    if state is None:
+        return open_connection(*args)
+    
+    started = time.perf_counter()
+    conn = open_connection(*args)
+    # SQLCipher derives the key on the first read, so include it here
+    conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+    state['connect'] += time.perf_counter() - started
+    return TimedConnection(conn, state)
+
+def load_page_cache_library():
+    """The SQLite library pysqlcipher3 runs on, or None if it cannot be found for certain"""
+    # Built with the SQLCipher amalgamation: the functions are in the module
+    candidates = []
+    try:
+        candidates.append(importlib.import_module('pysqlcipher3._sqlite3').__file__)
+    except (ImportError, AttributeError):
+        pass
+    
+    # Linked against libsqlcipher: only trust a copy that is already loaded
+    try:
+        with open('/proc/self/maps', 'r') as f:
+            for line in f:
+                path = line.split()[-1]
+                if 'libsqlcipher' in os.path.basename(path) and path not in candidates:
+                    candidates.append(path)
+    except OSError:
+        pass
+    
+    for path in candidates:
+        try:
+            lib = ctypes.CDLL(path)
+        except OSError:
+            continue
+        if hasattr(lib, 'sqlite3_db_status'):
+            lib.sqlite3_db_status.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+                                              ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+            return lib
+    return None
+
+def pysqlcipher3_version():
+    """Installed version of pysqlcipher3, None if it cannot be told"""
+    if importlib_metadata is None:
+        return None
+    try:
+        return importlib_metadata.version('pysqlcipher3')
+    except importlib_metadata.PackageNotFoundError:
+        return None
+
+def page_cache_available():
+    """Whether page cache counters can be read safely on this install"""
+    global _cache_lib
+    if _cache_lib is None:
+        _cache_lib = False
+        if pysqlcipher3_version() in PAGE_CACHE_VERSIONS:
+            _cache_lib = load_page_cache_library() or False
+    return bool(_cache_lib)
+
+def page_cache_counters(conn):
+    """Return (page cache hits, misses) of a connection, (0, 0) if unavailable"""
+    if not page_cache_available():
+        return 0, 0
+    
+    # The sqlite3 handle is the first field after the object header in
+    # pysqlcipher3 1.2.0's pysqlite_Connection struct
+    handle = ctypes.c_void_p.from_address(id(conn) + object.__basicsize__).value
+    if not handle:
+        return 0, 0
+    
+    hits, misses, high = ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+    _cache_lib.sqlite3_db_status(handle, SQLITE_DBSTATUS_CACHE_HIT, ctypes.byref(hits), ctypes.byref(high), 0)
+    _cache_lib.sqlite3_db_status(handle, SQLITE_DBSTATUS_CACHE_MISS, ctypes.byref(misses), ctypes.byref(high), 0)
+    return hits.value, misses.value
+
+def flush():
+    """Write this worker's numbers to METRICS_DIR"""
+    global _last_flush, _snapshot_name
+    _last_flush = time.time()
+    if _snapshot_name is None:
+        _snapshot_name = f'worker-{os.getpid()}-{int(_last_flush)}.json'
+    
+    with _lock:
+        snapshot = json.dumps({
+            'pid': os.getpid(),
+            'written': _last_flush,
+            'counters': _counters,
+            'histograms': _histograms,
+            'in_flight': _in_flight,
+        })
+    
+    path = os.path.join(METRICS_DIR, _snapshot_name)
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"Cannot write metrics snapshot {path}: {e}", file=sys.stderr)
+        return False
+    return True
+
+def process_alive(pid):
+    """Whether a process with this id is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def load_snapshots():
+    """Snapshots of all workers; those of long-gone workers are deleted"""
+    snapshots = []
+    try:
+        filenames = os.listdir(METRICS_DIR)
+    except OSError:
+        return snapshots
+    
+    now = time.time()
+    for filename in filenames:
+        if not (filename.startswith('worker-') and filename.endswith('.json')):
+            continue
+        path = os.path.join(METRICS_DIR, filename)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        
+        snapshot['alive'] = process_alive(snapshot['pid'])
+        if not snapshot['alive'] and now - snapshot['written'] > METRICS_STALE_SECONDS:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+def merge_snapshots(snapshots):
+    """Sum counters, histograms and in-flight requests over worker snapshots"""
+    counters, histograms, in_flight = {}, {}, {}
+    for snapshot in snapshots:
+        for metric, series in snapshot['counters'].items():
+            merged = counters.setdefault(metric, {})
+            for labels, value in series.items():
+                merged[labels] = merged.get(labels, 0) + value
+        for metric, series in snapshot['histograms'].items():
+            merged = histograms.setdefault(metric, {})
+            for labels, values in series.items():
+                if labels in merged:
+                    merged[labels] = [a + b for a, b in zip(merged[labels], values)]
+                else:
+                    merged[labels] = list(values)
+        # A worker that has exited is not handling anything
+        if snapshot['alive']:
+            for labels, value in snapshot['in_flight'].items():
+                in_flight[labels] = in_flight.get(labels, 0) + value
+    return counters, histograms, in_flight
+
+def render():
+    """Metrics of all workers in the Prometheus text exposition format"""
+    if flush():
+        counters, histograms, in_flight = merge_snapshots(load_snapshots())
+    else:
+        # Without METRICS_DIR only this worker's numbers are available
+        with _lock:
+            counters, histograms, in_flight = merge_snapshots([{
+                'counters': _counters,
+                'histograms': _histograms,
+                'in_flight': _in_flight,
+                'alive': True,
+            }])
+    
+    lines = []
+    for metric, kind, description, buckets in METRICS:
+        if metric in CACHE_METRICS and not page_cache_available():
+            continue
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if kind == 'histogram':
+            for labels, values in sorted(histograms.get(metric, {}).items()):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, values):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                total = cumulative + values[len(buckets)]
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {total}')
+                lines.append(f'{metric}_sum{{{labels}}} {values[-1]:.6f}')
+                lines.append(f'{metric}_count{{{labels}}} {total}')
+        else:
+            series = in_flight if kind == 'gauge' else counters.get(metric, {})
+            for labels, value in sorted(series.items()):
+                lines.append(f'{metric}{{{labels}}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+SQL used by the search web interface
+
+app.py builds every log query through these functions, and db_utils.py
+uses the same functions for query plan snapshots and workload replay, so
+benchmarks always measure exactly what the web interface runs.
+explain_plan() is shared by db_utils.py plan snapshots and app.py request
+profiling. jobs.py runs the same search query one range of days at a time.
+The facet query shares the WHERE clause of the search query, so its counts
+always match the search, and rows_start_date() uses them to narrow down the
+days the search query has to look at. fetch_context() returns the context
+of many search results at once, merging hits of one day into shared line
+ranges.
+"""
+
+from datetime import datetime, timedelta
+
+from query_language import parse_query, compile_query, compile_rank
+
+# Maximum number of rows returned by a search
+SEARCH_LIMIT = 1000
+
+# Histogram intervals of search facets
+FACET_INTERVALS = ('day', 'week', 'month')
+
+# Most lines of context on either side of a hit returned with search results
+CONTEXT_MAX_LINES = 20
+
+# Line ranges fetched per inline context query; each range takes 7
+# parameters, and SQLite before 3.32 allows at most 999 per statement
+CONTEXT_RANGES_PER_QUERY = 140
+
+NETWORKS_QUERY = '''
+    SELECT DISTINCT n.id, n.display_name
+    FROM networks n
+    INNER JOIN log_entries le ON n.id = le.network_id
+    ORDER BY n.display_name
+'''
+
+CHANNELS_QUERY = '''
+    SELECT DISTINCT channel_name
+    FROM log_entries
+    WHERE network_id = ?
+    AND channel_name LIKE '#%'
+    ORDER BY channel_name
+'''
+
+def search_conditions(network, query, channel='', znc_user='', start_date=None, end_date=None,
+                      case_sensitive=False, expansions=None):
+    """WHERE clause shared by the search and facet queries, returns (sql, params); raises QueryError"""
+    sql_query = 'WHERE le.network_id = ?'
+    params = [network]
+    
+    # Add channel filter if specified
+    if channel:
+        sql_query += ' AND le.channel_name = ?'
+        params.append(channel)
+    
+    # Scope to a single ZNC user if specified
+    if znc_user:
+        sql_query += ' AND le.znc_user = ?'
+        params.append(znc_user)
+    
+    # Add date range filters
+    if start_date:
+        sql_query += ' AND le.log_date >= ?'
+        params.append(start_date)
+    
+    if end_date:
+        sql_query += ' AND le.log_date <= ?'
+        params.append(end_date)
+    
+    # Add search filter: words, phrases and operators of the query language
+    query_sql, query_params = compile_query(parse_query(query), case_sensitive, expansions)
+    sql_query += f' AND {query_sql}'
+    params.extend(query_params)
+    
+    return sql_query, params
+
+def build_search_query(network, query, channel='', znc_user='', start_date=None, end_date=None,
+                       case_sensitive=False, limit=SEARCH_LIMIT, expansions=None):
+    """
+    Build the /api/search query, returns (sql, params).
+    
+    With expansions (a fuzzy search) every row also gets its edit distance
+    from the query, and rows are ordered by distance before date.
+    """
+    conditions, params = search_conditions(network, query, channel, znc_user,
+                                           start_date, end_date, case_sensitive, expansions)
+    rank_sql = ''
+    order = 'le.log_date DESC, le.line_number ASC'
+    if expansions:
+        rank_sql, rank_params = compile_rank(parse_query(query), expansions)
+        rank_sql = f',\n            {rank_sql} AS distance'
+        params = rank_params + params
+        order = 'distance ASC, ' + order
+    
+    sql_query = '''
+        SELECT
+            le.network_id,
+            n.display_name,
+            le.channel_name,
+            le.log_date,
+            le.line_number,
+            le.content,
+            le.znc_user''' + rank_sql + '''
+        FROM log_entries le
+        JOIN networks n ON le.network_id = n.id
+    ''' + conditions
+    
+    sql_query += f' ORDER BY {order} LIMIT {int(limit)}'
+    
+    return sql_query, params
+
+def build_facets_query(network, query, channel='', znc_user='', start_date=None, end_date=None,
+                       case_sensitive=False, expansions=None):
+    """Build the query for the hits of a search per channel and day, returns (sql, params)"""
+    conditions, params = search_conditions(network, query, channel, znc_user,
+                                           start_date, end_date, case_sensitive, expansions)
+    sql_query = '''
+        SELECT le.channel_name, le.log_date, COUNT(*)
+        FROM log_entries le
+    ''' + conditions + ' GROUP BY le.channel_name, le.log_date'
+    
+    return sql_query, params
+
+def rows_start_date(day_counts, limit=SEARCH_LIMIT):
+    """
+    First day of the newest days that hold limit hits, from the facet counts
+    per day; None if all days together hold fewer.
+    
+    Results are ordered newest first, so once the facets are counted an
+    exact search only has to look for rows from that day on.
+    """
+    hits = 0
+    for log_date in sorted(day_counts, reverse=True):
+        hits += day_counts[log_date]
+        if hits >= limit:
+            return log_date
+    return None
+
+def add_facet_counts(rows, channel_counts, day_counts):
+    """Add build_facets_query() rows to hit counts per channel and per day, returns the hits added"""
+    hits = 0
+    for channel_name, log_date, count in rows:
+        channel_counts[channel_name] = channel_counts.get(channel_name, 0) + count
+        day_counts[log_date] = day_counts.get(log_date, 0) + count
+        hits += count
+    return hits
+
+def facet_bucket(day, interval):
+    """First and last day of the day, week or month a date falls in"""
+    if interval == 'month':
+        first = day.replace(day=1)
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    elif interval == 'week':
+        first = day - timedelta(days=day.weekday())
+        last = first + timedelta(days=6)
+    else:
+        first = last = day
+    return first, last
+
+def summarize_facets(channel_counts, day_counts, interval='auto'):
+    """
+    Facets returned with search results.
+    
+    Hits per channel, most first, and a histogram of hits per day, week or
+    month from the first to the last day with hits. 'auto' picks the
+    interval from the span of those days.
+    """
+    facets = {
+        'total': sum(channel_counts.values()),
+        'channels': [{'channel': name, 'count': count} for name, count in
+                     sorted(channel_counts.items(), key=lambda item: (-item[1], item[0]))],
+        'interval': interval,
+        'histogram': [],
+    }
+    if not day_counts:
+        return facets
+    
+    days = {datetime.strptime(log_date, '%Y-%m-%d').date(): count for log_date, count in day_counts.items()}
+    first_day, last_day = min(days), max(days)
+    if interval not in FACET_INTERVALS:
+        span = (last_day - first_day).days
+        interval = 'day' if span <= 62 else 'week' if span <= 730 else 'month'
+    facets['interval'] = interval
+    
+    # Every bucket between the first and last hit, so gaps show as empty bars
+    buckets = {}
+    first, last = facet_bucket(first_day, interval)
+    while first <= last_day:
+        buckets[first] = {'start': first.isoformat(), 'end': last.isoformat(), 'count': 0}
+        first, last = facet_bucket(last + timedelta(days=1), interval)
+    for day, count in days.items():
+        buckets[facet_bucket(day, interval)[0]]['count'] += count
+    facets['histogram'] = list(buckets.values())
+    return facets
+
+def search_result(row):
+    """Result of one build_search_query() row, as returned to the browser"""
+    result = {
+        'network': row[1],
+        'network_id': row[0],
+        'channel': row[2],
+        'date': row[3],
+        'line': row[4],
+        'content': row[5],
+        'znc_user': row[6]
+    }
+    if len(row) > 7:
+        result['distance'] = row[7]
+    return result
+
+def build_date_counts_query(network, channel='', znc_user='', start_date=None, end_date=None):
+    """Build the query for the lines a search covers per day, newest first; returns (sql, params)"""
+    sql_query = '''
+        SELECT log_date, COUNT(*)
+        FROM log_entries
+        WHERE network_id = ?
+    '''
+    params = [network]
+    
+    if channel:
+        sql_query += ' AND channel_name = ?'
+        params.append(channel)
+    
+    if znc_user:
+        sql_query += ' AND znc_user = ?'
+        params.append(znc_user)
+    
+    if start_date:
+        sql_query += ' AND log_date >= ?'
+        params.append(start_date)
+    
+    if end_date:
+        sql_query += ' AND log_date <= ?'
+        params.append(end_date)
+    
+    sql_query += ' GROUP BY log_date ORDER BY log_date DESC'
+    
+    return sql_query, params
+
+def build_context_queries(network, channel, log_date, start_line, end_line, znc_user=None):
+    """
+    Build the /api/context and /api/day queries.
+    
+    Returns ((lines_sql, params), (total_sql, params)): the requested line
+    range and the number of lines logged that day.
+    """
+    # Two ZNC users can log the same channel on the same day
+    user_filter = ''
+    user_params = []
+    if znc_user is not None:
+        user_filter = ' AND znc_user = ?'
+        user_params = [znc_user]
+    
+    lines_sql = '''
+        SELECT line_number, content
+        FROM log_entries
+        WHERE network_id = ?
+        AND channel_name = ?
+        AND log_date = ?
+        AND line_number BETWEEN ? AND ?''' + user_filter + '''
+        ORDER BY line_number
+    '''
+    lines_params = [network, channel, log_date, start_line, end_line] + user_params
+    
+    return (lines_sql, lines_params), build_day_total_query(network, channel, log_date, znc_user)
+
+def build_day_total_query(network, channel, log_date, znc_user=None):
+    """Build the query for the number of lines logged in a channel on one day; returns (sql, params)"""
+    total_sql = '''
+        SELECT COUNT(*) FROM log_entries
+        WHERE network_id = ? AND channel_name = ? AND log_date = ?'''
+    total_params = [network, channel, log_date]
+    if znc_user is not None:
+        total_sql += ' AND znc_user = ?'
+        total_params.append(znc_user)
+    return total_sql, total_params
+
+def merge_context_ranges(results, lines):
+    """
+    Group search results into line ranges with lines of context on either
+    side; results of one day whose ranges overlap or touch share a range.
+    
+    Returns (ranges, result_ranges): the ranges as dicts, in the order of
+    the results, and the index of the range of each result.
+    """
+    by_day = {}
+    for index, result in enumerate(results):
+        day = (result['znc_user'], result['network_id'], result['channel'], result['date'])
+        by_day.setdefault(day, []).append((result['line'], index))
+    
+    ranges = []
+    result_ranges = [None] * len(results)
+    for (znc_user, network_id, channel, log_date), hits in by_day.items():
+        current = None
+        for line, index in sorted(hits):
+            start_line = max(1, line - lines)
+            if current is None or start_line > current['end_line'] + 1:
+                current = {
+                    'znc_user': znc_user,
+                    'network_id': network_id,
+                    'channel': channel,
+                    'date': log_date,
+                    'start_line': start_line,
+                    'end_line': line + lines,
+                }
+                ranges.append(current)
+            current['end_line'] = max(current['end_line'], line + lines)
+            result_ranges[index] = len(ranges) - 1
+    return ranges, result_ranges
+
+def build_context_ranges_query(ranges):
+    """Build the query for the lines of several ranges of merge_context_ranges(); returns (sql, params)"""
+    values = ', '.join(['(?, ?, ?, ?, ?, ?, ?)'] * len(ranges))
+    sql_query = f'''
+        WITH ranges (range_id, znc_user, network_id, channel_name, log_date, start_line, end_line) AS (
+            VALUES {values}
+        )
+        SELECT r.range_id, le.line_number, le.content
+        FROM ranges r
+        JOIN log_entries le
+            ON le.network_id = r.network_id
+            AND le.channel_name = r.channel_name
+            AND le.log_date = r.log_date
+            AND le.znc_user = r.znc_user
+            AND le.line_number BETWEEN r.start_line AND r.end_line
+        ORDER BY r.range_id, le.line_number
+    '''
+    params = []
+    for range_id, context_range in enumerate(ranges):
+        params += [range_id, context_range['znc_user'], context_range['network_id'], context_range['channel'],
+                   context_range['date'], context_range['start_line'], context_range['end_line']]
+    return sql_query, params
+
+def build_day_totals_query(days):
+    """Build the query for the number of lines of several (znc_user, network, channel, date) days; returns (sql, params)"""
+    values = ', '.join(['(?, ?, ?, ?, ?)'] * len(days))
+    sql_query = f'''
+        WITH days (day_id, znc_user, network_id, channel_name, log_date) AS (
+            VALUES {values}
+        )
+        SELECT d.day_id, (
+            SELECT COUNT(*) FROM log_entries le
+            WHERE le.network_id = d.network_id AND le.channel_name = d.channel_name
+            AND le.log_date = d.log_date AND le.znc_user = d.znc_user
+        )
+        FROM days d
+    '''
+    params = [value for day_id, day in enumerate(days) for value in (day_id,) + day]
+    return sql_query, params
+
+def context_batches(ranges):
+    """
+    Split merge_context_ranges() ranges into batches of
+    CONTEXT_RANGES_PER_QUERY; yields (batch, the day of every range, the
+    distinct days). Ranges of one day share its line count.
+    """
+    for first in range(0, len(ranges), CONTEXT_RANGES_PER_QUERY):
+        batch = ranges[first:first + CONTEXT_RANGES_PER_QUERY]
+        range_days = [(context_range['znc_user'], context_range['network_id'],
+                       context_range['channel'], context_range['date']) for context_range in batch]
+        yield batch, range_days, list(dict.fromkeys(range_days))
+
+def build_inline_context_queries(results, lines):
+    """Build the queries fetch_context() runs for search results, returns [(sql, params)]"""
+    ranges, _ = merge_context_ranges(results, max(0, min(lines, CONTEXT_MAX_LINES)))
+    queries = []
+    for batch, _, days in context_batches(ranges):
+        queries += [build_context_ranges_query(batch), build_day_totals_query(days)]
+    return queries
+
+def fetch_context(conn, results, lines):
+    """
+    Lines of context around every search result, two queries per
+    CONTEXT_RANGES_PER_QUERY ranges instead of two per result.
+    
+    Returns (ranges, result_ranges) of merge_context_ranges(), every range
+    with its 'lines' ({'line', 'content'} dicts) and the 'total_lines' of
+    its day.
+    """
+    lines = max(0, min(lines, CONTEXT_MAX_LINES))
+    ranges, result_ranges = merge_context_ranges(results, lines)
+    cursor = conn.cursor()
+    
+    for batch, range_days, days in context_batches(ranges):
+        for context_range in batch:
+            context_range['lines'] = []
+        cursor.execute(*build_context_ranges_query(batch))
+        for range_id, line, content in cursor.fetchall():
+            batch[range_id]['lines'].append({'line': line, 'content': content})
+        
+        cursor.execute(*build_day_totals_query(days))
+        totals = dict(cursor.fetchall())
+        day_ids = {day: day_id for day_id, day in enumerate(days)}
+        for context_range, day in zip(batch, range_days):
+            context_range['total_lines'] = totals[day_ids[day]]
+    
+    return ranges, result_ranges
+
+def explain_plan(conn, sql, params):
+    """Return EXPLAIN QUERY PLAN output as indented lines"""
+    rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
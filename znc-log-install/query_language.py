@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Search query language of the web interface
+
+    passkey reset           lines containing both words (AND is implied)
+    passkey AND reset       the same
+    ssl OR tls              lines containing either word
+    NOT bot, -bot           lines not containing the word
+    "exact phrase"          a phrase, spaces included
+    (ssl OR tls) -bot       parentheses group terms
+    nick:foo                lines said by (or actions of) nick foo
+    chan:#linux             lines in channel #linux
+    date:2024               lines of a year, month (2024-03), day
+                            (2024-03-15) or range (2024-01-01..2024-03-31)
+
+AND, OR and NOT are operators only in capitals; in lower case they are
+searched for like any other word. A query is parsed once into a tree of
+tuples, and compile_query() turns the tree into one WHERE clause for
+queries.search_conditions(). Inside every AND the most selective terms come
+first: channel and date terms, which the composite index narrows down, then
+nicks, then words from the longest to the shortest, with exclusions last.
+In a fuzzy search every word and nick also matches its variants from
+fuzzy.py, and compile_rank() scores each line by how close it is.
+"""
+
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+# Most terms in one query
+MAX_QUERY_TERMS = 20
+
+# Operators with a field name and a value
+FIELDS = ('nick', 'chan', 'date')
+
+TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<minus>-)(?=[^\s)])
+  | (?:(?P<field>[A-Za-z]+):)?(?:"(?P<phrase>[^"]*)"|(?P<word>[^\s()"]+))
+  | (?P<quote>")
+''', re.VERBOSE)
+
+DATE_FORMATS = (('%Y-%m-%d', 'day'), ('%Y-%m', 'month'), ('%Y', 'year'))
+
+class QueryError(ValueError):
+    """A search query that cannot be parsed; the message is shown to the user"""
+
+def tokenize(query):
+    """Split a query into (kind, value, field, position) tokens"""
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = TOKEN.match(query, position)
+        kind = match.lastgroup
+        if kind == 'quote':
+            raise QueryError(f'Unterminated quote at position {position + 1}')
+        if kind in ('phrase', 'word'):
+            value = match.group(kind)
+            field = match.group('field')
+            if kind == 'word' and value in ('AND', 'OR', 'NOT') and not field:
+                kind = value
+            elif field and field.lower() not in FIELDS:
+                # Not an operator, e.g. a URL or "re:"
+                value = f'{field}:{value}'
+                field = None
+            if kind == 'phrase' and not value.strip():
+                raise QueryError(f'Empty phrase at position {position + 1}')
+            tokens.append((kind, value, field and field.lower(), position + 1))
+        elif kind != 'space':
+            tokens.append((kind, match.group(kind), None, position + 1))
+        position = match.end()
+    return tokens
+
+def parse_date(value):
+    """First and last day of date:VALUE"""
+    first_text, separator, last_text = value.partition('..')
+    if not separator:
+        last_text = first_text
+    
+    days = []
+    for text, end in ((first_text, False), (last_text, True)):
+        for date_format, unit in DATE_FORMATS:
+            try:
+                day = datetime.strptime(text, date_format).date()
+            except ValueError:
+                continue
+            if end and unit == 'month':
+                day = (day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            elif end and unit == 'year':
+                day = day.replace(month=12, day=31)
+            days.append(day.isoformat())
+            break
+        else:
+            raise QueryError(f"Invalid date '{value}': use YYYY, YYYY-MM, YYYY-MM-DD "
+                             "or a range like 2024-01-01..2024-03-31")
+    
+    if days[0] > days[1]:
+        raise QueryError(f"Date range '{value}' ends before it starts")
+    return days[0], days[1]
+
+class Parser:
+    """Recursive descent parser: or := and ('OR' and)*, and := unary ('AND'? unary)*"""
+    
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+    
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+    
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+    
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else ('or', tuple(children))
+    
+    def parse_and(self):
+        children = [self.parse_unary()]
+        while self.peek() not in (None, 'OR', 'close'):
+            if self.peek() == 'AND':
+                self.take()
+            children.append(self.parse_unary())
+        return children[0] if len(children) == 1 else ('and', tuple(children))
+    
+    def parse_unary(self):
+        if self.peek() in ('NOT', 'minus'):
+            self.take()
+            return ('not', self.parse_unary())
+        return self.parse_primary()
+    
+    def parse_primary(self):
+        if self.peek() is None:
+            operator = self.tokens[self.position - 1][1] if self.position else ''
+            raise QueryError(f"'{operator}' at the end of the query needs a term after it")
+        
+        kind, value, field, position = self.take()
+        if kind == 'open':
+            node = self.parse_or()
+            if self.peek() != 'close':
+                raise QueryError(f'Missing closing parenthesis for the one at position {position}')
+            self.take()
+            return node
+        if kind == 'close':
+            raise QueryError(f"Unexpected ')' at position {position}; "
+                             'put text with parentheses in quotes, e.g. ":)"')
+        if kind in ('AND', 'OR'):
+            raise QueryError(f"'{kind}' at position {position} needs a term on both sides")
+        
+        if field == 'date':
+            return ('date',) + parse_date(value)
+        if field:
+            return (field, value)
+        return ('text', value)
+
+def count_terms(node):
+    """Number of terms in a parsed query"""
+    if node[0] in ('and', 'or'):
+        return sum(count_terms(child) for child in node[1])
+    if node[0] == 'not':
+        return count_terms(node[1])
+    return 1
+
+def is_positive(node):
+    """Whether a query can only match lines it names, rather than everything but some"""
+    if node[0] == 'and':
+        return any(is_positive(child) for child in node[1])
+    if node[0] == 'or':
+        return all(is_positive(child) for child in node[1])
+    return node[0] != 'not'
+
+@lru_cache(maxsize=256)
+def parse_query(query):
+    """Parse a search query into a tree of tuples, raises QueryError"""
+    tokens = tokenize(query)
+    if not tokens:
+        raise QueryError('Query required')
+    
+    parser = Parser(tokens)
+    tree = parser.parse_or()
+    if parser.position < len(tokens):
+        _, value, _, position = tokens[parser.position]
+        raise QueryError(f"Unexpected '{value}' at position {position}; "
+                         'put text with parentheses in quotes, e.g. ":)"')
+    
+    if count_terms(tree) > MAX_QUERY_TERMS:
+        raise QueryError(f'Too many terms: at most {MAX_QUERY_TERMS} are allowed')
+    if not is_positive(tree):
+        raise QueryError('Add at least one term to search for; a query cannot only exclude terms')
+    return tree
+
+def selectivity(node):
+    """Sort key putting the terms that rule out the most lines first"""
+    order = {'chan': 0, 'date': 1, 'nick': 2, 'text': 3, 'and': 4, 'or': 5, 'not': 6}
+    length = len(node[1]) if node[0] == 'text' else 0
+    return order[node[0]], -length
+
+def like_pattern(text):
+    """LIKE pattern matching text anywhere, with % and _ taken literally"""
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def term_condition(kind, value, case_sensitive=False):
+    """SQL condition for one word, phrase or nick"""
+    if kind == 'nick':
+        # "[12:00:00] <nick> text" and "[12:00:00] * nick action"
+        nick = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return ("(le.content LIKE ? ESCAPE '\\' OR le.content LIKE ? ESCAPE '\\')",
+                [f'[%] <{nick}> %', f'[%] * {nick} %'])
+    if case_sensitive:
+        # LIKE ignores the case of ASCII letters, which the highlights would not
+        return 'instr(le.content, ?) > 0', [value]
+    return "LOWER(le.content) LIKE LOWER(?) ESCAPE '\\'", [like_pattern(value)]
+
+def compile_query(node, case_sensitive=False, expansions=None):
+    """
+    SQL condition on log_entries le for a parsed query, returns (sql, params).
+    
+    expansions ({term: [(variant, distance)]}, from fuzzy.expand_query())
+    makes each word or nick match any of its variants.
+    """
+    kind = node[0]
+    if kind in ('and', 'or'):
+        children = sorted(node[1], key=selectivity) if kind == 'and' else node[1]
+        parts = [compile_query(child, case_sensitive, expansions) for child in children]
+        sql = f' {kind.upper()} '.join(part for part, _ in parts)
+        return f'({sql})', [param for _, params in parts for param in params]
+    if kind == 'not':
+        sql, params = compile_query(node[1], case_sensitive, expansions)
+        return f'NOT {sql}', params
+    if kind == 'chan':
+        return 'le.channel_name = ?', [node[1]]
+    if kind == 'date':
+        if node[1] == node[2]:
+            return 'le.log_date = ?', [node[1]]
+        return 'le.log_date BETWEEN ? AND ?', [node[1], node[2]]
+    
+    variants = (expansions or {}).get(node[1].lower())
+    if variants and len(variants) > 1:
+        # Variants are lower case, so they always match case-insensitively
+        parts = [term_condition(kind, variant) for variant, _ in variants]
+        sql = ' OR '.join(part for part, _ in parts)
+        return f'({sql})', [param for _, params in parts for param in params]
+    return term_condition(kind, node[1], case_sensitive)
+
+def compile_rank(node, expansions):
+    """
+    SQL expression for how far a matching line is from the query, returns
+    (sql, params): the sum of the edit distance of the closest variant found
+    of every expanded word and nick the line must contain.
+    """
+    cases = []
+    params = []
+    
+    def visit(node):
+        if node[0] in ('and', 'or'):
+            for child in node[1]:
+                visit(child)
+        elif node[0] in ('text', 'nick'):
+            variants = expansions.get(node[1].lower())
+            if not variants or len(variants) == 1:
+                return
+            whens = []
+            for variant, distance in variants:
+                sql, variant_params = term_condition(node[0], variant)
+                whens.append(f'WHEN {sql} THEN {distance}')
+                params.extend(variant_params)
+            cases.append(f"(CASE {' '.join(whens)} ELSE 0 END)")
+    
+    visit(node)
+    return ' + '.join(cases) or '0', params
+
+def query_scope(node):
+    """
+    What every match of a parsed query has in common.
+    
+    Returns a dict: 'channel' (the channel of a top-level chan: term, or
+    None), 'start_date' and 'end_date' (the narrowest top-level date: range,
+    or None) and 'term_length' (length of the longest word or phrase every
+    match contains, 0 if none).
+    """
+    scope = {'channel': None, 'start_date': None, 'end_date': None, 'term_length': 0}
+    for child in node[1] if node[0] == 'and' else [node]:
+        if child[0] == 'chan' and scope['channel'] is None:
+            scope['channel'] = child[1]
+        elif child[0] == 'date':
+            scope['start_date'] = max(filter(None, (scope['start_date'], child[1])))
+            scope['end_date'] = min(filter(None, (scope['end_date'], child[2])))
+        elif child[0] == 'text':
+            scope['term_length'] = max(scope['term_length'], len(child[1]))
+    return scope
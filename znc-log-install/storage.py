@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Shared database access for the ZNC log search tools
+
+Every script opens the encrypted database through get_db() here, so the
+path, key, connection tuning and schema live in one place. Connections are
+tuned with a named pragma profile matching how they are used:
+
+    web-read      Short-lived connections serving one web request
+    bulk-import   Long-running import workers writing many rows
+    maintenance   db_utils.py and user_admin.py commands
+
+'db_utils.py bench --profiles' measures what each profile gains over an
+untuned connection.
+
+With a passphrase as DB_KEY, SQLCipher derives the encryption key with
+256,000 PBKDF2 rounds on every new connection. A raw 256-bit key skips that:
+either from DB_KEY_FILE (written by 'db_utils.py rekey'), or derived from
+DB_KEY once per process with DERIVE_KEY_ONCE.
+
+Imports and prunes bump a generation counter in a small file next to the
+database. The web app compares it with what a browser already has, so
+unchanged statistics and network lists are answered without opening the
+database.
+"""
+
+import os
+import re
+import fcntl
+import hashlib
+import threading
+from pysqlcipher3 import dbapi2 as sqlite
+
+# Configuration - used by app.py, import_logs.py, db_utils.py, user_admin.py
+# and migrate_add_users.py
+DB_PATH = '/path/to/znc_search/znc_logs.db'
+DB_KEY = 'secret_key'
+
+# Raw key (OPTIONAL). Path of a file holding the database key as 64 hex
+# digits; when set, DB_KEY is not used.
+DB_KEY_FILE = ''
+
+# Derive the raw key from DB_KEY once per process and reuse it for every
+# connection, instead of SQLCipher deriving it again on each connect
+DERIVE_KEY_ONCE = False
+
+# Generation file (OPTIONAL). Defaults to DB_PATH + '.generation'; must be
+# writable by the importer and readable by the web app.
+GENERATION_FILE = ''
+
+# SQLCipher 4 key derivation (cipher_compatibility = 4)
+KDF_ITERATIONS = 256000
+KDF_SALT_SIZE = 16
+
+# Pragmas applied to every new connection, per profile. cache_size is in KiB
+# when negative. SQLCipher never memory-maps encrypted pages, so mmap_size
+# would have no effect and is not set.
+PRAGMA_PROFILES = {
+    # A search touches index and table pages of one network for a few
+    # seconds at most; sorting the results happens in memory, and a running
+    # import makes readers wait instead of failing
+    'web-read': {
+        'cache_size': -32768,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    # Index pages of log_entries stay cached across batches; workers wait
+    # for each other's write transactions instead of failing
+    'bulk-import': {
+        'cache_size': -262144,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 300000,
+    },
+    # Prune, analyze, reindex and integrity checks walk whole indexes;
+    # REINDEX and VACUUM sorts can exceed memory, so they go to disk
+    'maintenance': {
+        'cache_size': -131072,
+        'temp_store': 'FILE',
+        'busy_timeout': 60000,
+    },
+}
+
+# Raw keys already read or derived, by key file or by (passphrase, salt)
+_raw_keys = {}
+_raw_keys_lock = threading.Lock()
+
+def read_key_file(path):
+    """Read a raw key file, returns the key as 64 lowercase hex digits"""
+    with open(path, 'r', encoding='ascii') as f:
+        key = f.read().strip().lower()
+    if not re.fullmatch(r'[0-9a-f]{64}', key):
+        raise ValueError(f"{path} does not contain a 256-bit key (64 hex digits)")
+    return key
+
+def derive_raw_key(passphrase, path):
+    """Derive the raw key SQLCipher uses for a passphrase and database file, None for a new file"""
+    try:
+        with open(path, 'rb') as f:
+            salt = f.read(KDF_SALT_SIZE)
+    except OSError:
+        return None
+    if len(salt) < KDF_SALT_SIZE:
+        return None
+    
+    with _raw_keys_lock:
+        key = _raw_keys.get((passphrase, salt))
+        if key is None:
+            key = hashlib.pbkdf2_hmac('sha512', passphrase.encode(), salt, KDF_ITERATIONS, 32).hex()
+            _raw_keys[(passphrase, salt)] = key
+    return key
+
+def key_pragma(path=None, raw_key=None):
+    """PRAGMA key statement for a database: raw_key, DB_KEY_FILE, or DB_KEY"""
+    if raw_key is None and DB_KEY_FILE:
+        with _raw_keys_lock:
+            raw_key = _raw_keys.get(DB_KEY_FILE)
+            if raw_key is None:
+                raw_key = _raw_keys[DB_KEY_FILE] = read_key_file(DB_KEY_FILE)
+    if raw_key is None and DERIVE_KEY_ONCE:
+        # A file that does not exist yet gets a new salt, so its key can only
+        # be derived once SQLCipher has created it
+        raw_key = derive_raw_key(DB_KEY, path or DB_PATH)
+    
+    if raw_key:
+        return f"PRAGMA key = \"x'{raw_key}'\""
+    return f"PRAGMA key = '{DB_KEY}'"
+
+def connection_pragmas(profile, path=None, raw_key=None):
+    """Statements run on every new connection: the key, then the profile (None for untuned)"""
+    pragmas = [key_pragma(path, raw_key), "PRAGMA cipher_compatibility = 4"]
+    if profile:
+        pragmas += [f'PRAGMA {name} = {value}' for name, value in PRAGMA_PROFILES[profile].items()]
+    return pragmas
+
+def get_db(profile='web-read', path=None, raw_key=None):
+    """Open an encrypted connection tuned with one of PRAGMA_PROFILES"""
+    conn = sqlite.connect(path or DB_PATH)
+    for pragma in connection_pragmas(profile, path, raw_key):
+        conn.execute(pragma)
+    return conn
+
+def generation_path():
+    """Path of the generation file"""
+    return GENERATION_FILE or DB_PATH + '.generation'
+
+def read_generation():
+    """(generation, modification time) of the logs; (0, None) before the first bump, None if unreadable"""
+    try:
+        with open(generation_path(), 'r', encoding='ascii') as f:
+            generation = int(f.read())
+            return generation, os.fstat(f.fileno()).st_mtime
+    except FileNotFoundError:
+        return 0, None
+    except (OSError, ValueError):
+        return None
+
+def bump_generation():
+    """Record that log lines were added or removed, returns the new generation"""
+    fd = os.open(generation_path(), os.O_RDWR | os.O_CREAT, 0o644)
+    with open(fd, 'r+', encoding='ascii') as f:
+        # Concurrent imports and prunes must not both write the same number
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            generation = int(f.read()) + 1
+        except ValueError:
+            generation = 1
+        # The number only grows, so a reader never sees a shorter, half-written one
+        f.seek(0)
+        f.write(str(generation))
+        f.truncate()
+    return generation
+
+def init_db(conn):
+    """Create or upgrade the schema; safe to run on every start"""
+    cursor = conn.cursor()
+    
+    # Must be set before the first table is created; lets db_utils.py
+    # prune/vacuum return free pages a few at a time
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
+    # Create tables
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS networks (
+            id TEXT PRIMARY KEY,
+            display_name TEXT NOT NULL
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            network_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            FOREIGN KEY (network_id) REFERENCES networks(id),
+            UNIQUE(network_id, name)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS log_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            network_id TEXT NOT NULL,
+            channel_name TEXT NOT NULL,
+            log_date DATE NOT NULL,
+            line_number INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            znc_user TEXT NOT NULL DEFAULT '',
+            FOREIGN KEY (network_id) REFERENCES networks(id)
+        )
+    ''')
+    
+    # Make sure log_entries from before multi-user imports can be scoped by ZNC user
+    cursor.execute('PRAGMA table_info(log_entries)')
+    if 'znc_user' not in [row[1] for row in cursor.fetchall()]:
+        print("Adding znc_user column to log_entries...")
+        cursor.execute("ALTER TABLE log_entries ADD COLUMN znc_user TEXT NOT NULL DEFAULT ''")
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS znc_users (
+            name TEXT PRIMARY KEY
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            totp_secret TEXT,
+            totp_enabled INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create import tracking table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    
+    # Vocabulary of the logs for fuzzy search, filled by db_utils.py build-terms
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS term_dictionary (
+            term TEXT PRIMARY KEY,
+            frequency INTEGER NOT NULL,
+            indexed INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS term_deletes (
+            variant TEXT NOT NULL,
+            term TEXT NOT NULL,
+            PRIMARY KEY (variant, term)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Create indexes for efficient searching
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_log_network
+        ON log_entries(network_id)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_log_channel
+        ON log_entries(channel_name)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_log_date
+        ON log_entries(log_date)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_log_content
+        ON log_entries(content)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_log_composite
+        ON log_entries(network_id, channel_name, log_date)
+    ''')
+    
+    conn.commit()
@@ -24,20 +24,15 @@ import getpass
 from datetime import datetime
 from pysqlcipher3 import dbapi2 as sqlite
 
-# Configuration - should match app.py
-DB_PATH = '/path/to/znc_search/znc_logs.db'
-DB_KEY = 'secret_key'  # Must match app.py
+import storage  # Database path and encryption key
 
 def get_db():
     """Get database connection with encryption"""
-    if not os.path.exists(DB_PATH):
-        print(f"Error: Database not found: {DB_PATH}")
+    if not os.path.exists(storage.DB_PATH):
+        print(f"Error: Database not found: {storage.DB_PATH}")
         sys.exit(1)
     
-    conn = sqlite.connect(DB_PATH)
-    conn.execute(f"PRAGMA key = '{DB_KEY}'")
-    conn.execute("PRAGMA cipher_compatibility = 4")
-    return conn
+    return storage.get_db('maintenance')
 
 def hash_password(password):
     """Hash password using SHA256"""